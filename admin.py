@@ -6,9 +6,9 @@ import argparse
 import getpass
 import json
 import time
-import random
 import textwrap
 import httpx
+from transport import AsyncTransport, CircuitOpenError, RetryPolicy, accept_encoding, latency_lines, traffic_lines
 from typing import Optional
 
 class C:
@@ -43,58 +43,39 @@ class HTTPXAdminClient:
         self.backoff = float(backoff)
         self.token: Optional[str] = None
         self.username: Optional[str] = None
-        self._client: Optional[httpx.AsyncClient] = None
-
-    def _url(self, path: str) -> str:
-        return self.base_url + path
-
-    async def _client_ctx(self):
-        if self._client is None:
-            self._client = httpx.AsyncClient(timeout=self.timeout)
-        return self._client
-
-    async def _request(self, path: str, method: str = "POST", json_payload: dict | None = None, params: dict | None = None):
-        async def do_once():
-            client = await self._client_ctx()
-            headers = {}
-            if self.token:
-                headers["Authorization"] = f"Bearer {self.token}"
-            try:
-                if method.upper() == "POST":
-                    r = await client.post(self._url(path), json=json_payload or {}, headers=headers)
-                else:
-                    r = await client.get(self._url(path), params=params or {}, headers=headers)
-            except httpx.RequestError as e:
-                raise APIError(f"request error: {e}") from e
-            try:
-                data = r.json()
-            except Exception:
-                raise APIError(f"invalid json from server (status {r.status_code})")
-            if r.status_code >= 400:
-                raise APIError({"status": r.status_code, "body": data})
-            if isinstance(data, dict) and data.get("ok") is False:
-                raise APIError(data)
-            return data
-
-        last_exc = None
-        for attempt in range(self.retries):
-            try:
-                return await do_once()
-            except APIError as e:
-                last_exc = e
-                if attempt + 1 >= self.retries:
-                    raise
-                await asyncio.sleep(self.backoff * (2 ** attempt) + random.random() * 0.1)
-        raise last_exc
+        self.transport = AsyncTransport(self.base_url, timeout=timeout,
+                                        retry=RetryPolicy(attempts=self.retries, backoff=self.backoff))
+
+    async def _request(self, path: str, method: str = "POST", json_payload: dict | None = None,
+                       params: dict | None = None, idempotent: bool | None = None):
+        # retries happen in the transport, and only for failures that are safe to repeat
+        headers = {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = (json_payload or {}) if method.upper() == "POST" else None
+        try:
+            r = await self.transport.request(method, path, payload, headers=headers, params=params,
+                                             idempotent=idempotent)
+        except CircuitOpenError as e:
+            raise APIError(f"server unavailable, not retrying for {e.retry_in:.0f}s") from e
+        except httpx.RequestError as e:
+            raise APIError(f"request error: {e}") from e
+        try:
+            data = r.json()
+        except Exception:
+            raise APIError(f"invalid json from server (status {r.status_code})")
+        if r.status_code >= 400:
+            raise APIError({"status": r.status_code, "body": data})
+        if isinstance(data, dict) and data.get("ok") is False:
+            raise APIError(data)
+        return data
 
     async def close(self):
-        if self._client:
-            await self._client.aclose()
-            self._client = None
+        await self.transport.aclose()
 
     async def login(self, username: str, password: str):
         payload = {"username": username, "password": password}
-        resp = await self._request("/login", "POST", json_payload=payload)
+        resp = await self._request("/login", "POST", json_payload=payload, idempotent=True)
         token = resp.get("token")
         role = resp.get("role")
         if not token:
@@ -106,11 +87,11 @@ class HTTPXAdminClient:
     # existing admin ops
     async def ban_user(self, target: str):
         payload = {"username": target}
-        return await self._request("/admin/ban", "POST", json_payload=payload)
+        return await self._request("/admin/ban", "POST", json_payload=payload, idempotent=True)
 
     async def unban_user(self, target: str):
         payload = {"username": target}
-        return await self._request("/admin/unban", "POST", json_payload=payload)
+        return await self._request("/admin/unban", "POST", json_payload=payload, idempotent=True)
 
     async def delete_user(self, target: str):
         payload = {"username": target}
@@ -127,7 +108,7 @@ class HTTPXAdminClient:
 
     async def change_user_password(self, target: str, new_password: str):
         payload = {"username": target, "new_password": new_password}
-        return await self._request("/admin/change_user_password", "POST", json_payload=payload)
+        return await self._request("/admin/change_user_password", "POST", json_payload=payload, idempotent=True)
 
     async def change_user_username(self, old_username: str, new_username: str):
         payload = {"username": old_username, "new_username": new_username}
@@ -161,6 +142,8 @@ class AdminCLI:
         self.registry.register("setpass", "Reset a user's password", self.cmd_setpass)
         self.registry.register("rename", "Rename a user", self.cmd_rename)
         self.registry.register("broadcast", "Broadcast message to all users", self.cmd_broadcast)
+        self.registry.register("traffic", "Show bytes sent/received per endpoint", self.cmd_traffic)
+        self.registry.register("stats", "Show latency percentiles, retries and errors per endpoint", self.cmd_stats)
         self.registry.register("exit", "Exit CLI", self.cmd_exit)
 
     async def run(self):
@@ -369,6 +352,30 @@ class AdminCLI:
         prin("Broadcast sent", C.GREEN)
         prin(json.dumps(resp, indent=2, ensure_ascii=False), C.CYAN)
 
+    async def cmd_traffic(self, args: list[str]):
+        """Raw vs. on-the-wire bytes per endpoint for this session."""
+        prin(f"Accept-Encoding: {accept_encoding()}", C.BLUE)
+        gz = self.client.transport.caps.get("request_gzip")
+        prin(f"Compressed uploads: {'unknown yet' if gz is None else ('yes' if gz else 'not supported by server')}", C.BLUE)
+        prin(f"Circuit breaker: {self.client.transport.breaker.state}", C.BLUE)
+        stats = self.client.transport.stats.snapshot()
+        if not stats:
+            prin("No requests yet", C.YELLOW)
+            return
+        for i, line in enumerate(traffic_lines(stats, width=28)):
+            prin(line, C.BOLD if i == 0 else C.CYAN)
+
+    async def cmd_stats(self, args: list[str]):
+        """Client-side latency per endpoint; TOTAL includes retries/backoff, SERVER is the last attempt."""
+        stats = self.client.transport.stats.snapshot()
+        if not stats:
+            prin("No requests yet", C.YELLOW)
+            return
+        for i, line in enumerate(latency_lines(stats, width=28)):
+            prin(line, C.BOLD if i == 0 else C.CYAN)
+        if args and args[0] == "--json":
+            print(json.dumps(stats, indent=2))
+
     async def cmd_exit(self, args: list[str]):
         prin("Bye", C.GREEN)
         await self.client.close()
@@ -380,6 +387,7 @@ async def main_async(argv):
     p.add_argument("--timeout", "-t", type=int, default=8)
     p.add_argument("--retries", "-r", type=int, default=4)
     p.add_argument("--backoff", "-b", type=float, default=0.4)
+    p.add_argument("--stats-file", help="write per-endpoint request stats as JSON on exit")
     args = p.parse_args(argv[1:])
     client = HTTPXAdminClient(base_url=args.server, timeout=args.timeout, retries=args.retries, backoff=args.backoff)
     cli = AdminCLI(client)
@@ -389,6 +397,11 @@ async def main_async(argv):
         prin("\nInterrupted", C.YELLOW)
     finally:
         await client.close()
+        if args.stats_file:
+            try:
+                client.transport.stats.dump(args.stats_file)
+            except OSError as e:
+                prin(f"could not write stats: {e}", C.RED)
 
 def main():
     asyncio.run(main_async(sys.argv))
@@ -8,20 +8,27 @@ import time
 import textwrap
 import sys
 import re
-import httpx
+import shutil
+import codecs
+import random
+import atexit
+import sqlite3
+import hashlib
+import threading
+import importlib.util
+from urllib.parse import urlsplit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from transport import (AsyncTransport, CircuitBreaker, CircuitOpenError, EndpointStats, RetryPolicy, Transport,
+                       accept_encoding, fmt_bytes, latency_lines, new_idempotency_key, parse_retry_after,
+                       traffic_lines)
 import colorama
 import socket
 from colorama import Fore, Style as CStyle
-from prompt_toolkit import Application
-from prompt_toolkit.layout import Layout, HSplit
-from prompt_toolkit.widgets import TextArea
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.styles import Style as PTStyle
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 CONFIG_DIR = os.path.join(BASE_DIR, "app_config_data")
-os.makedirs(CONFIG_DIR, exist_ok=True)
 
 CONFIG_FILE = os.path.join(CONFIG_DIR, "client_config.json")
 CLIENT_VERSION = "v.1.0.2-stable"
@@ -33,8 +40,37 @@ DEFAULT_SERVER = f"http://{DEFAULT_SERVER_HOST}:{DEFAULT_SERVER_PORT}"
 TIMEOUT = 6 
 PAGE_SIZE = 12
 
-# init Colorama
-colorama.init(autoreset=True)
+# connection pool defaults (overridable in client_config.json)
+POOL_MAX_CONNECTIONS = 10
+POOL_MAX_KEEPALIVE = 5
+KEEPALIVE_EXPIRY = 30
+ASYNC_CONCURRENCY = 8
+BULK_CONCURRENCY = 6
+OUTBOX_MAX_ATTEMPTS = 12
+OUTBOX_MAX_BACKOFF = 300
+BODY_CACHE_BYTES = 8 * 1024 * 1024
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.3
+RETRY_MAX_BACKOFF = 3
+RETRY_MAX_WAIT = 5
+BREAKER_THRESHOLD = 4
+BREAKER_COOLDOWN = 10
+
+MAIL_FOLDERS = ("inbox", "sent", "deleted", "spam")
+STORE_FILE = os.path.join(CONFIG_DIR, "mail_store.sqlite3")
+SYNC_PAGE_SIZE = 100
+PAGE_CACHE_SIZE = 32
+ETAG_CACHE_SIZE = 64
+ATTACHMENT_CHUNK = 256 * 1024
+DOWNLOAD_DIR = os.path.join(CONFIG_DIR, "downloads")
+HEALTH_INTERVAL = 15
+HEALTH_TTL = 45
+WATCH_HOLD = 25
+WATCH_POLL_MIN = 20
+WATCH_POLL_MAX = 300
+EXPORT_PAGE_SIZE = 500
+EXPORT_CONCURRENCY = 4
+IMPORT_BATCH = 200
 
 class C:
     HEADER = Fore.MAGENTA
@@ -49,8 +85,13 @@ class C:
 def color(msg, col=C.END):
     return f"{col}{msg}{C.END}"
 
-def printc(msg, col=C.END):
-    print(color(msg, col))
+def printc(msg, col=C.END, out=None):
+    # out: a list collecting the lines of a frame for SCREEN.render instead of printing now
+    if out is not None:
+        # one entry per screen row, each carrying its own color
+        out.extend(color(part, col) for part in str(msg).split("\n"))
+    else:
+        print(color(msg, col))
 
 def pause(msg="Press enter to continue..."):
     try:
@@ -79,8 +120,406 @@ def save_config():
     except Exception as e:
         printc(f"Failed to save config: {e}", C.RED)
 
-load_config()
-SERVER_URL = CONFIG.get("server_url", DEFAULT_SERVER)
+SERVER_URL = DEFAULT_SERVER
+
+def page_size():
+    return max(1, int(CONFIG.get("page_size", PAGE_SIZE)))
+
+def server_url():
+    return (CONFIG.get("server_url") or SERVER_URL or DEFAULT_SERVER).rstrip("/")
+
+# ---------- HTTP session ----------
+def pool_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=int(CONFIG.get("pool_max_connections", POOL_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(CONFIG.get("pool_max_keepalive", POOL_MAX_KEEPALIVE)),
+        keepalive_expiry=float(CONFIG.get("keepalive_expiry", KEEPALIVE_EXPIRY)),
+    )
+
+def use_http2():
+    # http2 needs the optional h2 package
+    return bool(CONFIG.get("http2")) and importlib.util.find_spec("h2") is not None
+
+def retry_policy():
+    # keep interactive waits short: a long Retry-After is reported instead of slept through
+    return RetryPolicy(attempts=int(CONFIG.get("retries", RETRY_ATTEMPTS)), backoff=RETRY_BACKOFF,
+                       max_backoff=RETRY_MAX_BACKOFF, max_retry_after=RETRY_MAX_WAIT)
+
+def transport_options():
+    return dict(timeout=TIMEOUT, limits=pool_limits(), http2=use_http2(), retry=retry_policy(),
+                breaker=BREAKER, stats=NET_STATS, caps=SERVER_CAPS,
+                compress=bool(CONFIG.get("compress_requests", True)))
+
+# what the server turned out to support; None until we know
+SERVER_CAPS = {"headers_only": None, "request_gzip": None, "delta_sync": None, "bulk_import": None,
+               "cursor_paging": None, "body_endpoint": None}
+NET_STATS = EndpointStats()
+# shared by the sync and async transports so either one notices an outage for both
+BREAKER = CircuitBreaker(threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN)
+
+class HTTPSession:
+    # one long-lived pooled transport, rebuilt only when the server url changes
+    def __init__(self, breaker=None):
+        self.breaker = breaker  # None: the shared BREAKER
+        self._transport = None
+        self._base_url = None
+        self._lock = threading.Lock()
+
+    def transport(self):
+        base_url = server_url()
+        with self._lock:
+            if self._transport is None or self._base_url != base_url:
+                if self._transport is not None:
+                    self._transport.close()
+                options = transport_options()
+                if self.breaker is not None:
+                    options["breaker"] = self.breaker
+                self._transport = Transport(base_url, **options)
+                self._base_url = base_url
+            return self._transport
+
+    def close(self):
+        with self._lock:
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+                self._base_url = None
+
+SESSION = HTTPSession()
+atexit.register(SESSION.close)
+# the /watch long-poll has its own connection and breaker: a hold that ends in a dropped
+# connection must not open the circuit for every other request
+WATCH_SESSION = HTTPSession(CircuitBreaker(threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN))
+atexit.register(WATCH_SESSION.close)
+
+# ---------- local mail store ----------
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mails (
+    account   TEXT NOT NULL,
+    folder    TEXT NOT NULL,
+    mail_id   TEXT NOT NULL,
+    timestamp REAL NOT NULL DEFAULT 0,
+    sender    TEXT NOT NULL DEFAULT '',
+    subject   TEXT NOT NULL DEFAULT '',
+    message   TEXT NOT NULL DEFAULT '',
+    data      TEXT NOT NULL,
+    UNIQUE (account, folder, mail_id)
+);
+CREATE INDEX IF NOT EXISTS mails_by_folder ON mails (account, folder, timestamp DESC, mail_id DESC);
+CREATE TABLE IF NOT EXISTS sync_state (
+    account   TEXT NOT NULL,
+    folder    TEXT NOT NULL,
+    newest_ts REAL NOT NULL DEFAULT 0,
+    newest_id TEXT,
+    complete  INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL NOT NULL DEFAULT 0,
+    cursor    TEXT,
+    PRIMARY KEY (account, folder)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    key        TEXT PRIMARY KEY,
+    account    TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    status     TEXT NOT NULL DEFAULT 'pending',
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    next_try   REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    mail_id    TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_try);
+"""
+
+# external-content full-text index over the mails table, kept in step by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS mails_fts USING fts5 (
+    subject, sender, message,
+    content='mails', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS mails_fts_ai AFTER INSERT ON mails BEGIN
+    INSERT INTO mails_fts (rowid, subject, sender, message)
+    VALUES (new.rowid, new.subject, new.sender, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS mails_fts_ad AFTER DELETE ON mails BEGIN
+    INSERT INTO mails_fts (mails_fts, rowid, subject, sender, message)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.message);
+END;
+CREATE TRIGGER IF NOT EXISTS mails_fts_au AFTER UPDATE OF subject, sender, message ON mails BEGIN
+    INSERT INTO mails_fts (mails_fts, rowid, subject, sender, message)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.message);
+    INSERT INTO mails_fts (rowid, subject, sender, message)
+    VALUES (new.rowid, new.subject, new.sender, new.message);
+END;
+"""
+
+def fts_query(query):
+    # every word must match, the last one as a prefix so partial words still hit
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+class MailStore:
+    # on-disk copy of the synced folders, one row per (account, folder, mail)
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.RLock()
+        self.fts = False
+
+    def db(self):
+        with self._lock:
+            if self._db is None:
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(STORE_SCHEMA)
+                self._migrate(db)
+                self.fts = self._init_fts(db)
+                self._db = db
+            return self._db
+
+    def _migrate(self, db):
+        # columns added after the first release; CREATE TABLE IF NOT EXISTS leaves old tables alone
+        cols = {row[1] for row in db.execute("PRAGMA table_info(sync_state)")}
+        if "cursor" not in cols:
+            with db:
+                db.execute("ALTER TABLE sync_state ADD COLUMN cursor TEXT")
+
+    def _init_fts(self, db):
+        try:
+            fresh = db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='mails_fts'"
+            ).fetchone() is None
+            db.executescript(FTS_SCHEMA)
+            if fresh:
+                # index mails synced before the index existed
+                with db:
+                    db.execute("INSERT INTO mails_fts (mails_fts) VALUES ('rebuild')")
+            return True
+        except sqlite3.Error:
+            # sqlite built without fts5: searches go to the server
+            return False
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def upsert(self, account, folder, mails):
+        rows = []
+        for m in mails:
+            if m.id is None:
+                continue
+            rows.append((
+                account, folder, m.key, m.timestamp, m.sender, m.subject,
+                m.message or "", json.dumps(m.to_json()),
+            ))
+        if not rows:
+            return 0
+        with self._lock:
+            db = self.db()
+            with db:
+                db.executemany(
+                    "INSERT INTO mails (account, folder, mail_id, timestamp, sender, subject, message, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (account, folder, mail_id) DO UPDATE SET "
+                    "timestamp=excluded.timestamp, sender=excluded.sender, subject=excluded.subject, "
+                    "message=excluded.message, data=excluded.data",
+                    rows,
+                )
+        return len(rows)
+
+    def remove(self, account, folder, mail_ids):
+        with self._lock:
+            db = self.db()
+            with db:
+                db.executemany(
+                    "DELETE FROM mails WHERE account=? AND folder=? AND mail_id=?",
+                    [(account, folder, str(mid)) for mid in mail_ids],
+                )
+
+    def move(self, account, mail_id, src, dst):
+        # only a completely synced destination takes the row: anywhere else it could land
+        # outside the synced prefix, so it is just dropped from the source
+        with self._lock:
+            db = self.db()
+            with db:
+                row = db.execute(
+                    "SELECT complete FROM sync_state WHERE account=? AND folder=?", (account, dst),
+                ).fetchone()
+                if not (row and row[0]):
+                    db.execute(
+                        "DELETE FROM mails WHERE account=? AND folder=? AND mail_id=?",
+                        (account, src, str(mail_id)),
+                    )
+                    return
+                db.execute(
+                    "DELETE FROM mails WHERE account=? AND folder=? AND mail_id=?",
+                    (account, dst, str(mail_id)),
+                )
+                db.execute(
+                    "UPDATE mails SET folder=? WHERE account=? AND folder=? AND mail_id=?",
+                    (dst, account, src, str(mail_id)),
+                )
+
+    def page(self, account, folder, offset, limit):
+        with self._lock:
+            cur = self.db().execute(
+                "SELECT data FROM mails WHERE account=? AND folder=? "
+                "ORDER BY timestamp DESC, mail_id DESC LIMIT ? OFFSET ?",
+                (account, folder, limit, offset),
+            )
+            rows = cur.fetchall()
+        return [Mail.from_json(json.loads(row[0]), folder) for row in rows]
+
+    def get(self, account, folder, mail_id):
+        with self._lock:
+            row = self.db().execute(
+                "SELECT data FROM mails WHERE account=? AND folder=? AND mail_id=?",
+                (account, folder, str(mail_id)),
+            ).fetchone()
+        return Mail.from_json(json.loads(row[0]), folder) if row else None
+
+    def count(self, account, folder):
+        with self._lock:
+            cur = self.db().execute(
+                "SELECT COUNT(*) FROM mails WHERE account=? AND folder=?", (account, folder)
+            )
+            return cur.fetchone()[0]
+
+    def count_since(self, account, folder, timestamp):
+        with self._lock:
+            cur = self.db().execute(
+                "SELECT COUNT(*) FROM mails WHERE account=? AND folder=? AND timestamp > ?",
+                (account, folder, timestamp),
+            )
+            return cur.fetchone()[0]
+
+    def state(self, account, folder):
+        with self._lock:
+            cur = self.db().execute(
+                "SELECT newest_ts, newest_id, complete, synced_at, cursor FROM sync_state "
+                "WHERE account=? AND folder=?",
+                (account, folder),
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return {"newest_ts": row[0], "newest_id": row[1], "complete": bool(row[2]), "synced_at": row[3],
+                "cursor": json.loads(row[4]) if row[4] is not None else None}
+
+    def set_state(self, account, folder, newest_ts, newest_id, complete, cursor=None):
+        # cursor: the server's change-feed position this copy is current to, if it has one
+        with self._lock:
+            db = self.db()
+            with db:
+                db.execute(
+                    "INSERT INTO sync_state (account, folder, newest_ts, newest_id, complete, synced_at, cursor) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (account, folder) DO UPDATE SET newest_ts=excluded.newest_ts, "
+                    "newest_id=excluded.newest_id, complete=excluded.complete, synced_at=excluded.synced_at, "
+                    "cursor=excluded.cursor",
+                    (account, folder, newest_ts, newest_id, int(complete), time.time(),
+                     json.dumps(cursor) if cursor is not None else None),
+                )
+
+    def clear(self, account, folder):
+        with self._lock:
+            db = self.db()
+            with db:
+                db.execute("DELETE FROM mails WHERE account=? AND folder=?", (account, folder))
+                db.execute("DELETE FROM sync_state WHERE account=? AND folder=?", (account, folder))
+
+    def covers(self, account, folder, offset, limit):
+        # synced rows form a contiguous run from the newest mail downwards
+        st = self.state(account, folder)
+        if st is None:
+            return False
+        if st["complete"]:
+            return True
+        return self.count(account, folder) >= offset + limit
+
+    def search_ready(self, account, folder):
+        self.db()
+        st = self.state(account, folder)
+        return self.fts and st is not None and st["complete"]
+
+    def search(self, account, query, folders, limit=50):
+        match = fts_query(query)
+        if not match or not folders:
+            return []
+        marks = ", ".join("?" for _ in folders)
+        with self._lock:
+            cur = self.db().execute(
+                "SELECT m.data, m.folder, snippet(mails_fts, -1, '[', ']', '...', 12) "
+                "FROM mails_fts JOIN mails m ON m.rowid = mails_fts.rowid "
+                f"WHERE mails_fts MATCH ? AND m.account = ? AND m.folder IN ({marks}) "
+                "ORDER BY bm25(mails_fts, 5.0, 3.0, 1.0) LIMIT ?",
+                (match, account, *folders, limit),
+            )
+            rows = cur.fetchall()
+        results = []
+        for data, folder, snippet in rows:
+            m = Mail.from_json(json.loads(data), folder)
+            m.snippet = snippet
+            results.append(m)
+        return results
+
+    # outbox rows: pending -> sent, or failed once the server rejects them / retries run out
+    def outbox_add(self, account, key, payload):
+        with self._lock:
+            db = self.db()
+            with db:
+                db.execute(
+                    "INSERT INTO outbox (key, account, payload, created_at) VALUES (?, ?, ?, ?)",
+                    (key, account, json.dumps(payload), time.time()),
+                )
+
+    def outbox_list(self, account, statuses=("pending", "failed")):
+        marks = ", ".join("?" for _ in statuses)
+        with self._lock:
+            cur = self.db().execute(
+                "SELECT key, payload, status, attempts, next_try, last_error, mail_id FROM outbox "
+                f"WHERE account=? AND status IN ({marks}) ORDER BY created_at",
+                (account, *statuses),
+            )
+            rows = cur.fetchall()
+        keys = ("key", "payload", "status", "attempts", "next_try", "last_error", "mail_id")
+        items = [dict(zip(keys, row)) for row in rows]
+        for item in items:
+            item["payload"] = json.loads(item["payload"])
+        return items
+
+    def outbox_get(self, account, key):
+        items = [it for it in self.outbox_list(account, ("pending", "failed", "sent")) if it["key"] == key]
+        return items[0] if items else None
+
+    def outbox_update(self, key, **fields):
+        cols = ", ".join(f"{k}=?" for k in fields)
+        with self._lock:
+            db = self.db()
+            with db:
+                db.execute(f"UPDATE outbox SET {cols} WHERE key=?", (*fields.values(), key))
+
+    def outbox_counts(self, account):
+        with self._lock:
+            cur = self.db().execute(
+                "SELECT status, COUNT(*) FROM outbox WHERE account=? GROUP BY status", (account,)
+            )
+            return dict(cur.fetchall())
+
+    def outbox_purge(self, account, status):
+        with self._lock:
+            db = self.db()
+            with db:
+                db.execute("DELETE FROM outbox WHERE account=? AND status=?", (account, status))
+
+STORE = MailStore(STORE_FILE)
+atexit.register(STORE.close)
 
 # ---------- utilities ----------
 def parse_recipient_field(s: str):
@@ -93,6 +532,103 @@ def parse_recipient_field(s: str):
         parts = [p.strip() for p in s.split()]
     parts = [p for p in parts if p]
     return parts
+
+# ---------- mail model ----------
+_MAIL_KEYS = frozenset(("id", "from", "sender", "subject", "timestamp", "to", "cc", "bcc",
+                        "message", "folder", "snippet"))
+
+def _addresses(value):
+    if not value:
+        return ()
+    if isinstance(value, (list, tuple)):
+        return tuple(sys.intern(str(v)) for v in value if v)
+    return (sys.intern(str(value)),)
+
+class Mail:
+    # parsed once at the API boundary; message is None until the body has been loaded
+    __slots__ = ("id", "sender", "subject", "timestamp", "to", "cc", "bcc",
+                 "message", "folder", "snippet", "extra", "_row")
+
+    def __init__(self, id=None, sender="", subject="", timestamp=0, to=(), cc=(), bcc=(),
+                 message=None, folder=None, snippet=None, extra=None):
+        self.id = id
+        self.sender = sender
+        self.subject = subject
+        self.timestamp = timestamp
+        self.to = to
+        self.cc = cc
+        self.bcc = bcc
+        self.message = message
+        self.folder = folder
+        self.snippet = snippet
+        self.extra = extra
+        self._row = None
+
+    @classmethod
+    def from_json(cls, d, folder=None):
+        extra = {k: v for k, v in d.items() if k not in _MAIL_KEYS} or None
+        folder = folder or d.get("folder")
+        return cls(
+            id=d.get("id"),
+            sender=sys.intern(str(d.get("from") or d.get("sender") or "")),
+            subject=d.get("subject") or "",
+            timestamp=d.get("timestamp") or 0,
+            to=_addresses(d.get("to")),
+            cc=_addresses(d.get("cc")),
+            bcc=_addresses(d.get("bcc")),
+            message=d.get("message"),
+            folder=sys.intern(folder) if folder else None,
+            snippet=d.get("snippet"),
+            extra=extra,
+        )
+
+    @classmethod
+    def from_list(cls, items, folder=None):
+        return [cls.from_json(d, folder) for d in items]
+
+    def to_json(self):
+        d = dict(self.extra) if self.extra else {}
+        d.update({
+            "id": self.id, "from": self.sender, "subject": self.subject, "timestamp": self.timestamp,
+            "to": list(self.to), "cc": list(self.cc), "bcc": list(self.bcc),
+        })
+        if self.message is not None:
+            d["message"] = self.message
+        return d
+
+    @property
+    def key(self):
+        return str(self.id)
+
+    @property
+    def attachments(self):
+        # [{"id", "filename", "size", "sha256"}]; the server lists them with the headers
+        return (self.extra or {}).get("attachments") or []
+
+    def row(self):
+        # list line, built on first render and reused afterwards
+        if self._row is None:
+            date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.timestamp))
+            self._row = f"{self.subject or '(no subject)'} | From: {self.sender or '(unknown)'} | {date}"
+        return self._row
+
+    def __repr__(self):
+        return f"Mail(id={self.id!r}, sender={self.sender!r}, subject={self.subject!r})"
+
+class MailPage(list):
+    # one page from the server; next_cursor continues right after its last mail (None on the
+    # last page, or when the server only pages by offset)
+    next_cursor = None
+
+    @classmethod
+    def from_response(cls, resp, folder):
+        page = cls(Mail.from_list(resp.get("mails", []), folder))
+        if "next_cursor" in resp:
+            SERVER_CAPS["cursor_paging"] = True
+            page.next_cursor = resp["next_cursor"]
+        elif SERVER_CAPS["cursor_paging"] is None:
+            SERVER_CAPS["cursor_paging"] = False
+        return page
     
 def ensure_logged_in():
     if CONFIG.get("token") and CONFIG.get("username"):
@@ -107,47 +643,44 @@ def require_login_flow():
     user_login()
     return ensure_logged_in()
 
-def pretty_mail_list(mails, start_index=1):
+def pretty_mail_list(mails, start_index=1, out=None):
     mapping = {}
     for i, m in enumerate(mails, start_index):
-        subj = m.get("subject") or "(no subject)"
-        sender = m.get("from") or m.get("sender") or "(unknown)"
-        ts = m.get("timestamp") or 0
-        date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
-        printc(f"[{i}] {subj} | From: {sender} | {date}", C.CYAN)
+        printc(f"[{i}] {m.row()}", C.CYAN, out)
         mapping[i] = m
     return mapping
 
-def show_mail_detail(mail):
+def show_mail_detail(mail, folder=None, offset=None):
+    if mail.message is None and folder:
+        mail = load_mail_body(mail, folder, offset)
     clear_screen()
-    printc(f"{C.BOLD}Mail ID:{C.END} {mail.get('id', '')}", C.CYAN)
-    printc(f"{C.BOLD}From:  {C.END}{mail.get('from', '')}", C.CYAN)
-
-    to = mail.get("to")
-    to_display = ", ".join(to) if isinstance(to, list) else str(to or "")
-    printc(f"{C.BOLD}To:    {C.END}{to_display}", C.CYAN)
-
-    cc = mail.get("cc") or []
-    cc_display = ", ".join(cc) if isinstance(cc, list) else str(cc)
-    printc(f"{C.BOLD}CC:    {C.END}{cc_display}", C.CYAN)
-
-    bcc = mail.get("bcc") or []
-    bcc_display = ", ".join(bcc) if isinstance(bcc, list) else str(bcc)
-    printc(f"{C.BOLD}BCC:   {C.END}{bcc_display}", C.CYAN)
-
-    subject = mail.get("subject") or ""
-    printc(f"{C.BOLD}Subject:{C.END} {subject}", C.GREEN)
+    printc(f"{C.BOLD}Mail ID:{C.END} {mail.id if mail.id is not None else ''}", C.CYAN)
+    printc(f"{C.BOLD}From:  {C.END}{mail.sender}", C.CYAN)
+    printc(f"{C.BOLD}To:    {C.END}{', '.join(mail.to)}", C.CYAN)
+    printc(f"{C.BOLD}CC:    {C.END}{', '.join(mail.cc)}", C.CYAN)
+    printc(f"{C.BOLD}BCC:   {C.END}{', '.join(mail.bcc)}", C.CYAN)
+    printc(f"{C.BOLD}Subject:{C.END} {mail.subject}", C.GREEN)
 
     printc(f"{C.BOLD}Message:{C.END}", C.YELLOW)
     
-    body = mail.get("message") or ""
-    print(body)
+    if mail.message is not None:
+        print(mail.message)
+    else:
+        printc("(message body could not be loaded)", C.YELLOW)
 
-    ts = mail.get("timestamp") or 0
-    printc(f"{C.BOLD}Timestamp:{C.END} {time.ctime(ts)}", C.BLUE)
+    printc(f"{C.BOLD}Timestamp:{C.END} {time.ctime(mail.timestamp)}", C.BLUE)
+    for i, att in enumerate(mail.attachments, 1):
+        printc(f"{C.BOLD}Attachment {i}:{C.END} {att.get('filename')} ({fmt_bytes(att.get('size') or 0)})", C.BLUE)
     printc("-" * 60, C.CYAN)
     
 def multiline_input_scrollable(existing_lines=None):
+    # prompt_toolkit is only needed here; importing it costs more than the rest of startup
+    from prompt_toolkit import Application
+    from prompt_toolkit.layout import Layout, HSplit
+    from prompt_toolkit.widgets import TextArea
+    from prompt_toolkit.key_binding import KeyBindings
+    from prompt_toolkit.styles import Style as PTStyle
+
     if existing_lines is None:
         text = ""
     else:
@@ -251,30 +784,356 @@ def user_logout():
     pause()
 
 # ---------- Mail operations ----------
-def send_request(endpoint, payload):
+def auth_headers():
+    token = CONFIG.get("token")
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+# reads and set-style updates: repeating them cannot do anything twice
+IDEMPOTENT_ENDPOINTS = {"/login", "/fetch_mail", "/fetch_mail_body", "/search_mail",
+                        "/add_sender_to_spam", "/delete_sender_from_spam", "/upload_init", "/upload_complete"}
+
+def _reply_error(r):
+    # the "error" of a JSON error reply, None for anything else (an HTML error page, say)
     try:
-        token = CONFIG.get("token")
-        headers = {"Authorization": f"Bearer {token}"} if token else {}
-        with httpx.Client(timeout=TIMEOUT) as client:
-            r = client.post(f"http://{DEFAULT_SERVER_HOST}:{DEFAULT_SERVER_PORT}{endpoint}",
-                            json=payload, headers=headers)
-            r.raise_for_status()
-            resp = r.json()
-            if resp.get("ok"):
-                return True, resp
-            else:
-                err_msg = resp.get("error") or "Unknown server error"
-                return False, {"error": err_msg}
-    except httpx.TimeoutException:
-        return False, {"error": "Request timed out."}
-    except httpx.RequestError as e:
-        return False, {"error": f"Connection error: {str(e)}"}
+        resp = r.json()
     except ValueError:
+        return None
+    return resp.get("error") if isinstance(resp, dict) else None
+
+def _response_result(r):
+    # "unsupported": the server has no such endpoint (405/501, or a 404 for the route itself).
+    # A 404 for a missing resource (attachment, upload, user) carries the server's own error
+    err = _reply_error(r) if r.status_code in (400, 401, 403, 404) else None
+    if r.status_code in (405, 501) or (r.status_code == 404 and err in (None, "unknown endpoint")):
+        return False, {"error": f"Not supported by the server ({r.status_code})", "unsupported": True}
+    if r.status_code == 404:
+        return False, {"error": err, "not_found": True}
+    if r.status_code == 429 or r.status_code >= 500:
+        resp = {"error": f"Server error ({r.status_code})", "retry": True}
+        wait = parse_retry_after(r.headers.get("Retry-After"))
+        if wait is not None:
+            resp["retry_after"] = wait
+            resp["error"] = f"Server busy ({r.status_code}), retry in {wait:.0f}s"
+        return False, resp
+    if r.status_code in (401, 403):
+        return False, {"error": err or f"Not authorized ({r.status_code})", "auth": True}
+    if r.status_code == 400:
+        return False, {"error": err or "Bad request (400)", "bad_request": True}
+    r.raise_for_status()
+    resp = r.json()
+    if resp.get("ok"):
+        return True, resp
+    else:
+        err_msg = resp.get("error") or "Unknown server error"
+        return False, {"error": err_msg}
+
+def _error_result(e):
+    # "retry" marks failures where the request may not have reached the server
+    import asyncio
+    import httpx
+    if isinstance(e, CircuitOpenError):
+        HEALTH.report(False)
+        return False, {"error": f"Server unavailable, trying again in {e.retry_in:.0f}s.", "retry": True,
+                       "retry_after": e.retry_in}
+    if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)):
+        HEALTH.report(False)
+        return False, {"error": "Request timed out.", "retry": True}
+    if isinstance(e, httpx.RequestError):
+        HEALTH.report(False)
+        return False, {"error": f"Connection error: {str(e)}", "retry": True}
+    if isinstance(e, ValueError):
         # JSON decode error
         return False, {"error": "Invalid response from server."}
+    return False, {"error": f"Unexpected error: {str(e)}"}
+
+class ETagCache:
+    # last successful reply per (account, endpoint, payload), revalidated with If-None-Match
+    def __init__(self, max_entries=ETAG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(endpoint, payload):
+        return server_url(), CONFIG.get("username"), endpoint, json.dumps(payload, sort_keys=True)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, resp):
+        with self._lock:
+            self._entries[key] = (etag, resp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+ETAGS = ETagCache()
+
+def send_request(endpoint, payload, headers=None, conditional=False):
+    # conditional: reuse the cached reply when the server answers 304 Not Modified
+    headers = {**auth_headers(), **(headers or {})}
+    cached = None
+    if conditional:
+        key = ETagCache.key(endpoint, payload)
+        cached = ETAGS.get(key)
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
+    try:
+        started = time.perf_counter()
+        r = SESSION.transport().request("POST", endpoint, payload, headers=headers,
+                                        idempotent=endpoint in IDEMPOTENT_ENDPOINTS)
+        HEALTH.report(True, time.perf_counter() - started)
+        if r.status_code == 304 and cached is not None:
+            return True, cached[1]
+        ok, resp = _response_result(r)
+        if ok and conditional and r.headers.get("ETag"):
+            ETAGS.put(key, r.headers["ETag"], resp)
+        return ok, resp
     except Exception as e:
-        return False, {"error": f"Unexpected error: {str(e)}"}
-            
+        return _error_result(e)
+
+# ---------- streaming responses ----------
+_NEED_MORE = object()
+_ARRAY_END = object()
+
+class JSONArrayStream:
+    # decodes the items of one top-level array (e.g. "mails") while the body is still arriving;
+    # everything else in the object is kept, with the array emptied, for meta()
+    def __init__(self, key):
+        self.key = key
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._skeleton = []
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string = ""
+        self._last_key = None
+        self._value_key = None
+
+    def feed(self, data, final=False):
+        self._buf = self._buf[self._pos:] + self._utf8.decode(data, final)
+        self._pos = 0
+        if self._in_string:
+            self._string_start = 0
+        items = []
+        while self._pos < len(self._buf):
+            if not self._in_array:
+                self._scan_outer()
+                continue
+            item = self._next_item(final)
+            if item is _NEED_MORE:
+                break
+            if item is not _ARRAY_END:
+                items.append(item)
+        return items
+
+    def meta(self):
+        return json.loads("".join(self._skeleton))
+
+    def _scan_outer(self):
+        buf, i, n = self._buf, self._pos, len(self._buf)
+        start = i
+        while i < n:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = self._string + buf[self._string_start:i]
+                    self._string = ""
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch == ":" and self._depth == 1:
+                self._value_key = self._last_key
+            elif ch == "," and self._depth == 1:
+                self._value_key = None
+            elif ch in "{[":
+                if ch == "[" and self._depth == 1 and self._value_key == self.key:
+                    self._skeleton.append(buf[start:i] + "[]")
+                    self._in_array = True
+                    self._value_key = None
+                    self._pos = i + 1
+                    return
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+            i += 1
+        if self._in_string:
+            # keep the partial key text; the buffer is trimmed before the next chunk
+            self._string += buf[self._string_start:n]
+        self._skeleton.append(buf[start:n])
+        self._pos = n
+
+    def _next_item(self, final):
+        buf, i, n = self._buf, self._pos, len(self._buf)
+        while i < n and buf[i] in " \t\r\n,":
+            i += 1
+        self._pos = i
+        if i >= n:
+            return _NEED_MORE
+        if buf[i] == "]":
+            self._in_array = False
+            self._pos = i + 1
+            return _ARRAY_END
+        try:
+            value, end = self._decoder.raw_decode(buf, i)
+        except ValueError:
+            if final:
+                raise
+            return _NEED_MORE
+        if not final and buf[end - 1] not in '}]"' and (end >= n or buf[end] not in " \t\r\n,]"):
+            # a number cut by the chunk boundary ("-25" of "-2500.0") must wait for the rest
+            return _NEED_MORE
+        self._pos = end
+        return value
+
+class StreamedResponse:
+    # iterate to get rows as they arrive; ok/resp follow send_request once iteration ends
+    def __init__(self, endpoint, payload, key, folder=None):
+        self.endpoint = endpoint
+        self.payload = payload
+        self.key = key
+        self.folder = folder
+        self.ok = None
+        self.resp = {}
+
+    def __iter__(self):
+        parser = JSONArrayStream(self.key)
+        try:
+            started = time.perf_counter()
+            with SESSION.transport().stream("POST", self.endpoint, self.payload, headers=auth_headers(),
+                                            idempotent=self.endpoint in IDEMPOTENT_ENDPOINTS) as r:
+                HEALTH.report(True, time.perf_counter() - started)
+                sent = len(r.request.content)
+                if r.status_code >= 400:
+                    r.read()
+                    NET_STATS.record_bytes(self.endpoint, sent, sent, len(r.content), r.num_bytes_downloaded)
+                    self.ok, self.resp = _response_result(r)
+                    return
+                raw_in = 0
+                for chunk in r.iter_bytes():
+                    raw_in += len(chunk)
+                    for item in parser.feed(chunk):
+                        yield Mail.from_json(item, self.folder)
+                for item in parser.feed(b"", final=True):
+                    yield Mail.from_json(item, self.folder)
+                NET_STATS.record_bytes(self.endpoint, sent, sent, raw_in, r.num_bytes_downloaded)
+            meta = parser.meta()
+            if meta.get("ok"):
+                self.ok, self.resp = True, meta
+            else:
+                self.ok, self.resp = False, {"error": meta.get("error") or "Unknown server error"}
+        except Exception as e:
+            self.ok, self.resp = _error_result(e)
+
+# ---------- async networking ----------
+class AsyncSession:
+    # event loop on a daemon thread owning one AsyncTransport, so sync code can submit to it;
+    # asyncio itself is imported on first use, most sessions never need it
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._transport = None
+        self._base_url = None
+        self._lock = threading.Lock()
+
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                import asyncio
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def transport(self):
+        # only called from coroutines running on self._loop
+        base_url = server_url()
+        if self._transport is None or self._base_url != base_url:
+            if self._transport is not None:
+                self._loop.create_task(self._transport.aclose())
+            self._transport = AsyncTransport(base_url, **transport_options())
+            self._base_url = base_url
+        return self._transport
+
+    def submit(self, coro):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+    def run(self, coro, timeout=None):
+        fut = self.submit(coro)
+        try:
+            return fut.result(timeout)
+        except (FutureTimeout, KeyboardInterrupt):
+            fut.cancel()
+            raise
+
+    async def _aclose(self):
+        if self._transport is not None:
+            await self._transport.aclose()
+            self._transport = None
+
+    def close(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        try:
+            import asyncio
+            asyncio.run_coroutine_threadsafe(self._aclose(), loop).result(2)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(2)
+
+ASYNC = AsyncSession()
+atexit.register(ASYNC.close)
+
+async def async_send_request(endpoint, payload, timeout=None, headers=None):
+    import asyncio
+    try:
+        started = time.perf_counter()
+        call = ASYNC.transport().request("POST", endpoint, payload, headers={**auth_headers(), **(headers or {})},
+                                         idempotent=endpoint in IDEMPOTENT_ENDPOINTS)
+        r = await asyncio.wait_for(call, timeout) if timeout else await call
+        HEALTH.report(True, time.perf_counter() - started)
+        return _response_result(r)
+    except Exception as e:
+        return _error_result(e)
+
+async def gather_requests(calls, concurrency=ASYNC_CONCURRENCY, timeout=None):
+    # calls: [(endpoint, payload), ...] or (endpoint, payload, headers); results come back in the
+    # same order
+    import asyncio
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(endpoint, payload, headers=None):
+        async with sem:
+            return await async_send_request(endpoint, payload, timeout, headers)
+
+    return await asyncio.gather(*(one(*call) for call in calls))
+
+def send_requests(calls, concurrency=ASYNC_CONCURRENCY, timeout=None):
+    calls = list(calls)
+    if not calls:
+        return []
+    return ASYNC.run(gather_requests(calls, concurrency, timeout))
+
 def action_send():
     if not require_login_flow():
         return
@@ -314,6 +1173,19 @@ def action_send():
 
     message = "\n".join(lines)
 
+    # ---- ATTACHMENTS ----
+    files = []
+    if input("Attach files? (y/n): ").strip().lower() == "y":
+        printc("One path per line, empty line to finish.", C.BLUE)
+        while True:
+            path = os.path.expanduser(input("File: ").strip().strip('"'))
+            if not path:
+                break
+            if os.path.isfile(path):
+                files.append(os.path.abspath(path))
+            else:
+                printc(f"Not a file: {path}", C.RED)
+
     # ---- PREVIEW ----
     clear_screen()
     printc("=== PREVIEW ===", C.CYAN)
@@ -321,6 +1193,8 @@ def action_send():
     if cc: printc(f"CC: {', '.join(cc)}")
     if bcc: printc(f"BCC: {', '.join(bcc)}")
     printc(f"Subject: {subject}")
+    for path in files:
+        printc(f"Attachment: {os.path.basename(path)} ({fmt_bytes(os.path.getsize(path))})")
     printc("-" * 50)
     print(message)
     printc("-" * 50)
@@ -337,48 +1211,1003 @@ def action_send():
         "subject": subject,
         "message": message
     }
+    if files:
+        # uploaded by the outbox right before sending, so attaching works offline too
+        payload["files"] = files
+
+    queue_mail(payload)
+    printc("Mail queued — it will be delivered in the background.", C.GREEN)
+    time.sleep(0.7)
+
+# ---------- attachments ----------
+def file_sha256(path):
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(ATTACHMENT_CHUNK), b""):
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+def _put_chunk(upload_id, offset, data):
+    try:
+        started = time.perf_counter()
+        r = SESSION.transport().request("PUT", "/upload_chunk", data, headers=auth_headers(),
+                                        params={"upload_id": upload_id, "offset": offset})
+        HEALTH.report(True, time.perf_counter() - started)
+        if r.status_code == 409:
+            # the server holds a different amount than we assumed; it says how much
+            return False, r.json()
+        return _response_result(r)
+    except Exception as e:
+        return _error_result(e)
 
-    ok, resp = send_request("/send", payload)
+def upload_attachment(path, progress=None):
+    # one chunk in memory at a time; the server keeps partial uploads per (size, sha256), so
+    # calling this again for the same file resumes after the last acknowledged chunk
+    digest, size = file_sha256(path)
+    ok, resp = send_request("/upload_init", {"filename": os.path.basename(path), "size": size, "sha256": digest})
     if not ok:
-        printc(f"Send failed: {resp}", C.RED)
+        return False, resp
+    upload_id = resp["upload_id"]
+    chunk_size = int(resp.get("chunk_size") or ATTACHMENT_CHUNK)
+    offset = int(resp.get("received") or 0)
+    with open(path, "rb") as f:
+        while offset < size:
+            f.seek(offset)
+            ok, resp = _put_chunk(upload_id, offset, f.read(chunk_size))
+            if not ok and "received" not in resp:
+                return False, resp
+            offset = int(resp["received"])
+            if progress:
+                progress(offset, size)
+    return send_request("/upload_complete", {"upload_id": upload_id})
+
+def upload_files(paths):
+    ids = []
+    for path in paths:
+        if not os.path.isfile(path):
+            return False, {"error": f"Attachment not found: {path}"}
+        ok, resp = upload_attachment(path)
+        if not ok:
+            return False, resp
+        ids.append(resp["attachment_id"])
+    return True, {"attachments": ids}
+
+def _free_path(path):
+    base, ext = os.path.splitext(path)
+    n = 1
+    while os.path.exists(path):
+        path = f"{base} ({n}){ext}"
+        n += 1
+    return path
+
+def download_attachment(att, dest_dir=None, progress=None):
+    # streams into <name>.part, continuing a partial file with a Range request; the file only
+    # gets its real name once the sha256 matches
+    dest_dir = dest_dir or CONFIG.get("download_dir") or DOWNLOAD_DIR
+    os.makedirs(dest_dir, exist_ok=True)
+    name = os.path.basename(str(att.get("filename") or "")).strip() or "attachment"
+    part = os.path.join(dest_dir, name + ".part")
+    size = int(att.get("size") or 0)
+    h = hashlib.sha256()
+    have = 0
+    if os.path.exists(part):
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(ATTACHMENT_CHUNK), b""):
+                h.update(chunk)
+                have += len(chunk)
+    headers = auth_headers()
+    if have:
+        headers["Range"] = f"bytes={have}-"
+    try:
+        started = time.perf_counter()
+        with SESSION.transport().stream("GET", "/attachment", headers=headers,
+                                        params={"attachment_id": att["id"]}) as r:
+            HEALTH.report(True, time.perf_counter() - started)
+            if r.status_code == 200 and have:
+                # range ignored: the whole file is coming again
+                h, have = hashlib.sha256(), 0
+            if r.status_code in (200, 206):
+                received = 0
+                with open(part, "ab" if have else "wb") as f:
+                    for chunk in r.iter_bytes(ATTACHMENT_CHUNK):
+                        f.write(chunk)
+                        h.update(chunk)
+                        have += len(chunk)
+                        received += len(chunk)
+                        if progress:
+                            progress(have, size)
+                NET_STATS.record_bytes("/attachment", 0, 0, received, r.num_bytes_downloaded)
+            elif r.status_code != 416 or have != size:
+                r.read()
+                ok, resp = _response_result(r)
+                return False, resp if not ok else {"error": f"Unexpected status {r.status_code}"}
+    except Exception as e:
+        return _error_result(e)
+    if att.get("sha256") and h.hexdigest() != att["sha256"]:
+        os.remove(part)
+        return False, {"error": f"{name}: checksum mismatch, download discarded", "retry": True}
+    final = _free_path(os.path.join(dest_dir, name))
+    os.replace(part, final)
+    return True, {"path": final}
+
+def _print_progress(label):
+    def show(done, total):
+        pct = f"{done * 100 // total}%" if total else fmt_bytes(done)
+        sys.stdout.write(f"\r{label}: {pct}   ")
+        sys.stdout.flush()
+    return show
+
+def action_download_attachments(mail):
+    for att in mail.attachments:
+        name = att.get("filename") or "attachment"
+        ok, resp = download_attachment(att, progress=_print_progress(name))
+        print()
+        if ok:
+            printc(f"Saved {resp['path']}", C.GREEN)
+        else:
+            printc(f"{name}: {resp.get('error')}", C.RED)
+    pause()
+
+# ---------- outbox ----------
+class OutboxWorker:
+    # delivers queued mails with backoff; the Idempotency-Key lets the server drop replays
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                delay = self.deliver_due()
+            except Exception:
+                delay = 30
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def deliver_due(self):
+        account = CONFIG.get("username")
+        if not account or not CONFIG.get("token"):
+            return 30
+        now = time.time()
+        next_due = now + 30
+        for item in STORE.outbox_list(account, ("pending",)):
+            if item["next_try"] > now:
+                next_due = min(next_due, item["next_try"])
+                continue
+            self.deliver(item)
+            if HEALTH.online is False:
+                # no point hammering the rest of the queue while offline
+                return 5
+        return max(0.5, next_due - time.time())
+
+    def deliver(self, item):
+        payload = item["payload"]
+        ok, resp = True, {}
+        if payload.get("files"):
+            # local paths: upload them (resuming where a previous try stopped), then send the ids
+            ok, resp = upload_files(payload["files"])
+            if ok:
+                payload = {k: v for k, v in payload.items() if k != "files"}
+                payload["attachments"] = resp["attachments"]
+                STORE.outbox_update(item["key"], payload=json.dumps(payload))
+        if ok:
+            ok, resp = send_request("/send", payload, headers={"Idempotency-Key": item["key"]})
+        attempts = item["attempts"] + 1
+        if ok:
+            STORE.outbox_update(item["key"], status="sent", attempts=attempts,
+                                mail_id=str(resp.get("mail_id")), last_error=None)
+            folders_changed("sent")
+            return True
+        err = resp.get("error") or "Unknown error"
+        if not resp.get("retry") or attempts >= OUTBOX_MAX_ATTEMPTS:
+            STORE.outbox_update(item["key"], status="failed", attempts=attempts, last_error=err)
+        else:
+            backoff = min(OUTBOX_MAX_BACKOFF, 5 * (2 ** (attempts - 1))) + random.random() * 2
+            backoff = max(backoff, resp.get("retry_after") or 0)
+            STORE.outbox_update(item["key"], attempts=attempts, next_try=time.time() + backoff, last_error=err)
+        return False
+
+OUTBOX = OutboxWorker()
+
+def queue_mail(payload):
+    key = new_idempotency_key()
+    STORE.outbox_add(CONFIG.get("username"), key, payload)
+    OUTBOX.start()
+    OUTBOX.wake()
+    return key
+
+def outbox_indicator():
+    counts = STORE.outbox_counts(CONFIG.get("username"))
+    pending, failed = counts.get("pending", 0), counts.get("failed", 0)
+    if failed:
+        return color(f"Outbox: {pending} pending, {failed} failed", C.RED)
+    if pending:
+        return color(f"Outbox: {pending} pending", C.YELLOW)
+    return None
+
+def action_outbox():
+    if not require_login_flow(): return
+    account = CONFIG.get("username")
+    while True:
+        clear_screen()
+        printc("=== OUTBOX ===", C.HEADER)
+        items = STORE.outbox_list(account)
+        if not items:
+            printc("Outbox is empty.", C.GREEN)
+        for i, item in enumerate(items, 1):
+            p = item["payload"]
+            col = C.RED if item["status"] == "failed" else C.YELLOW
+            printc(f"[{i}] {item['status']} | To: {', '.join(p.get('to', []))} | {p.get('subject') or '(no subject)'}", col)
+            if item["last_error"]:
+                printc(f"     attempts: {item['attempts']} | last error: {item['last_error']}", C.BLUE)
+        printc("\nOptions: [s]end now, [r]etry failed, [x] discard failed, [b]ack", C.BLUE)
+        cmd = input("Choice: ").strip().lower()
+        if cmd == "s":
+            for item in STORE.outbox_list(account, ("pending",)):
+                STORE.outbox_update(item["key"], next_try=0)
+            OUTBOX.start()
+            OUTBOX.wake()
+            time.sleep(0.5)
+        elif cmd == "r":
+            for item in STORE.outbox_list(account, ("failed",)):
+                STORE.outbox_update(item["key"], status="pending", attempts=0, next_try=0)
+            OUTBOX.start()
+            OUTBOX.wake()
+            time.sleep(0.5)
+        elif cmd == "x":
+            if input("Discard all failed mails? (y/n): ").strip().lower() == "y":
+                STORE.outbox_purge(account, "failed")
+        elif cmd == "b":
+            return
+
+
+# ---------- folder sync ----------
+_SYNC_RUNNING = set()
+_SYNC_LOCK = threading.Lock()
+
+def _fetch_sync_page(folder, offset):
+    ok, resp = send_request("/fetch_mail", {"folder": folder, "limit": SYNC_PAGE_SIZE, "offset": offset},
+                            conditional=True)
+    if not ok:
+        return None
+    return Mail.from_list(resp.get("mails", []), folder)
+
+def _delta_cursor(folder):
+    # the change-feed position to record before a full sync; None if the server has no /sync_mail
+    if SERVER_CAPS["delta_sync"] is False:
+        return None
+    ok, resp = send_request("/sync_mail", {"folder": folder, "cursor": None})
+    if ok and resp.get("cursor") is not None:
+        SERVER_CAPS["delta_sync"] = True
+        return resp["cursor"]
+    if ok or not resp.get("retry"):
+        SERVER_CAPS["delta_sync"] = False
+    return None
+
+def _fill_bodies(folder, mails):
+    # feeds that list headers only: fetch the missing bodies so search and offline reading work
+    missing = [m for m in mails if m.message is None]
+    if not missing:
+        return True
+    results = send_requests([("/fetch_mail_body", {"mail_id": m.id, "folder": folder}) for m in missing])
+    for m, (ok, resp) in zip(missing, results):
+        body = resp.get("message") if ok else None
+        if body is None:
+            return False
+        m.message = body
+    return True
+
+def _sync_delta(folder, account, state):
+    # apply what changed since state["cursor"]; None means a full sync is needed instead,
+    # otherwise True/False like sync_folder
+    ok, resp = send_request("/sync_mail", {"folder": folder, "cursor": state["cursor"]})
+    if not ok and resp.get("retry"):
+        return False
+    if not ok or resp.get("cursor") is None:
+        SERVER_CAPS["delta_sync"] = False
+        return None
+    if resp.get("reset"):
+        # the feed no longer reaches back to our cursor: start this folder over
+        STORE.clear(account, folder)
+        return None
+    added = Mail.from_list(resp.get("added") or [], folder)
+    if not _fill_bodies(folder, added):
+        # keep the cursor where it is: the local index must not get mails without their text
+        return False
+    removed = resp.get("removed") or []
+    moved = [mv for mv in resp.get("moved") or [] if mv.get("to") in MAIL_FOLDERS]
+    STORE.upsert(account, folder, added)
+    STORE.remove(account, folder, removed)
+    for mv in moved:
+        STORE.move(account, mv["id"], folder, mv["to"])
+    newest_ts, newest_id = state["newest_ts"], state["newest_id"]
+    for m in added:
+        if m.timestamp >= newest_ts:
+            newest_ts, newest_id = m.timestamp, m.key
+    STORE.set_state(account, folder, newest_ts, newest_id, state["complete"], resp["cursor"])
+    if added or removed or moved:
+        folders_changed(folder, *{mv["to"] for mv in moved})
+    return True
+
+def _reached_known(mails, state):
+    for m in mails:
+        if state["newest_id"] is not None and m.key == state["newest_id"]:
+            return True
+        if m.timestamp < state["newest_ts"]:
+            return True
+    return False
+
+def sync_folder(folder, account=None, backfill=True):
+    account = account or CONFIG.get("username")
+    if not account:
+        return False
+    state = STORE.state(account, folder)
+    if state is not None and state["cursor"] is not None and SERVER_CAPS["delta_sync"] is not False:
+        done = _sync_delta(folder, account, state)
+        if done is not None:
+            return _backfill(folder, account) if backfill and done and not state["complete"] else done
+        state = STORE.state(account, folder)
+    cursor = _delta_cursor(folder)
+    complete = bool(state and state["complete"])
+    newest = None
+
+    # head: walk from the newest mail until we meet what we already have
+    offset = 0
+    while True:
+        mails = _fetch_sync_page(folder, offset)
+        if mails is None:
+            return False
+        if newest is None and mails:
+            newest = mails[0]
+        STORE.upsert(account, folder, mails)
+        if len(mails) < SYNC_PAGE_SIZE:
+            complete = True
+            break
+        if state is None or _reached_known(mails, state):
+            break
+        offset += len(mails)
+
+    if newest is not None:
+        newest_ts, newest_id = newest.timestamp, newest.key
+    elif state is not None:
+        newest_ts, newest_id = state["newest_ts"], state["newest_id"]
     else:
-        printc(f"Mail sent successfully. id={resp.get('mail_id')}", C.GREEN)
+        newest_ts, newest_id = 0, None
+    STORE.set_state(account, folder, newest_ts, newest_id, complete, cursor)
+    return _backfill(folder, account) if backfill and not complete else True
 
-    pause()
-    
-def list_folder(folder, page=0):
-    if not require_login_flow(): return []
-    payload = {"folder": folder, "limit": PAGE_SIZE, "offset": page * PAGE_SIZE}
-    ok, resp = send_request("/fetch_mail", payload)
+def _backfill(folder, account):
+    # tail: continue an unfinished initial sync where the local copy ends
+    while True:
+        mails = _fetch_sync_page(folder, STORE.count(account, folder))
+        if mails is None:
+            return False
+        STORE.upsert(account, folder, mails)
+        if len(mails) < SYNC_PAGE_SIZE:
+            state = STORE.state(account, folder)
+            STORE.set_state(account, folder, state["newest_ts"], state["newest_id"], True, state["cursor"])
+            return True
+
+def sync_folder_once(folder, account, backfill=True):
+    # one sync per folder at a time; returns None when another is already running
+    key = (account, folder)
+    with _SYNC_LOCK:
+        if key in _SYNC_RUNNING:
+            return None
+        _SYNC_RUNNING.add(key)
+    try:
+        return sync_folder(folder, account, backfill)
+    finally:
+        with _SYNC_LOCK:
+            _SYNC_RUNNING.discard(key)
+
+def refresh_folder_async(folder, account=None):
+    account = account or CONFIG.get("username")
+    if not account:
+        return
+    with _SYNC_LOCK:
+        if (account, folder) in _SYNC_RUNNING:
+            return
+
+    def run():
+        try:
+            sync_folder_once(folder, account)
+        except Exception:
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+# ---------- header-only listings & lazy bodies ----------
+
+def _rejects_fields(resp):
+    # a bad request (or plain "ok": false) naming the parameter; auth, missing folders and
+    # unreachable servers say nothing about headers-only support
+    if resp.keys() & {"retry", "auth", "unsupported", "not_found"}:
+        return False
+    return "field" in (resp.get("error") or "").lower()
+
+def fetch_mail_headers(folder, limit, offset, cursor=None):
+    # ask for subject/sender/timestamp only; servers that ignore the hint send full mails.
+    # With a cursor the offset is only there for servers that page by offset
+    payload = {"folder": folder, "limit": limit, "offset": offset}
+    if cursor is not None:
+        payload["cursor"] = cursor
+    headers_only = SERVER_CAPS["headers_only"] is not False
+    if headers_only:
+        payload["fields"] = "headers"
+    ok, resp = send_request("/fetch_mail", payload, conditional=True)
+    if not ok and headers_only and SERVER_CAPS["headers_only"] is None and _rejects_fields(resp):
+        # the server rejected the unknown field: use the full payload from now on
+        SERVER_CAPS["headers_only"] = False
+        payload.pop("fields")
+        ok, resp = send_request("/fetch_mail", payload, conditional=True)
     if not ok:
-        printc(f"Failed to fetch {folder}: {resp}", C.RED)
-        return []
-    mails = resp.get("mails", [])
+        return False, resp
+    rows = resp.get("mails", [])
+    if headers_only and rows:
+        SERVER_CAPS["headers_only"] = not any("message" in m for m in rows)
+    return True, MailPage.from_response(resp, folder)
+
+class BodyCache:
+    # LRU of mail bodies bounded by total characters rather than entries
+    def __init__(self, max_bytes=BODY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._bodies.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._bodies[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._bodies.popitem(last=False)
+                self.size -= len(evicted)
+
+BODY_CACHE = BodyCache()
+
+def _body_from_full_page(mail, folder, offset):
+    # fallback for servers without /fetch_mail_body: refetch the rows around the mail in full
+    start = max(0, (offset or 0) - page_size())
+    ok, resp = send_request("/fetch_mail", {"folder": folder, "limit": page_size() * 2, "offset": start})
+    if not ok:
+        return None
+    for m in resp.get("mails", []):
+        if m.get("id") == mail.id:
+            return m.get("message")
+    return None
+
+def load_mail_body(mail, folder, offset=None):
+    account = CONFIG.get("username")
+    key = (account, folder, mail.key)
+    body = BODY_CACHE.get(key)
+    stored = None
+    if body is None:
+        stored = STORE.get(account, folder, mail.id)
+        if stored is not None:
+            body = stored.message
+    if body is None:
+        resp = {}
+        if SERVER_CAPS["body_endpoint"] is not False:
+            ok, resp = send_request("/fetch_mail_body", {"mail_id": mail.id, "folder": folder})
+            if ok:
+                SERVER_CAPS["body_endpoint"] = True
+                body = resp.get("message")
+                if body is None:
+                    body = (resp.get("mail") or {}).get("message")
+            elif resp.get("unsupported"):
+                SERVER_CAPS["body_endpoint"] = False
+        if body is None and not resp.get("retry"):
+            body = _body_from_full_page(mail, folder, offset)
+        if body is not None:
+            _store_body(account, folder, stored or mail, body)
+    if body is None:
+        return mail
+    BODY_CACHE.put(key, body)
+    mail.message = body
+    return mail
+
+def _store_body(account, folder, mail, body):
+    # keep fetched bodies for offline reading and the search index. A mail the store does not
+    # have yet is only added once the folder is fully synced: a partial sync must stay a
+    # contiguous run from the newest mail (see MailStore.covers)
+    if STORE.get(account, folder, mail.id) is None:
+        st = STORE.state(account, folder)
+        if not (st and st["complete"]):
+            return
+    full = Mail.from_json(mail.to_json(), folder)
+    full.message = body
+    STORE.upsert(account, folder, [full])
+
+# ---------- page cache & prefetch ----------
+class PageCache:
+    # bounded LRU of server pages keyed by (account, folder, page), plus the cursor each page
+    # is fetched with. Cursors outlive invalidation: they mark "after this mail", which new mail
+    # arriving at the top does not move, so paging neither repeats nor skips mails. Both are
+    # LRUs of max_pages entries
+    def __init__(self, max_pages=PAGE_CACHE_SIZE):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._generation = {}
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cursor(self, key):
+        with self._lock:
+            cursor = self._cursors.get(key)
+            if cursor is not None:
+                self._cursors.move_to_end(key)
+            return cursor
+
+    def set_cursor(self, key, cursor):
+        with self._lock:
+            if cursor is None:
+                self._cursors.pop(key, None)
+                return
+            self._cursors[key] = cursor
+            self._cursors.move_to_end(key)
+            while len(self._cursors) > self.max_pages:
+                self._cursors.popitem(last=False)
+
+    def generation(self, account, folder):
+        with self._lock:
+            return self._generation.get((account, folder), 0)
+
+    def get(self, key):
+        with self._lock:
+            mails = self._pages.get(key)
+            if mails is not None:
+                self._pages.move_to_end(key)
+            return mails
+
+    def put(self, key, mails, generation):
+        with self._lock:
+            # drop pages fetched before the folder was invalidated
+            if self._generation.get(key[:2], 0) != generation:
+                return
+            self._pages[key] = mails
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def invalidate(self, account, folder):
+        with self._lock:
+            self._generation[(account, folder)] = self._generation.get((account, folder), 0) + 1
+            for key in [k for k in self._pages if k[:2] == (account, folder)]:
+                del self._pages[key]
+
+PAGE_CACHE = PageCache()
+_PREFETCH = None
+_PREFETCH_INFLIGHT = {}
+_PREFETCH_LOCK = threading.Lock()
+
+def _prefetch_pool():
+    global _PREFETCH
+    with _PREFETCH_LOCK:
+        if _PREFETCH is None:
+            _PREFETCH = ThreadPoolExecutor(max_workers=2, thread_name_prefix="omx-prefetch")
+        return _PREFETCH
+
+def _fetch_server_page(account, folder, page):
+    # pages reached by next/prev continue from their neighbour's cursor: constant cost at any
+    # depth. Offset is the fallback for old servers and pages reached some other way
+    generation = PAGE_CACHE.generation(account, folder)
+    size = page_size()
+    cursor = PAGE_CACHE.cursor((account, folder, page)) if page and SERVER_CAPS["cursor_paging"] else None
+    ok, mails = fetch_mail_headers(folder, size, page * size, cursor)
+    if not ok:
+        return False, mails
+    if SERVER_CAPS["cursor_paging"]:
+        PAGE_CACHE.set_cursor((account, folder, page + 1), mails.next_cursor)
+    PAGE_CACHE.put((account, folder, page), mails, generation)
+    return True, mails
+
+def fetch_page(folder, page, account=None):
+    account = account or CONFIG.get("username")
+    offset = page * page_size()
+    if STORE.covers(account, folder, offset, page_size()):
+        return True, STORE.page(account, folder, offset, page_size())
+    key = (account, folder, page)
+    mails = PAGE_CACHE.get(key)
+    if mails is not None:
+        return True, mails
+    with _PREFETCH_LOCK:
+        pending = _PREFETCH_INFLIGHT.get(key)
+    if pending is not None:
+        # the prefetcher is already on it, wait rather than fetch twice
+        try:
+            return pending.result(timeout=TIMEOUT + 1)
+        except Exception:
+            pass
+    return _fetch_server_page(account, folder, page)
+
+def prefetch_pages(folder, page, account=None):
+    account = account or CONFIG.get("username")
+    for p in (page + 1, page - 1):
+        if p < 0:
+            continue
+        key = (account, folder, p)
+        if STORE.covers(account, folder, p * page_size(), page_size()) or PAGE_CACHE.get(key) is not None:
+            continue
+        with _PREFETCH_LOCK:
+            if key in _PREFETCH_INFLIGHT:
+                continue
+        fut = _prefetch_pool().submit(_fetch_server_page, account, folder, p)
+        with _PREFETCH_LOCK:
+            _PREFETCH_INFLIGHT[key] = fut
+        fut.add_done_callback(lambda f, key=key: _prefetch_done(key))
+
+def _prefetch_done(key):
+    with _PREFETCH_LOCK:
+        _PREFETCH_INFLIGHT.pop(key, None)
+
+def folders_changed(*folders):
+    account = CONFIG.get("username")
+    for folder in folders:
+        PAGE_CACHE.invalidate(account, folder)
+
+def store_mail_deleted(folder, mail_id):
+    account = CONFIG.get("username")
+    if folder == "deleted":
+        STORE.remove(account, "deleted", [mail_id])
+    else:
+        STORE.move(account, mail_id, folder, "deleted")
+    folders_changed(folder, "deleted")
+
+def store_mail_recovered(mail_id):
+    STORE.move(CONFIG.get("username"), mail_id, "deleted", "inbox")
+    folders_changed("deleted", "inbox")
+
+def list_folder(folder, page=0, out=None):
+    if not require_login_flow(): return []
+    account = CONFIG.get("username")
+    ok, resp = fetch_page(folder, page, account)
+    if ok:
+        mails = resp
+    else:
+        # offline: fall back to whatever has been synced
+        mails = STORE.page(account, folder, page * page_size(), page_size())
+        if not mails:
+            printc(f"Failed to fetch {folder}: {resp}", C.RED, out)
+            return []
+        printc(f"Offline — showing local copy ({resp.get('error')})", C.YELLOW, out)
     if not mails:
-        printc("No mails.", C.YELLOW)
+        printc("No mails.", C.YELLOW, out)
         return []
-    pretty_mail_list(mails)
+    pretty_mail_list(mails, out=out)
     return mails
 
+# ---------- new-mail watcher ----------
+class MailWatcher:
+    # holds a /watch long-poll open so new mail is synced as it arrives; servers without /watch
+    # are polled instead, less often the longer nothing arrives
+    def __init__(self, hold=WATCH_HOLD, poll_min=WATCH_POLL_MIN, poll_max=WATCH_POLL_MAX):
+        self.hold = hold
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.mode = None  # "push" or "poll", decided by the first answer from the server
+        self.interval = poll_min
+        self._account = None
+        self._cursor = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def poke(self):
+        # the user is active: check soon, and poll at the fastest rate again
+        self.interval = self.poll_min
+        if self.mode != "push":
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                delay = self.check()
+            except Exception:
+                delay = self.poll_min
+            if delay:
+                self._wake.wait(delay)
+                self._wake.clear()
+
+    def check(self):
+        # one round; returns how long to wait before the next
+        account = CONFIG.get("username")
+        if not account or not CONFIG.get("token"):
+            return 5
+        if account != self._account:
+            self._account, self._cursor, self.mode = account, None, None
+        if self.mode != "poll":
+            delay = self._watch()
+            if delay is not None:
+                return delay
+        return self._poll()
+
+    def _watch(self):
+        # None means the server has no /watch and we should poll
+        import httpx
+        started = time.monotonic()
+        try:
+            r = WATCH_SESSION.transport().request("POST", "/watch", {"cursor": self._cursor, "timeout": self.hold},
+                                                  headers=auth_headers(), idempotent=True, timeout=self.hold + TIMEOUT)
+        except CircuitOpenError as e:
+            return e.retry_in
+        except httpx.TransportError:
+            return self.poll_min
+        if r.status_code in (404, 405, 501):
+            self.mode = "poll"
+            return None
+        try:
+            resp = r.json() if r.status_code == 200 else {}
+        except ValueError:
+            resp = {}
+        if not resp.get("ok"):
+            return self.poll_min
+        if resp.get("cursor") is None:
+            # answered, but not as a change feed
+            self.mode = "poll"
+            return None
+        self.mode = "push"
+        first = self._cursor is None
+        self._cursor = resp.get("cursor")
+        folders = [f for f in resp.get("folders") or () if f in MAIL_FOLDERS]
+        if folders and not first:
+            self._changed(folders)
+            return 0
+        # an answer that came back at once with nothing in it must not turn into a busy loop
+        return 0 if first or time.monotonic() - started >= 1 else 1
+
+    def _poll(self):
+        state = STORE.state(self._account, "inbox")
+        ok, mails = fetch_mail_headers("inbox", 1, 0)
+        if ok and mails and (state is None or mails[0].key != state["newest_id"]):
+            self._changed(["inbox"])
+            self.interval = self.poll_min
+        else:
+            self.interval = min(self.poll_max, self.interval * 2)
+        return self.interval
+
+    def _changed(self, folders):
+        # inbox always (it feeds the badge); other folders only if they are kept locally
+        for folder in folders:
+            if folder == "inbox" or STORE.state(self._account, folder) is not None:
+                sync_folder_once(folder, self._account, backfill=False)
+        folders_changed(*folders)
+
+WATCHER = MailWatcher()
+
+def unread_count(account=None):
+    # inbox mails newer than the last time the inbox was opened
+    account = account or CONFIG.get("username")
+    if not account:
+        return 0
+    seen = CONFIG.setdefault("inbox_seen", {})
+    if account not in seen:
+        state = STORE.state(account, "inbox")
+        if state is None:
+            return 0
+        # first run on this machine: only mail arriving from now on counts as new
+        seen[account] = state["newest_ts"]
+        save_config()
+    return STORE.count_since(account, "inbox", seen[account])
+
+def mark_seen(folder):
+    account = CONFIG.get("username")
+    if folder != "inbox" or not account:
+        return
+    state = STORE.state(account, "inbox")
+    CONFIG.setdefault("inbox_seen", {})[account] = state["newest_ts"] if state else 0
+    save_config()
+
+# ---------- full-screen browser ----------
+class FolderView:
+    # what browser.MailBrowser needs from the client; browser.py never imports app
+    def __init__(self, folder, account=None):
+        self.folder = folder
+        self.account = account or CONFIG.get("username")
+
+    def count(self):
+        return STORE.count(self.account, self.folder)
+
+    def rows(self, offset, limit):
+        return STORE.page(self.account, self.folder, offset, limit)
+
+    def refresh(self):
+        refresh_folder_async(self.folder, self.account)
+
+    def syncing(self):
+        with _SYNC_LOCK:
+            return (self.account, self.folder) in _SYNC_RUNNING
+
+    def body(self, mail):
+        return load_mail_body(mail, self.folder).message
+
+    def status(self):
+        return _ANSI_RE.sub("", server_indicator())
+
+    def actions(self):
+        acts = {"d": ("Delete", self.delete), "s": ("Spam sender", self.spam)}
+        if self.folder == "deleted":
+            acts["r"] = ("Recover", self.recover)
+        return acts
+
+    def delete(self, mail):
+        ok, resp = send_request("/delete_mail", {"mail_id": mail.id, "folder": self.folder})
+        if not ok:
+            return False, f"Delete failed: {resp.get('error')}"
+        store_mail_deleted(self.folder, mail.id)
+        return True, "Moved to deleted." if self.folder != "deleted" else "Permanently deleted."
+
+    def spam(self, mail):
+        ok, resp = send_request("/add_sender_to_spam", {"sender": mail.sender})
+        if not ok:
+            return False, f"Add spam failed: {resp.get('error')}"
+        folders_changed(self.folder, "spam")
+        return True, f"{mail.sender} added to your spam list."
+
+    def recover(self, mail):
+        ok, resp = send_request("/recover_mail", {"mail_id": mail.id})
+        if not ok:
+            return False, f"Recover failed: {resp.get('error')}"
+        store_mail_recovered(mail.id)
+        return True, "Mail recovered to inbox."
+
+def browse_folder(folder):
+    # prompt_toolkit (via browser.py) is loaded here, on first use
+    from browser import MailBrowser
+    MailBrowser(FolderView(folder)).run()
+    SCREEN.invalidate()
+
+# ---------- bulk actions ----------
+BULK_ACTIONS = {"d": "delete", "del": "delete", "rec": "recover", "s": "spam", "spam": "spam"}
+
+def parse_selection(text, count):
+    # "1-8,11", "3 5 7" or "all" -> sorted 1-based numbers
+    text = text.strip().lower()
+    if text in ("all", "a", "*"):
+        return list(range(1, count + 1))
+    picked = set()
+    for part in re.split(r"[,\s]+", text):
+        if not part:
+            continue
+        lo, sep, hi = part.partition("-")
+        if sep:
+            if not lo.isdigit() or not hi.isdigit():
+                raise ValueError(f"Invalid range: {part}")
+            lo, hi = sorted((int(lo), int(hi)))
+        elif part.isdigit():
+            lo = hi = int(part)
+        else:
+            raise ValueError(f"Invalid number: {part}")
+        # checked before expanding, so "1-999999999" cannot build a huge set
+        if lo < 1 or hi > count:
+            raise ValueError("Out of range")
+        picked.update(range(lo, hi + 1))
+    numbers = sorted(picked)
+    if not numbers:
+        raise ValueError("Nothing selected")
+    return numbers
+
+def bulk_mail_action(action, folder, mails):
+    if action == "delete":
+        calls = [("/delete_mail", {"mail_id": m.id, "folder": folder}) for m in mails]
+    elif action == "recover":
+        calls = [("/recover_mail", {"mail_id": m.id}) for m in mails]
+    elif action == "spam":
+        senders = dict.fromkeys(m.sender for m in mails)
+        calls = [("/add_sender_to_spam", {"sender": s}) for s in senders if s]
+    else:
+        raise ValueError(f"unknown bulk action {action}")
+    concurrency = int(CONFIG.get("bulk_concurrency", BULK_CONCURRENCY))
+    results = send_requests(calls, concurrency=concurrency)
+    done, failed = 0, []
+    for (endpoint, payload), (ok, resp) in zip(calls, results):
+        if not ok:
+            failed.append(resp.get("error") or "Unknown error")
+            continue
+        done += 1
+        if action == "delete":
+            store_mail_deleted(folder, payload["mail_id"])
+        elif action == "recover":
+            store_mail_recovered(payload["mail_id"])
+    if action == "spam" and done:
+        folders_changed(folder, "inbox", "spam")
+    return len(calls), done, failed
+
+def print_bulk_summary(action, total, done, failed):
+    col = C.GREEN if not failed else (C.YELLOW if done else C.RED)
+    printc(f"{action.capitalize()}: {done}/{total} succeeded.", col)
+    errors = {}
+    for err in failed:
+        errors[err] = errors.get(err, 0) + 1
+    for err, n in errors.items():
+        printc(f"  {n} failed: {err}", C.RED)
+
+def run_bulk_command(action, folder, mails, selection):
+    if not selection:
+        selection = input(f"{action.capitalize()} which (e.g. 1-8,11 or all)? ").strip()
+    try:
+        numbers = parse_selection(selection, len(mails))
+    except ValueError as e:
+        printc(str(e), C.RED)
+        pause()
+        return
+    chosen = [mails[n - 1] for n in numbers]
+    if input(f"{action.capitalize()} {len(chosen)} mail(s)? (y/n): ").strip().lower() != "y":
+        printc("Cancelled.", C.YELLOW)
+        pause()
+        return
+    print_bulk_summary(action, *bulk_mail_action(action, folder, chosen))
+    pause()
+
 def interactive_read(folder):
     if not require_login_flow():
         return
 
     page = 0
+    refresh_folder_async(folder)
+    SCREEN.invalidate()
     while True:
-        clear_screen()
-        printc(f"=== {folder.upper()} (page {page+1}) ===", C.HEADER)
-        mails = list_folder(folder, page)
+        frame = []
+        printc(f"=== {folder.upper()} (page {page+1}) ===", C.HEADER, frame)
+        mails = list_folder(folder, page, frame)
+        if mails:
+            prefetch_pages(folder, page)
+            printc("\nOptions: [n]ext page, [p]rev page, [o]pen <num>, [f]ull-screen, [r]efresh, [b]ack", C.BLUE, frame)
+            if folder == "deleted":
+                printc("Bulk: [d]elete <sel>, [rec]over <sel>, [s]pam <sel>  (sel: 1-8,11 or all)", C.BLUE, frame)
+            else:
+                printc("Bulk: [d]elete <sel>, [s]pam <sel>  (sel: 1-8,11 or all)", C.BLUE, frame)
+        # paging redraws only the rows that changed
+        SCREEN.render(frame)
         if not mails:
             choice = input("Back (b) or refresh (r)? ").strip().lower()
             if choice == "b":
                 return
             else:
+                folders_changed(folder)
+                sync_folder_once(folder, CONFIG.get("username"), backfill=False)
                 continue
 
-        printc("\nOptions: [n]ext page, [p]rev page, [o]pen <num>, [r]efresh, [b]ack", C.BLUE)
         cmd = input("Choice: ").strip().lower()
 
+        verb, _, selection = cmd.partition(" ")
+        action = BULK_ACTIONS.get(verb)
+        if action and (action != "recover" or folder == "deleted"):
+            run_bulk_command(action, folder, mails, selection)
+            # the summary can be long enough to scroll the list off its rows
+            SCREEN.invalidate()
+            continue
+
         if cmd == "n":
             page += 1
             continue
@@ -403,45 +2232,52 @@ def interactive_read(folder):
 
             mail = mails[idx]
             clear_screen()
-            show_mail_detail(mail)
+            show_mail_detail(mail, folder, page * page_size() + idx)
 
             while True:
+                extra = ", [a]ttachments download" if mail.attachments else ""
                 if folder == "deleted":
-                    printc("Actions: [d]elete, [r]ecover, [s]pam add sender, [b]ack", C.BLUE)
+                    printc(f"Actions: [d]elete, [r]ecover, [s]pam add sender{extra}, [b]ack", C.BLUE)
                 else:
-                    printc("Actions: [d]elete, [s]pam add sender, [b]ack", C.BLUE)
+                    printc(f"Actions: [d]elete, [s]pam add sender{extra}, [b]ack", C.BLUE)
                 act = input("Action: ").strip().lower()
 
                 if act == "d":
-                    mid = mail.get("id")
+                    mid = mail.id
                     ok, resp = send_request("/delete_mail", {"mail_id": mid, "folder": folder})
                     if not ok:
                         printc(f"Delete failed: {resp}", C.RED)
                     else:
+                        store_mail_deleted(folder, mid)
                         msg = "Moved to deleted." if folder != "deleted" else "Permanently deleted."
                         printc(msg, C.GREEN)
                     pause()
                     break
 
                 elif act == "r" and folder == "deleted":
-                    mid = mail.get("id")
+                    mid = mail.id
                     ok, resp = send_request("/recover_mail", {"mail_id": mid})
                     if not ok:
                         printc(f"Recover failed: {resp}", C.RED)
                     else:
+                        store_mail_recovered(mid)
                         printc("Mail recovered to inbox.", C.GREEN)
                     pause()
                     break
 
                 elif act == "s":
-                    sender = mail.get("from")
+                    sender = mail.sender
                     ok, resp = send_request("/add_sender_to_spam", {"sender": sender})
                     if not ok:
                         printc(f"Add spam failed: {resp}", C.RED)
                     else:
+                        folders_changed(folder, "spam")
                         printc("Sender added to your spam list.", C.GREEN)
                     pause()
 
+                elif act == "a" and mail.attachments:
+                    action_download_attachments(mail)
+
                 elif act == "b":
                     break
                 else:
@@ -449,6 +2285,14 @@ def interactive_read(folder):
             break
 
         elif cmd == "r":
+            folders_changed(folder)
+            # skipped when the background sync is already on this folder
+            sync_folder_once(folder, CONFIG.get("username"), backfill=False)
+            refresh_folder_async(folder)
+            continue
+        elif cmd == "f":
+            browse_folder(folder)
+            folders_changed(folder)
             continue
         elif cmd == "b":
             return
@@ -458,30 +2302,46 @@ def interactive_read(folder):
             
 def action_recover():
     if not require_login_flow(): return
-    ok, resp = send_request("/fetch_mail", {"folder": "deleted"})
-    if not ok:
-        printc(f"Failed: {resp}", C.RED); pause(); return
-    mails = resp.get("mails", [])
+    stream = StreamedResponse("/fetch_mail", {"folder": "deleted"}, "mails", "deleted")
+    mails = []
+    for i, m in enumerate(stream, 1):
+        printc(f"[{i}] {m.row()}", C.CYAN)
+        mails.append(m)
+    if not stream.ok:
+        printc(f"Failed: {stream.resp}", C.RED); pause(); return
     if not mails:
         printc("No deleted mails.", C.YELLOW); pause(); return
-    pretty_mail_list(mails)
-    choice = input("Select mail number to recover (or 0 to cancel): ").strip()
-    if not choice.isdigit(): return
-    n = int(choice)
-    if n == 0: return
-    idx = n - 1
-    if idx < 0 or idx >= len(mails):
-        printc("Out of range", C.RED); pause(); return
-    mail = mails[idx]
-    mid = mail.get("id")
-    ok, resp = send_request("/recover_mail", {"mail_id": mid})
-    if not ok:
-        printc(f"Recover failed: {resp}", C.RED)
-    else:
-        printc("Recovered to inbox.", C.GREEN)
+    choice = input("Select mail number(s) to recover, e.g. 1-3,5 or all (or 0 to cancel): ").strip()
+    if not choice or choice == "0": return
+    try:
+        numbers = parse_selection(choice, len(mails))
+    except ValueError as e:
+        printc(str(e), C.RED); pause(); return
+    chosen = [mails[n - 1] for n in numbers]
+    print_bulk_summary("recover", *bulk_mail_action("recover", "deleted", chosen))
     pause()
 
 # ---------- Search ----------
+def iter_search(query, folders, errors):
+    # synced folders are searched in the local index, cold ones streamed from the server
+    account = CONFIG.get("username")
+    warm = [f for f in folders if STORE.search_ready(account, f)]
+    cold = [f for f in folders if f not in warm]
+    if warm:
+        yield from STORE.search(account, query, warm)
+    for folder in cold:
+        stream = StreamedResponse("/search_mail", {"query": query, "folder": folder}, "results", folder)
+        yield from stream
+        if not stream.ok:
+            errors.append(f"{folder}: {stream.resp.get('error')}")
+            continue
+        refresh_folder_async(folder, account)
+
+def search_mails(query, folders):
+    errors = []
+    results = list(iter_search(query, folders, errors))
+    return results, errors
+
 def action_search():
     if not require_login_flow(): return
     clear_screen()
@@ -489,24 +2349,80 @@ def action_search():
     query = input("Query: ").strip()
     if not query:
         printc("Empty query", C.YELLOW); return
-    folder = input("Folder (inbox/sent/deleted): ").strip() or "inbox"
-    ok, resp = send_request("/search_mail", {"query": query, "folder": folder})
-    if not ok:
-        printc(f"Search failed: {resp}", C.RED); pause(); return
-    results = resp.get("results", [])
-    if not results:
-        printc("No results.", C.YELLOW); pause(); return
-
-    for i, r in enumerate(results, 1):
-        subj = r.get("subject") or "(no subject)"
-        sender = r.get("from") or r.get("sender") or "(unknown)"
-        ts = r.get("timestamp") or 0
-        printc(f"[{i}] {subj} | From: {sender} | {time.ctime(ts)}", C.CYAN)
-        snippet = r.get("snippet")
-        if snippet:
-            for line in textwrap.wrap(snippet, width=78):
+    folder = input("Folder (inbox/sent/deleted/spam, empty = all): ").strip().lower()
+    folders = [folder] if folder else list(MAIL_FOLDERS)
+    started = time.perf_counter()
+    errors = []
+    count = 0
+    for count, r in enumerate(iter_search(query, folders, errors), 1):
+        where = f" [{r.folder}]" if len(folders) > 1 and r.folder else ""
+        printc(f"[{count}]{where} {r.row()}", C.CYAN)
+        if r.snippet:
+            for line in textwrap.wrap(r.snippet, width=78):
                 print(line)
             print()
+    elapsed = (time.perf_counter() - started) * 1000
+    for err in errors:
+        printc(f"Search failed: {err}", C.RED)
+    if not count:
+        printc("No results.", C.YELLOW); pause(); return
+    printc(f"{count} result(s) in {elapsed:.0f} ms", C.BLUE)
+    pause()
+
+# ---------- Folder overview ----------
+def action_folder_overview():
+    if not require_login_flow(): return
+    clear_screen()
+    printc("=== FOLDER OVERVIEW ===", C.HEADER)
+    account = CONFIG.get("username")
+    # one concurrent round of requests instead of one per folder
+    calls = [("/fetch_mail", {"folder": f, "limit": 3, "offset": 0}) for f in MAIL_FOLDERS]
+    for folder, (ok, resp) in zip(MAIL_FOLDERS, send_requests(calls)):
+        synced = STORE.count(account, folder)
+        printc(f"\n{folder.upper()} ({synced} synced locally)", C.BOLD)
+        if ok:
+            mails = Mail.from_list(resp.get("mails", []), folder)
+        else:
+            mails = STORE.page(account, folder, 0, 3)
+            printc(f"  offline: {resp.get('error')}", C.YELLOW)
+        if not mails:
+            printc("  (empty)", C.YELLOW)
+        for m in mails:
+            printc(f"  {m.row()}", C.CYAN)
+    print()
+    pause()
+
+# ---------- Network usage ----------
+def dump_net_stats():
+    # opt-in: "stats_file" in client_config.json or OMX_STATS_FILE
+    path = os.environ.get("OMX_STATS_FILE") or CONFIG.get("stats_file")
+    if not path or not NET_STATS.snapshot():
+        return
+    try:
+        NET_STATS.dump(path)
+    except OSError:
+        pass
+
+atexit.register(dump_net_stats)
+
+def action_network_stats():
+    clear_screen()
+    printc("=== NETWORK STATS (this session) ===", C.HEADER)
+    printc(f"Accept-Encoding: {accept_encoding()}", C.BLUE)
+    gz = SERVER_CAPS["request_gzip"]
+    printc(f"Compressed uploads: {'unknown yet' if gz is None else ('yes' if gz else 'not supported by server')}", C.BLUE)
+    printc(f"Circuit breaker: {BREAKER.state}", C.BLUE)
+    stats = NET_STATS.snapshot()
+    if not stats:
+        printc("No requests yet.", C.YELLOW)
+        pause()
+        return
+    printc("\nLatency (TOTAL = what you waited, SERVER = network + server for the last attempt):", C.BLUE)
+    for i, line in enumerate(latency_lines(stats)):
+        printc(line, C.BOLD if i == 0 else C.CYAN)
+    printc("\nBytes:", C.BLUE)
+    for i, line in enumerate(traffic_lines(stats)):
+        printc(line, C.BOLD if i == 0 else C.CYAN)
     pause()
 
 # ---------- Account management ----------
@@ -571,13 +2487,14 @@ def action_delete_account():
 # ---------- Spam management ----------
 def action_view_spam_list():
     if not require_login_flow(): return
-    ok, resp = send_request("/fetch_mail", {"folder": "spam"})
-    if not ok:
-        printc(f"Failed to fetch spam folder: {resp}", C.RED); pause(); return
-    mails = resp.get("mails", [])
-    if not mails:
+    stream = StreamedResponse("/fetch_mail", {"folder": "spam"}, "mails", "spam")
+    count = 0
+    for count, m in enumerate(stream, 1):
+        printc(f"[{count}] {m.row()}", C.CYAN)
+    if not stream.ok:
+        printc(f"Failed to fetch spam folder: {stream.resp}", C.RED); pause(); return
+    if not count:
         printc("No spam mails.", C.YELLOW); pause(); return
-    pretty_mail_list(mails)
     pause()
 
 def action_add_spam_sender():
@@ -589,6 +2506,7 @@ def action_add_spam_sender():
     if not ok:
         printc(f"Add spam failed: {resp}", C.RED)
     else:
+        folders_changed("inbox", "spam")
         printc("Sender added to your spam list.", C.GREEN)
     pause()
 
@@ -601,51 +2519,210 @@ def action_remove_spam_sender():
     if not ok:
         printc(f"Remove spam failed: {resp}", C.RED)
     else:
+        folders_changed("inbox", "spam")
         printc("Sender removed from your spam list.", C.GREEN)
     pause()
 
+# ---------- terminal rendering ----------
+_ANSI_RE = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]")
+# rows left under a frame for prompts and messages before the terminal may scroll
+FRAME_MARGIN = 4
+
+class Screen:
+    # composes whole frames and writes each with a single write(); while the last frame is
+    # known to still be on screen only the rows that differ are rewritten (no clear, no flicker)
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lines = []
+        self._valid = False
+        self._size = None
+
+    def _tty(self):
+        try:
+            return self.stream.isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    def invalidate(self):
+        # something else printed: the next frame is drawn from a clean screen
+        self._valid = False
+
+    def clear(self):
+        self._valid = False
+        if self._tty():
+            self._write("\x1b[H\x1b[2J")
+
+    def render(self, lines):
+        lines = list(lines)
+        if not self._tty():
+            self._write("".join(line + "\n" for line in lines))
+            return
+        size = shutil.get_terminal_size()
+        fits = (len(lines) + FRAME_MARGIN < size.lines
+                and all(len(_ANSI_RE.sub("", line)) < size.columns for line in lines))
+        if self._valid and fits and size == self._size:
+            parts = [f"\x1b[{row + 1};1H{line}\x1b[K"
+                     for row, line in enumerate(lines)
+                     if row >= len(self._lines) or self._lines[row] != line]
+            # drop whatever is below the frame: old rows, the last prompt and its answer
+            parts.append(f"\x1b[{len(lines) + 1};1H\x1b[J")
+        else:
+            parts = ["\x1b[H\x1b[2J", "\n".join(lines), "\n"]
+        self._write("".join(parts))
+        self._lines = lines
+        self._size = size
+        self._valid = fits
+
+SCREEN = Screen()
+
 def clear_screen():
-    os.system("cls" if os.name == "nt" else "clear")
-    
-def check_server():
-    printc("Loading...", C.BLUE)
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(TIMEOUT)
-    try:
-        s.connect((DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT))
-        s.close()
+    SCREEN.clear()
+
+# ---------- server health ----------
+class HealthMonitor:
+    # probes the server in the background; the menu only reads the cached result
+    def __init__(self, interval=HEALTH_INTERVAL, ttl=HEALTH_TTL):
+        self.interval = interval
+        self.ttl = ttl
+        self.online = None
+        self.latency = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _target(self):
+        url = urlsplit(server_url())
+        port = url.port or (443 if url.scheme == "https" else 80)
+        return url.hostname or DEFAULT_SERVER_HOST, port
+
+    def report(self, online, latency=None):
+        with self._lock:
+            recovered = online and self.online is False
+            self.online = online
+            self.latency = latency if online else None
+            self.checked_at = time.time()
+        if recovered:
+            # connectivity is back: flush mails queued while offline
+            OUTBOX.wake()
+
+    def probe(self):
+        started = time.perf_counter()
+        try:
+            with socket.create_connection(self._target(), timeout=min(TIMEOUT, 3)):
+                pass
+        except OSError:
+            self.report(False)
+            return False
+        self.report(True, time.perf_counter() - started)
         return True
-    except Exception:
-        printc("Error connecting to server. Aborting...", C.RED)
-        time.sleep(1)
-        sys.exit(1)
+
+    def _run(self):
+        while True:
+            self.probe()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def status(self):
+        with self._lock:
+            online, checked_at, latency = self.online, self.checked_at, self.latency
+        if online is None or time.time() - checked_at > self.ttl:
+            self._wake.set()
+            return "unknown", None
+        return ("online" if online else "offline"), latency
+
+HEALTH = HealthMonitor()
+
+def check_server():
+    return HEALTH.probe()
+
+def server_indicator():
+    state, latency = HEALTH.status()
+    if BREAKER.state == "open":
+        # reachable or not, requests are being refused until the cool-down ends
+        return color(f"● server not responding — retrying in {BREAKER.retry_in():.0f}s", C.RED)
+    if state == "online":
+        return color(f"● online ({latency * 1000:.0f} ms)", C.GREEN)
+    if state == "offline":
+        return color("● offline — local mail only, changes need a connection", C.RED)
+    return color("● checking connection...", C.YELLOW)
+
+# ---------- startup ----------
+_INITIALIZED = False
+
+def init():
+    # everything with side effects happens here, not at import, so importing app stays cheap
+    global SERVER_URL, _INITIALIZED
+    if _INITIALIZED:
+        return
+    # only Windows consoles need help with ANSI; every colored string already ends in a reset
+    if hasattr(colorama, "just_fix_windows_console"):
+        colorama.just_fix_windows_console()
+    else:
+        colorama.init()
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+    load_config()
+    SERVER_URL = CONFIG.get("server_url", DEFAULT_SERVER)
+    BODY_CACHE.max_bytes = int(CONFIG.get("body_cache_bytes", BODY_CACHE_BYTES))
+    _INITIALIZED = True
 
 # ---------- Main menu ----------
 def main_menu():
+    init()
+    HEALTH.start()
+    OUTBOX.start()
+    WATCHER.start()
+    SCREEN.invalidate()
     while True:
-        check_server()
-        clear_screen()
         user = CONFIG.get("username")
-        print(f"{C.BOLD}{C.BLUE}╔══════════════════════════════════╗{C.END}")
-        print(f"{C.BOLD}{C.BLUE}║        OMX Mail Client           ║{C.END}")
-        print(f"{C.BOLD}{C.BLUE}╚══════════════════════════════════╝{C.END}")
+        frame = [
+            f"{C.BOLD}{C.BLUE}╔══════════════════════════════════╗{C.END}",
+            f"{C.BOLD}{C.BLUE}║        OMX Mail Client           ║{C.END}",
+            f"{C.BOLD}{C.BLUE}╚══════════════════════════════════╝{C.END}",
+            server_indicator(),
+        ]
         if user:
-            printc(f"Logged in as: {user}", C.GREEN)
+            printc(f"Logged in as: {user}", C.GREEN, frame)
+            outbox = outbox_indicator()
+            if outbox:
+                frame.append(outbox)
+            unread = unread_count()
         else:
-            printc("Not logged in", C.YELLOW)
-        printc("\nMain Menu:", C.CYAN)
-        printc("[1] Login / Register", C.CYAN)
-        printc("[2] Send Mail", C.CYAN)
-        printc("[3] Inbox", C.CYAN)
-        printc("[4] Sent", C.CYAN)
-        printc("[5] Deleted (Trash)", C.CYAN)
-        printc("[6] Spam folder", C.CYAN)
-        printc("[7] Search", C.CYAN)
-        printc("[8] Account settings", C.CYAN)
-        printc("[0] Quit", C.YELLOW)
-        printc("-" * 40, C.YELLOW)
+            unread = 0
+            printc("Not logged in", C.YELLOW, frame)
+        printc("\nMain Menu:", C.CYAN, frame)
+        printc("[1] Login / Register", C.CYAN, frame)
+        printc("[2] Send Mail", C.CYAN, frame)
+        if unread:
+            printc(f"[3] Inbox ({unread} new)", C.GREEN, frame)
+        else:
+            printc("[3] Inbox", C.CYAN, frame)
+        printc("[4] Sent", C.CYAN, frame)
+        printc("[5] Deleted (Trash)", C.CYAN, frame)
+        printc("[6] Spam folder", C.CYAN, frame)
+        printc("[7] Search", C.CYAN, frame)
+        printc("[8] Account settings", C.CYAN, frame)
+        printc("[9] Folder overview", C.CYAN, frame)
+        printc("[10] Outbox", C.CYAN, frame)
+        printc("[11] Network stats", C.CYAN, frame)
+        printc("[0] Quit", C.YELLOW, frame)
+        printc("-" * 40, C.YELLOW, frame)
+        SCREEN.render(frame)
 
         choice = input(f"{C.BLUE}Choice: {C.END}").strip()
+        # whatever runs next prints freely; redraw the menu from scratch afterwards
+        SCREEN.invalidate()
+        WATCHER.poke()
 
         if choice == "1":
             clear_screen()
@@ -669,6 +2746,7 @@ def main_menu():
 
         elif choice == "3":
             interactive_read("inbox")
+            mark_seen("inbox")
 
         elif choice == "4":
             interactive_read("sent")
@@ -705,10 +2783,527 @@ def main_menu():
             elif c == "3": action_delete_account()
             else: continue
 
+        elif choice == "9":
+            action_folder_overview()
+
+        elif choice == "10":
+            action_outbox()
+
+        elif choice == "11":
+            action_network_stats()
+
         elif choice == "0":
             printc("App exited", C.GREEN)
             sys.exit(0)
 
         else:
             printc("Invalid choice.", C.RED)
-            time.sleep(0.7)         
\ No newline at end of file
+            time.sleep(0.7)         
+
+# ---------- export / import ----------
+# Both stream: an export holds at most `concurrency` pages in memory, an import `concurrency`
+# batches. Progress is checkpointed next to the file after every window, so an interrupted run
+# picks up where it stopped when started again with the same arguments.
+_MBOX_ESCAPE_RE = re.compile(rb"^(>*From )", re.M)
+_MBOX_UNESCAPE_RE = re.compile(rb"^>(>*From )")
+
+def _load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def _drop_checkpoint(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _mbox_header(value):
+    from email.header import Header
+    value = " ".join(str(value).split())
+    return value if value.isascii() else Header(value, "utf-8").encode()
+
+def mbox_entry(mail):
+    # mboxrd: body lines starting with ">*From " get one more ">"
+    from email.utils import formatdate
+    ts = mail.timestamp or 0
+    sender = "".join((mail.sender or "").split()) or "MAILER-DAEMON"
+    headers = [("From", mail.sender), ("To", ", ".join(mail.to))]
+    if mail.cc:
+        headers.append(("Cc", ", ".join(mail.cc)))
+    if mail.bcc:
+        headers.append(("Bcc", ", ".join(mail.bcc)))
+    headers += [("Subject", mail.subject), ("Date", formatdate(ts)), ("X-OMX-Id", mail.id),
+                ("X-OMX-Folder", mail.folder), ("MIME-Version", "1.0"),
+                ("Content-Type", "text/plain; charset=utf-8"), ("Content-Transfer-Encoding", "8bit")]
+    if mail.attachments:
+        headers.append(("X-OMX-Attachments", json.dumps(mail.attachments)))
+    head = f"From {sender} {time.asctime(time.gmtime(ts))}\n" + "".join(
+        f"{name}: {_mbox_header(value)}\n" for name, value in headers if value is not None)
+    # every body gets one "\n" of its own before the separator, so _mail_from_message
+    # can strip exactly that and a body's own trailing newlines survive the round trip
+    body = (mail.message or "").replace("\r\n", "\n") + "\n"
+    return head.encode() + b"\n" + _MBOX_ESCAPE_RE.sub(rb">\1", body.encode()) + b"\n"
+
+def ndjson_entry(mail):
+    return (json.dumps(dict(mail.to_json(), folder=mail.folder), ensure_ascii=False) + "\n").encode()
+
+EXPORT_FORMATS = {"ndjson": ndjson_entry, "mbox": mbox_entry}
+
+def export_mailbox(path, fmt="ndjson", folders=MAIL_FOLDERS, concurrency=EXPORT_CONCURRENCY,
+                   export_page_size=EXPORT_PAGE_SIZE):
+    # path "-" writes to stdout (no checkpoint then); returns (ok, {"exported": n} | error)
+    encode = EXPORT_FORMATS[fmt]
+    folders = list(folders)
+    ckpt = None if path == "-" else path + ".checkpoint"
+    fresh = {"format": fmt, "folders": folders, "done": [], "folder": None, "offset": 0, "bytes": 0, "count": 0}
+    state = _load_checkpoint(ckpt) if ckpt else None
+    if (not state or state.get("format") != fmt or state.get("folders") != folders
+            or not os.path.exists(path) or os.path.getsize(path) < state["bytes"]):
+        state = fresh
+    if path == "-":
+        out = sys.stdout.buffer
+    else:
+        out = open(path, "r+b" if state["bytes"] else "wb")
+        out.truncate(state["bytes"])
+        out.seek(state["bytes"])
+    try:
+        for folder in folders:
+            if folder in state["done"]:
+                continue
+            offset = state["offset"] if state["folder"] == folder else 0
+            # ids of the previous window: mails arriving mid-export shift later pages down by a few
+            seen = set()
+            while True:
+                calls = [("/fetch_mail", {"folder": folder, "limit": export_page_size,
+                                          "offset": offset + i * export_page_size})
+                         for i in range(concurrency)]
+                finished, window_ids = False, set()
+                for ok, resp in send_requests(calls, concurrency=concurrency):
+                    if not ok:
+                        return False, dict(resp, exported=state["count"])
+                    rows = resp.get("mails", [])
+                    for m in Mail.from_list(rows, folder):
+                        if m.key not in seen:
+                            out.write(encode(m))
+                            state["count"] += 1
+                        window_ids.add(m.key)
+                    offset += len(rows)
+                    if len(rows) < export_page_size:
+                        finished = True
+                        break
+                seen = window_ids
+                out.flush()
+                if ckpt:
+                    os.fsync(out.fileno())
+                    state.update(folder=folder, offset=offset, bytes=out.tell())
+                    if finished:
+                        state["done"].append(folder)
+                    _save_checkpoint(ckpt, state)
+                if finished:
+                    break
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    if ckpt:
+        _drop_checkpoint(ckpt)
+    return True, {"exported": state["count"]}
+
+def _mail_from_message(msg):
+    # compat32 messages: the modern email policy parses about twenty times slower
+    from email.header import decode_header, make_header
+    from email.utils import getaddresses, parsedate_to_datetime
+
+    def header(name):
+        value = msg.get(name)
+        return str(make_header(decode_header(value))) if value else ""
+
+    def addresses(name):
+        return [addr or real for real, addr in getaddresses([header(name)]) if addr or real]
+
+    try:
+        ts = parsedate_to_datetime(msg.get("Date")).timestamp()
+    except (TypeError, ValueError):
+        ts = None
+    part = next((p for p in msg.walk() if p.get_content_type() == "text/plain"), None)
+    body = ""
+    if part is not None:
+        data = part.get_payload(decode=True) or b""
+        try:
+            body = data.decode(part.get_content_charset() or "utf-8", "replace")
+        except LookupError:
+            body = data.decode("utf-8", "replace")
+    if body.endswith("\n\n"):
+        body = body[:-2]  # the newline mbox_entry adds to every body, then the separator
+    elif body.endswith("\n"):
+        body = body[:-1]  # a last entry written without the blank separator line
+    sender = addresses("From")
+    return {"from": sender[0] if sender else "", "to": addresses("To"), "cc": addresses("Cc"),
+            "bcc": addresses("Bcc"), "subject": header("Subject"), "message": body,
+            "timestamp": ts, "folder": header("X-OMX-Folder") or None}
+
+def iter_mbox(f):
+    # yields (offset just past the entry, mail dict)
+    from email.parser import BytesParser
+    parser = BytesParser()
+    lines, blank = None, True
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line or (line.startswith(b"From ") and blank):
+            if lines:
+                yield pos, _mail_from_message(parser.parsebytes(b"".join(lines)))
+            if not line:
+                return
+            lines = []
+        elif lines is not None:
+            lines.append(_MBOX_UNESCAPE_RE.sub(rb"\1", line))
+        blank = line in (b"\n", b"\r\n")
+
+def iter_ndjson(f):
+    for line in iter(f.readline, b""):
+        if line.strip():
+            yield f.tell(), json.loads(line)
+
+_IMPORT_FIELDS = ("from", "to", "cc", "bcc", "subject", "message", "timestamp", "folder")
+
+def _import_calls(window, account, file_id):
+    # one Idempotency-Key per batch (or mail), derived from the file and position, so
+    # re-running an interrupted import never stores anything twice
+    def key(*parts):
+        return hashlib.sha256("\0".join(map(str, (account, *file_id, *parts))).encode()).hexdigest()[:32]
+
+    if SERVER_CAPS["bulk_import"] is not False:
+        return [("/import_mail", {"mails": batch}, {"Idempotency-Key": key(start, end)})
+                for start, end, batch in window]
+    # without /import_mail each mail is sent to ourselves; sender and date go into the body
+    return [("/send", {"to": [account], "subject": m["subject"] or "",
+                       "message": f"From: {m['from']}\nDate: {time.ctime(m['timestamp'] or 0)}\n\n"
+                                  f"{m['message'] or ''}"},
+             {"Idempotency-Key": key(start, i)})
+            for start, _, batch in window for i, m in enumerate(batch)]
+
+def _import_window(window, account, file_id, concurrency):
+    # returns (offset everything before which is stored, error or None)
+    calls = _import_calls(window, account, file_id)
+    results = send_requests(calls, concurrency=concurrency)
+    if SERVER_CAPS["bulk_import"] is None and results:
+        if not results[0][0] and results[0][1].get("unsupported"):
+            SERVER_CAPS["bulk_import"] = False
+            return _import_window(window, account, file_id, concurrency)
+        SERVER_CAPS["bulk_import"] = results[0][0] or None
+    if SERVER_CAPS["bulk_import"] is False:
+        # regroup the per-mail results by batch
+        it, grouped = iter(results), []
+        for _, _, batch in window:
+            mine = [next(it) for _ in batch]
+            grouped.append(next((r for r in mine if not r[0]), (True, {})))
+        results = grouped
+    done = window[0][0]
+    for (start, end, batch), (ok, resp) in zip(window, results):
+        if not ok:
+            return done, resp
+        done = end
+    return done, None
+
+def import_mailbox(path, fmt=None, folder=None, concurrency=EXPORT_CONCURRENCY, batch_size=IMPORT_BATCH):
+    # fmt None: mbox if the file starts with "From ", NDJSON otherwise; folder overrides the
+    # folder recorded in the file (inbox when there is none)
+    account = CONFIG.get("username")
+    st = os.stat(path)
+    file_id = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    ckpt = path + ".import-checkpoint"
+    state = _load_checkpoint(ckpt)
+    if not state or state.get("account") != account or state.get("file") != list(file_id):
+        state = {"account": account, "file": list(file_id), "offset": 0, "count": 0, "batch": batch_size}
+    # batches the interrupted run had in flight are only recognized if they split the same way
+    batch_size = state["batch"]
+    with open(path, "rb") as f:
+        if fmt is None:
+            fmt = "mbox" if f.read(5) == b"From " else "ndjson"
+        f.seek(state["offset"])
+        reader = iter_mbox(f) if fmt == "mbox" else iter_ndjson(f)
+        window, batch, start = [], [], state["offset"]
+
+        def flush():
+            done, err = _import_window(window, account, file_id, concurrency)
+            stored = 0
+            for s, _, b in window:
+                if s < done:
+                    stored += len(b)
+            state.update(offset=done, count=state["count"] + stored)
+            _save_checkpoint(ckpt, state)
+            window.clear()
+            return err
+
+        for end, mail in reader:
+            mail = {k: mail.get(k) for k in _IMPORT_FIELDS}
+            if folder or mail["folder"] not in MAIL_FOLDERS:
+                mail["folder"] = folder or "inbox"
+            batch.append(mail)
+            if len(batch) >= batch_size:
+                window.append((start, end, batch))
+                batch, start = [], end
+            if len(window) >= concurrency:
+                err = flush()
+                if err:
+                    return False, dict(err, imported=state["count"])
+        if batch:
+            window.append((start, end, batch))
+        if window:
+            err = flush()
+            if err:
+                return False, dict(err, imported=state["count"])
+    _drop_checkpoint(ckpt)
+    folders_changed(*MAIL_FOLDERS)
+    return True, {"imported": state["count"]}
+
+# ---------- Headless CLI ----------
+# `python app.py <command>` for scripts and cron jobs: no menus, no pauses, one JSON object per
+# line on stdout, errors as JSON on stderr and an exit status a shell can act on
+EXIT_OK = 0
+EXIT_FAILED = 1       # the server rejected the request, or some items failed
+EXIT_USAGE = 2        # argparse uses 2 for bad arguments as well
+EXIT_AUTH = 3         # not logged in, or the token expired
+EXIT_UNAVAILABLE = 4  # network or server trouble; worth retrying later
+EXIT_QUEUED = 5       # send only: not delivered yet but kept in the outbox, see cli_send
+
+def emit(obj, out=None):
+    (out or sys.stdout).write(json.dumps(obj, ensure_ascii=False) + "\n")
+
+def cli_error(resp, **extra):
+    # report a failed request and pick the exit status for it
+    emit({"error": resp.get("error") or "Unknown error", **extra}, sys.stderr)
+    if resp.get("auth"):
+        return EXIT_AUTH
+    return EXIT_UNAVAILABLE if resp.get("retry") else EXIT_FAILED
+
+def _cli_mail(mail):
+    d = mail.to_json()
+    if mail.folder:
+        d["folder"] = mail.folder
+    if mail.snippet:
+        d["snippet"] = mail.snippet
+    return d
+
+def _cli_fetch_page(folder, limit, offset, cursor, bodies):
+    if not bodies:
+        return fetch_mail_headers(folder, limit, offset, cursor)
+    payload = {"folder": folder, "limit": limit, "offset": offset}
+    if cursor is not None:
+        payload["cursor"] = cursor
+    ok, resp = send_request("/fetch_mail", payload, conditional=True)
+    return (True, MailPage.from_response(resp, folder)) if ok else (False, resp)
+
+def cli_login(args):
+    # OMX_PASSWORD, else a hidden prompt on a terminal, else the first line of piped stdin
+    password = os.environ.get("OMX_PASSWORD")
+    if password is None and sys.stdin.isatty():
+        password = getpass.getpass("Password: ")
+    elif password is None:
+        password = sys.stdin.readline().rstrip("\r\n")
+    ok, resp = send_request("/login", {"username": args.username, "password": password})
+    if not ok:
+        return cli_error(resp)
+    if not resp.get("token"):
+        return cli_error({"error": "Login did not return a token"})
+    CONFIG["username"] = args.username
+    CONFIG["token"] = resp["token"]
+    save_config()
+    emit({"ok": True, "username": args.username})
+    return EXIT_OK
+
+def cli_fetch(args):
+    # pages straight through to stdout; --all keeps going until the server runs out
+    remaining = None if args.all else (args.limit or page_size())
+    offset, cursor = args.offset, None
+    while remaining is None or remaining > 0:
+        size = SYNC_PAGE_SIZE if remaining is None else min(SYNC_PAGE_SIZE, remaining)
+        ok, mails = _cli_fetch_page(args.folder, size, offset, cursor, args.bodies)
+        if not ok:
+            return cli_error(mails, folder=args.folder, offset=offset)
+        for m in mails:
+            emit(_cli_mail(m))
+        sys.stdout.flush()
+        offset, cursor = offset + len(mails), mails.next_cursor
+        if remaining is not None:
+            remaining -= len(mails)
+        if len(mails) < size:
+            break
+    return EXIT_OK
+
+def cli_search(args):
+    folders = args.folder or list(MAIL_FOLDERS)
+    errors = []
+    for m in iter_search(args.query, folders, errors):
+        emit(_cli_mail(m))
+    for err in errors:
+        emit({"error": err}, sys.stderr)
+    return EXIT_FAILED if errors else EXIT_OK
+
+def cli_send(args):
+    # through the outbox: a send that fails with a retryable error stays queued (exit 5) and is
+    # delivered by the next interactive session. Running the same command again with
+    # --key KEY delivers that queued mail instead of queueing a second copy
+    account = CONFIG.get("username")
+    item = STORE.outbox_get(account, args.key) if args.key else None
+    if item is None:
+        message = sys.stdin.read() if args.stdin else (args.message or "")
+        to = parse_recipient_field(",".join(args.to))
+        if not to:
+            return cli_error({"error": "No recipients"})
+        payload = {"to": to, "cc": parse_recipient_field(",".join(args.cc)),
+                   "bcc": parse_recipient_field(",".join(args.bcc)), "subject": args.subject, "message": message}
+        files = [os.path.abspath(os.path.expanduser(p)) for p in args.attach]
+        missing = [p for p in files if not os.path.isfile(p)]
+        if missing:
+            return cli_error({"error": f"Not a file: {missing[0]}"})
+        if files:
+            payload["files"] = files
+        key = args.key or new_idempotency_key()
+        STORE.outbox_add(account, key, payload)
+        item = STORE.outbox_get(account, key)
+    key = item["key"]
+    if item["status"] == "pending":
+        OUTBOX.deliver(item)
+        item = STORE.outbox_get(account, key)
+    if item["status"] == "sent":
+        emit({"ok": True, "key": key, "mail_id": item["mail_id"]})
+        return EXIT_OK
+    if item["status"] == "failed":
+        return cli_error({"error": item["last_error"]}, key=key, queued=False)
+    emit({"error": item["last_error"], "key": key, "queued": True}, sys.stderr)
+    return EXIT_QUEUED
+
+def _cli_ids(values):
+    # "1,2,3" or "-" for ids on stdin: one per line, bare or as the NDJSON `fetch` prints
+    ids = []
+    for value in values:
+        lines = sys.stdin if value == "-" else value.split(",")
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            mail_id = json.loads(line).get("id") if line.startswith("{") else line
+            ids.append(int(mail_id) if str(mail_id).isdigit() else mail_id)
+    return ids
+
+def cli_delete(args):
+    ids = _cli_ids(args.ids)
+    calls = [("/delete_mail", {"mail_id": i, "folder": args.folder}) for i in ids]
+    results = send_requests(calls, concurrency=int(CONFIG.get("bulk_concurrency", BULK_CONCURRENCY)))
+    status = EXIT_OK
+    for mail_id, (ok, resp) in zip(ids, results):
+        if ok:
+            store_mail_deleted(args.folder, mail_id)
+            emit({"id": mail_id, "ok": True})
+        else:
+            emit({"id": mail_id, "ok": False, "error": resp.get("error") or "Unknown error"})
+            if status == EXIT_OK or resp.get("auth"):
+                status = cli_error(resp, id=mail_id)
+    return status
+
+def cli_export(args):
+    ok, resp = export_mailbox(args.output, args.format, args.folder or MAIL_FOLDERS, args.concurrency,
+                              args.page_size)
+    if not ok:
+        return cli_error(resp, exported=resp.get("exported"))
+    emit(dict(resp, ok=True), sys.stderr if args.output == "-" else None)
+    return EXIT_OK
+
+def cli_import(args):
+    if not os.path.isfile(args.file):
+        return cli_error({"error": f"Not a file: {args.file}"})
+    ok, resp = import_mailbox(args.file, args.format, args.folder, args.concurrency, args.batch)
+    if not ok:
+        return cli_error(resp, imported=resp.get("imported"))
+    emit(dict(resp, ok=True))
+    return EXIT_OK
+
+def cli_parser():
+    import argparse
+    p = argparse.ArgumentParser(prog="app.py", description="OMX mail client. Without a command the "
+                                "interactive menu starts; with one, results are printed as NDJSON.")
+    p.add_argument("--server", help="server URL for this run; `login` saves it along with the token")
+    sub = p.add_subparsers(dest="command", metavar="COMMAND")
+
+    c = sub.add_parser("login", help="log in and save the token (password from $OMX_PASSWORD or stdin)")
+    c.add_argument("username")
+    c.set_defaults(func=cli_login, auth=False)
+
+    c = sub.add_parser("fetch", help="list mails in a folder, newest first")
+    c.add_argument("--folder", default="inbox", choices=MAIL_FOLDERS)
+    c.add_argument("--limit", type=int, help="default: the page_size setting")
+    c.add_argument("--offset", type=int, default=0)
+    c.add_argument("--all", action="store_true", help="every mail in the folder")
+    c.add_argument("--bodies", action="store_true", help="include message bodies")
+    c.set_defaults(func=cli_fetch)
+
+    c = sub.add_parser("search", help="search mails (locally when the folder is synced)")
+    c.add_argument("query")
+    c.add_argument("--folder", action="append", choices=MAIL_FOLDERS, help="repeatable; default: all")
+    c.set_defaults(func=cli_search)
+
+    c = sub.add_parser("send", help="send a mail")
+    c.add_argument("--to", action="append", default=[], help="comma separated, repeatable")
+    c.add_argument("--cc", action="append", default=[])
+    c.add_argument("--bcc", action="append", default=[])
+    c.add_argument("--subject", default="")
+    body = c.add_mutually_exclusive_group()
+    body.add_argument("--message")
+    body.add_argument("--stdin", action="store_true", help="read the message body from stdin")
+    c.add_argument("--attach", action="append", default=[], metavar="FILE")
+    c.add_argument("--key", help="idempotency key; repeating a send with the same key never sends twice")
+    c.set_defaults(func=cli_send)
+
+    c = sub.add_parser("delete", help="move mails to deleted (or remove them from deleted)")
+    c.add_argument("--ids", action="append", required=True, help="comma separated, or - to read stdin")
+    c.add_argument("--folder", default="inbox", choices=MAIL_FOLDERS)
+    c.set_defaults(func=cli_delete)
+
+    c = sub.add_parser("export", help="write a whole mailbox to a file; re-run to resume")
+    c.add_argument("-o", "--output", required=True, help="file, or - for stdout (no resume then)")
+    c.add_argument("--format", choices=tuple(EXPORT_FORMATS), default="ndjson")
+    c.add_argument("--folder", action="append", choices=MAIL_FOLDERS, help="repeatable; default: all")
+    c.add_argument("--concurrency", type=int, default=EXPORT_CONCURRENCY)
+    c.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    c.set_defaults(func=cli_export)
+
+    c = sub.add_parser("import", help="load an mbox or NDJSON export into your mailbox; re-run to resume")
+    c.add_argument("file")
+    c.add_argument("--format", choices=tuple(EXPORT_FORMATS), help="default: detected from the file")
+    c.add_argument("--folder", choices=MAIL_FOLDERS, help="put everything here instead of the recorded folders")
+    c.add_argument("--concurrency", type=int, default=EXPORT_CONCURRENCY)
+    c.add_argument("--batch", type=int, default=IMPORT_BATCH, help="mails per request")
+    c.set_defaults(func=cli_import)
+    return p
+
+def cli(argv=None):
+    args = cli_parser().parse_args(argv)
+    init()
+    if args.server:
+        CONFIG["server_url"] = args.server
+    if args.command is None:
+        main_menu()
+        return EXIT_OK
+    if getattr(args, "auth", True) and not ensure_logged_in():
+        return cli_error({"error": "Not logged in; run `app.py login USERNAME` first", "auth": True})
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # the reader (head, grep -m) went away; that is not an error
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# OMX client benchmarks
+# Drives the real client code paths (send_request, list_folder paging, search, the outbox send,
+# bulk delete, HTTPXAdminClient) headlessly against the reference server in server.py, over a
+# sweep of mailbox sizes and simulated round-trip times. Each scenario runs in fresh processes:
+# one for the server, one for the client, so peak RSS is the client's own.
+#
+#   python bench.py                                    # quick: 100 and 1000 mails, 0 and 20 ms
+#   python bench.py --sizes 100,1000,10000,100000 --rtts 0,20,80 -o results.json
+#   python bench.py --compare baseline.json            # run, then flag regressions (exit 1)
+#   python bench.py --compare baseline.json --results results.json   # compare without running
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = (100, 1000)
+DEFAULT_RTTS = (0, 20)
+PASSWORD = "benchpassword"
+SENDERS = 50
+WORDS = ("quarterly", "report", "invoice", "meeting", "launch", "budget", "review", "travel", "design",
+         "release", "offsite", "contract", "roadmap", "hiring", "security", "backup", "migration", "demo")
+QUERIES = ("invoice", "roadmap review", "security", "launch budget", "migr")
+SERVER_START_TIMEOUT = 15
+REGRESSION_THRESHOLD = 0.15
+
+# lower is better unless listed in HIGHER_IS_BETTER; changes smaller than the floor are noise
+METRIC_FLOORS = {"p50_ms": 1.0, "p99_ms": 2.0, "bytes": 512, "ops_per_s": 0.0, "peak_rss_kb": 2048}
+HIGHER_IS_BETTER = {"ops_per_s"}
+
+# ---------- seeding ----------
+def _mails(n: int, owner: str) -> list[dict]:
+    rng = random.Random(n)
+    now = time.time()
+    return [{
+        "from": f"sender{i % SENDERS}",
+        "to": [owner],
+        "subject": " ".join(rng.sample(WORDS, 3)).capitalize() + f" #{i}",
+        "message": " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))),
+        "timestamp": now - (n - i) * 60,
+    } for i in range(n)]
+
+def seed(data_dir: str, size: int) -> None:
+    from server import MailServer
+    state = MailServer(data_dir)
+    state.add_user("bench", PASSWORD)
+    state.add_user("benchadmin", PASSWORD, "admin")
+    for i in range(SENDERS):
+        state.add_user(f"sender{i}", PASSWORD)
+    state.import_mails("bench", "inbox", _mails(size, "bench"))
+    state.close()
+
+# ---------- server process ----------
+def start_server(data_dir: str, rtt_ms: float) -> tuple[subprocess.Popen, str]:
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "server.py"), "--port", "0", "--data-dir", data_dir,
+         "--latency", str(rtt_ms)],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        line = proc.stdout.readline()
+        m = re.search(r"(http://\S+)", line or "")
+        if m:
+            return proc, m.group(1)
+        if proc.poll() is not None:
+            break
+    proc.kill()
+    raise RuntimeError("reference server did not start")
+
+# ---------- client side (runs in its own process) ----------
+class Recorder:
+    def __init__(self, stats):
+        self.stats = stats
+        self.ops: dict[str, dict] = {}
+
+    def _wire(self) -> int:
+        return sum(e["wire_in"] + e["wire_out"] for e in self.stats().snapshot().values())
+
+    def run(self, name: str, func, repeat: int = 1, items: int = 1) -> None:
+        samples = []
+        before = self._wire()
+        for i in range(repeat):
+            started = time.perf_counter()
+            func(i)
+            samples.append(time.perf_counter() - started)
+        self.add(name, samples, self._wire() - before, items * repeat)
+
+    def add(self, name: str, samples: list[float], nbytes: int, items: int) -> None:
+        samples = sorted(samples)
+        total = sum(samples)
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))] * 1000
+
+        self.ops[name] = {"count": len(samples), "items": items, "total_s": round(total, 4),
+                          "ops_per_s": round(items / total, 2) if total else None,
+                          "p50_ms": round(pct(50), 3), "p99_ms": round(pct(99), 3), "bytes": nbytes}
+
+def _peak_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def run_client(url: str, work_dir: str, size: int) -> dict:
+    sys.path.insert(0, BASE_DIR)
+    import app
+    # keep the user's real config and mail store out of it
+    app.CONFIG_FILE = os.path.join(work_dir, "client_config.json")
+    app.CONFIG = {"server_url": url}
+    app.SERVER_URL = url
+    app.STORE = app.MailStore(os.path.join(work_dir, "store.sqlite3"))
+    rec = Recorder(lambda: app.NET_STATS)
+
+    def login(_):
+        ok, resp = app.send_request("/login", {"username": "bench", "password": PASSWORD})
+        if not ok:
+            raise RuntimeError(f"login failed: {resp}")
+        app.CONFIG.update(username="bench", token=resp["token"])
+
+    rec.run("login", login)
+    pages = max(1, min(10, size // app.PAGE_SIZE))
+    rng = random.Random(size)
+    rec.run("send_request.fetch_mail", lambda i: app.send_request(
+        "/fetch_mail", {"folder": "inbox", "limit": app.PAGE_SIZE, "offset": rng.randrange(max(1, size))}),
+        repeat=20)
+    rec.run("list_folder.server", lambda i: app.list_folder("inbox", i, out=[]), repeat=pages)
+    rec.run("search.server", lambda i: app.search_mails(QUERIES[i % len(QUERIES)], ["inbox"]), repeat=len(QUERIES))
+    # wait for the syncs the server-side searches started, so the full sync below is measured alone
+    while app._SYNC_RUNNING:
+        time.sleep(0.05)
+    app.STORE.clear("bench", "inbox")
+    app.ETAGS = app.ETagCache()  # a cold sync, not 304s for the pages the searches fetched
+    rec.run("sync.full", lambda i: app.sync_folder("inbox"), items=size)
+    rec.run("sync.idle", lambda i: app.sync_folder("inbox"), repeat=5)
+    rec.run("list_folder.local", lambda i: app.list_folder("inbox", i % pages, out=[]), repeat=20)
+    rec.run("search.local", lambda i: app.search_mails(QUERIES[i % len(QUERIES)], ["inbox"]), repeat=len(QUERIES))
+
+    def send(i):
+        key = app.new_idempotency_key()
+        payload = {"to": [f"sender{i % SENDERS}"], "cc": [], "bcc": [], "subject": f"bench {i}",
+                   "message": " ".join(WORDS)}
+        app.STORE.outbox_add("bench", key, payload)
+        item = next(it for it in app.STORE.outbox_list("bench", ("pending",)) if it["key"] == key)
+        if not app.OUTBOX.deliver(item):
+            raise RuntimeError("send failed")
+
+    rec.run("send.outbox", send, repeat=20)
+
+    batch = max(1, min(50, size // 4))
+    samples, before = [], rec._wire()
+    for _ in range(3):
+        mails = app.STORE.page("bench", "inbox", 0, batch)
+        started = time.perf_counter()
+        total, done, failed = app.bulk_mail_action("delete", "inbox", mails)
+        samples.append(time.perf_counter() - started)
+        if failed:
+            raise RuntimeError(f"bulk delete failed: {failed[0]}")
+    rec.add("bulk_delete", samples, rec._wire() - before, batch * len(samples))
+
+    rec.ops.update(run_admin(url, rec))
+    return {"ops": rec.ops, "peak_rss_kb": _peak_rss_kb()}
+
+def run_admin(url: str, rec: Recorder) -> dict:
+    import asyncio
+    from admin import HTTPXAdminClient
+
+    async def go():
+        client = HTTPXAdminClient(url)
+        out = Recorder(lambda: client.transport.stats)
+        samples = []
+        started = time.perf_counter()
+        await client.login("benchadmin", PASSWORD)
+        out.add("admin.login", [time.perf_counter() - started], 0, 1)
+        for name, call in (("admin.list_users", lambda i: client.list_users()),
+                           ("admin.ban_unban", lambda i: _ban_unban(client, f"sender{i % SENDERS}"))):
+            samples, before = [], out._wire()
+            for i in range(10):
+                started = time.perf_counter()
+                await call(i)
+                samples.append(time.perf_counter() - started)
+            out.add(name, samples, out._wire() - before, len(samples))
+        await client.close()
+        return out.ops
+
+    return asyncio.run(go())
+
+async def _ban_unban(client, user: str) -> None:
+    await client.ban_user(user)
+    await client.unban_user(user)
+
+# ---------- orchestration ----------
+def run_scenario(work_root: str, template: str, size: int, rtt: float) -> dict:
+    scenario_dir = os.path.join(work_root, f"run-{size}-{rtt:g}")
+    shutil.rmtree(scenario_dir, ignore_errors=True)
+    shutil.copytree(template, os.path.join(scenario_dir, "server"))
+    os.makedirs(os.path.join(scenario_dir, "client"))
+    proc, url = start_server(os.path.join(scenario_dir, "server"), rtt)
+    try:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--client", url, "--client-dir",
+             os.path.join(scenario_dir, "client"), "--sizes", str(size)],
+            capture_output=True, text=True, check=False)
+    finally:
+        proc.terminate()
+        proc.wait(5)
+    if out.returncode != 0:
+        raise RuntimeError(f"client run failed ({size} mails, {rtt:g} ms):\n{out.stderr.strip()}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return {"size": size, "rtt_ms": rtt, **result}
+
+def run_suite(sizes, rtts, work_root: str, log=print) -> dict:
+    scenarios = []
+    for size in sizes:
+        template = os.path.join(work_root, f"seed-{size}")
+        if not os.path.exists(os.path.join(template, "omx.sqlite3")):
+            log(f"seeding {size} mails...")
+            seed(template, size)
+        for rtt in rtts:
+            log(f"running {size} mails @ {rtt:g} ms RTT...")
+            scenarios.append(run_scenario(work_root, template, size, rtt))
+    return {
+        "meta": {"created": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+                 "cpu_count": os.cpu_count()},
+        "scenarios": scenarios,
+    }
+
+def _scenario_key(s: dict) -> tuple:
+    return s["size"], float(s["rtt_ms"])
+
+def compare(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """Human-readable lines, one per metric that got worse by more than `threshold`."""
+    base = {_scenario_key(s): s for s in baseline.get("scenarios", [])}
+    regressions = []
+    for s in current.get("scenarios", []):
+        b = base.get(_scenario_key(s))
+        if b is None:
+            continue
+        label = f"{s['size']} mails @ {s['rtt_ms']:g} ms"
+        pairs = [("peak_rss_kb", b.get("peak_rss_kb"), s.get("peak_rss_kb"))]
+        for op, m in s["ops"].items():
+            bm = b["ops"].get(op)
+            if bm:
+                pairs += [(f"{op}.{k}", bm.get(k), m.get(k)) for k in ("p50_ms", "p99_ms", "ops_per_s", "bytes")]
+        for name, old, new in pairs:
+            if old is None or new is None:
+                continue
+            metric = name.rsplit(".", 1)[-1]
+            worse = old - new if metric in HIGHER_IS_BETTER else new - old
+            if worse > METRIC_FLOORS.get(metric, 0) and worse > abs(old) * threshold:
+                change = (new - old) / old * 100 if old else float("inf")
+                regressions.append(f"{label}: {name} {old:g} -> {new:g} ({change:+.0f}%)")
+    return regressions
+
+def format_table(results: dict) -> list[str]:
+    lines = []
+    for s in results["scenarios"]:
+        rss = s.get("peak_rss_kb")
+        lines.append(f"== {s['size']} mails @ {s['rtt_ms']:g} ms RTT"
+                     + (f"  (peak RSS {rss / 1024:.1f} MiB)" if rss else ""))
+        lines.append(f"   {'operation':26} {'n':>4} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'bytes':>11}")
+        for op, m in s["ops"].items():
+            lines.append(f"   {op:26} {m['count']:>4} {m['ops_per_s'] or 0:>10.1f} {m['p50_ms']:>9.2f} "
+                         f"{m['p99_ms']:>9.2f} {m['bytes']:>11,}")
+    return lines
+
+def _numbers(text: str, kind=int) -> list:
+    return [kind(x) for x in text.split(",") if x.strip()]
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="OMX client benchmarks")
+    p.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="mailbox sizes, comma separated")
+    p.add_argument("--rtts", default=",".join(map(str, DEFAULT_RTTS)), help="simulated RTTs in ms, comma separated")
+    p.add_argument("-o", "--output", help="write the results as JSON here")
+    p.add_argument("--compare", metavar="BASELINE", help="flag regressions against a stored result file")
+    p.add_argument("--results", help="with --compare: compare this file instead of running")
+    p.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="relative change that counts")
+    p.add_argument("--work-dir", help="seeded databases are kept here and reused (default: temporary)")
+    p.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    p.add_argument("--client", help=argparse.SUPPRESS)
+    p.add_argument("--client-dir", help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.client:
+        print(json.dumps(run_client(args.client, args.client_dir, _numbers(args.sizes)[0])))
+        return 0
+
+    if args.results:
+        with open(args.results, encoding="utf-8") as f:
+            results = json.load(f)
+    else:
+        work_root = args.work_dir or tempfile.mkdtemp(prefix="omx-bench-")
+        try:
+            results = run_suite(_numbers(args.sizes), _numbers(args.rtts, float), work_root,
+                                log=lambda msg: print(msg, file=sys.stderr))
+        finally:
+            if not args.work_dir:
+                shutil.rmtree(work_root, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2) if args.json else "\n".join(format_table(results)))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:", file=sys.stderr)
+            for line in regressions:
+                print("  " + line, file=sys.stderr)
+            return 1
+        print(f"\nNo regressions against {args.compare}.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+# OMX full-screen mail browser
+# app.py imports this on demand, so prompt_toolkit is never loaded at startup. The list is
+# virtualized: prompt_toolkit only asks for the rows it is about to paint, and those rows are
+# read from the local store in chunks. A folder with thousands of mails costs about the same as
+# one page, and scrolling never touches the server.
+
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from prompt_toolkit.application import Application
+from prompt_toolkit.data_structures import Point
+from prompt_toolkit.filters import Condition
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.layout import ConditionalContainer, HSplit, Layout, Window
+from prompt_toolkit.layout.controls import FormattedTextControl, UIContent, UIControl
+from prompt_toolkit.layout.dimension import Dimension
+from prompt_toolkit.mouse_events import MouseEventType
+from prompt_toolkit.styles import Style
+
+CHUNK_ROWS = 200
+MAX_CHUNKS = 16
+POLL_INTERVAL = 0.5
+BODY_DELAY = 0.15  # wait for the selection to settle before loading a body
+
+STYLE = Style.from_dict({
+    "row": "",
+    "row.selected": "reverse",
+    "row.date": "#5f87af",
+    "row.sender": "#87af87",
+    "preview": "bg:#1c1c1c #d0d0d0",
+    "preview.header": "bold #87afd7",
+    "status": "reverse",
+    "status.message": "reverse bold",
+})
+
+class MailRows:
+    """Read-through view of one folder in the local store, fetched in chunks on demand."""
+    def __init__(self, source):
+        self.source = source
+        self.count = 0
+        self._chunks: OrderedDict[int, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reload(self) -> int:
+        count = self.source.count()
+        with self._lock:
+            self.count = count
+            self._chunks.clear()
+        return count
+
+    def get(self, index: int):
+        if index < 0 or index >= self.count:
+            return None
+        n, pos = divmod(index, CHUNK_ROWS)
+        with self._lock:
+            chunk = self._chunks.get(n)
+            if chunk is not None:
+                self._chunks.move_to_end(n)
+        if chunk is None:
+            chunk = self.source.rows(n * CHUNK_ROWS, CHUNK_ROWS)
+            with self._lock:
+                self._chunks[n] = chunk
+                while len(self._chunks) > MAX_CHUNKS:
+                    self._chunks.popitem(last=False)
+        return chunk[pos] if pos < len(chunk) else None
+
+    def find(self, key: str, start: int, stop: int) -> Optional[int]:
+        for i in range(max(0, start), min(self.count, stop)):
+            m = self.get(i)
+            if m is not None and m.key == key:
+                return i
+        return None
+
+def _row_text(mail, width: int) -> list[tuple[str, str]]:
+    date = time.strftime("%Y-%m-%d %H:%M", time.localtime(mail.timestamp or 0))
+    sender = (mail.sender or "")[:20].ljust(20)
+    subject = mail.subject or "(no subject)"
+    room = max(0, width - len(date) - len(sender) - 5)
+    return [("class:row.date", f" {date}  "), ("class:row.sender", sender), ("", f"  {subject[:room]}")]
+
+class MailListControl(UIControl):
+    def __init__(self, browser: "MailBrowser"):
+        self.browser = browser
+
+    def is_focusable(self) -> bool:
+        return True
+
+    def create_content(self, width: int, height: int) -> UIContent:
+        rows, selected = self.browser.rows, self.browser.selected
+
+        def get_line(i):
+            mail = rows.get(i)
+            if mail is None:
+                return [("class:row", " …")]
+            fragments = _row_text(mail, width)
+            if i == selected:
+                return [("class:row.selected " + style, text) for style, text in fragments]
+            return fragments
+
+        return UIContent(get_line=get_line, line_count=rows.count,
+                         cursor_position=Point(0, max(0, selected)), show_cursor=False)
+
+    def mouse_handler(self, mouse_event):
+        if mouse_event.event_type == MouseEventType.MOUSE_UP:
+            self.browser.select(mouse_event.position.y)
+            return None
+        if mouse_event.event_type == MouseEventType.SCROLL_DOWN:
+            self.browser.select(self.browser.selected + 3)
+            return None
+        if mouse_event.event_type == MouseEventType.SCROLL_UP:
+            self.browser.select(self.browser.selected - 3)
+            return None
+        return NotImplemented
+
+class MailBrowser:
+    """Full-screen list + preview for one folder. `source` is app.FolderView (or anything with
+    the same methods); this module never imports app."""
+    def __init__(self, source):
+        self.source = source
+        self.rows = MailRows(source)
+        self.selected = 0
+        self.preview = True
+        self.message = ""
+        self._bodies: dict[str, Optional[str]] = {}
+        self._body_wanted: Optional[str] = None
+        self._body_event = threading.Event()
+        self._stop = threading.Event()
+        self.list_window = Window(MailListControl(self), always_hide_cursor=True)
+        self.app = self._build_app()
+
+    # ---- state ----
+    def current(self):
+        return self.rows.get(self.selected)
+
+    def select(self, index: int) -> None:
+        if not self.rows.count:
+            self.selected = 0
+            return
+        self.selected = max(0, min(self.rows.count - 1, index))
+        self._want_body()
+
+    def _page(self) -> int:
+        info = self.list_window.render_info
+        return max(1, (info.window_height if info else 10) - 1)
+
+    def reload(self) -> None:
+        # keep the same mail selected when new ones arrive above it
+        before = self.current()
+        old_count = self.rows.count
+        count = self.rows.reload()
+        if before is not None and count:
+            at = self.rows.find(before.key, self.selected, self.selected + max(0, count - old_count) + 1)
+            if at is not None:
+                self.selected = at
+        self.select(self.selected)
+        self.app.invalidate()
+
+    def notify(self, message: str) -> None:
+        self.message = message
+        self.app.invalidate()
+
+    # ---- background work ----
+    def _want_body(self) -> None:
+        mail = self.current()
+        if self.preview and mail is not None and mail.key not in self._bodies:
+            self._body_wanted = mail.key
+            self._body_event.set()
+
+    def _body_loader(self) -> None:
+        while not self._stop.is_set():
+            self._body_event.wait()
+            self._body_event.clear()
+            time.sleep(BODY_DELAY)
+            if self._body_event.is_set() or self._stop.is_set():
+                continue  # still moving; wait for the next settle
+            mail = self.current()
+            if mail is None or mail.key != self._body_wanted or mail.key in self._bodies:
+                continue
+            try:
+                self._bodies[mail.key] = self.source.body(mail)
+            except Exception as e:
+                self._bodies[mail.key] = None
+                self.message = f"Could not load body: {e}"
+            self.app.invalidate()
+
+    def _poller(self) -> None:
+        # picks up mails the background sync and the new-mail watcher write to the store
+        was_syncing = True
+        while not self._stop.wait(POLL_INTERVAL):
+            syncing = self.source.syncing()
+            if self.source.count() != self.rows.count or (was_syncing and not syncing):
+                self.reload()
+            was_syncing = syncing
+
+    def _run_action(self, name: str) -> None:
+        mail = self.current()
+        action = self.source.actions().get(name)
+        if mail is None or action is None:
+            return
+        label, func = action
+        self.notify(f"{label}…")
+
+        def run():
+            try:
+                ok, msg = func(mail)
+            except Exception as e:
+                ok, msg = False, str(e)
+            self.message = msg
+            if ok:
+                self._bodies.pop(mail.key, None)
+                self.reload()
+            self.app.invalidate()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # ---- rendering ----
+    def _preview_text(self):
+        mail = self.current()
+        if mail is None:
+            return [("class:preview", " No mails in this folder yet." if not self.source.syncing()
+                     else " Loading…")]
+        lines = [
+            ("class:preview.header", " From:    "), ("class:preview", f"{mail.sender}\n"),
+            ("class:preview.header", " To:      "), ("class:preview", f"{', '.join(mail.to)}\n"),
+        ]
+        if mail.cc:
+            lines += [("class:preview.header", " CC:      "), ("class:preview", f"{', '.join(mail.cc)}\n")]
+        lines += [
+            ("class:preview.header", " Subject: "), ("class:preview", f"{mail.subject}\n"),
+            ("class:preview.header", " Date:    "), ("class:preview", f"{time.ctime(mail.timestamp or 0)}\n\n"),
+        ]
+        if mail.message is not None:
+            body = mail.message
+        elif mail.key in self._bodies:
+            body = self._bodies[mail.key]
+            body = "(message body could not be loaded)" if body is None else body
+        else:
+            body = "Loading…"
+        lines.append(("class:preview", body))
+        return lines
+
+    def _status_text(self):
+        count = self.rows.count
+        pos = f"{self.selected + 1}/{count}" if count else "0/0"
+        sync = "  syncing…" if self.source.syncing() else ""
+        keys = "↑↓ PgUp/PgDn g/G move  Enter preview  " + "  ".join(
+            f"{k} {label.lower()}" for k, (label, _) in self.source.actions().items()) + "  R refresh  q quit"
+        left = f" {self.source.folder.upper()}  {pos}{sync}  {self.source.status()}"
+        return [("class:status", left + "  "), ("class:status.message", self.message),
+                ("class:status", "  " + keys)]
+
+    def _build_app(self) -> Application:
+        kb = KeyBindings()
+
+        @kb.add("down")
+        @kb.add("j")
+        def _down(event):
+            self.select(self.selected + 1)
+
+        @kb.add("up")
+        @kb.add("k")
+        def _up(event):
+            self.select(self.selected - 1)
+
+        @kb.add("pagedown")
+        @kb.add("space")
+        def _pgdn(event):
+            self.select(self.selected + self._page())
+
+        @kb.add("pageup")
+        def _pgup(event):
+            self.select(self.selected - self._page())
+
+        @kb.add("home")
+        @kb.add("g")
+        def _home(event):
+            self.select(0)
+
+        @kb.add("end")
+        @kb.add("G")
+        def _end(event):
+            self.select(self.rows.count - 1)
+
+        @kb.add("enter")
+        @kb.add("p")
+        def _toggle_preview(event):
+            self.preview = not self.preview
+            self._want_body()
+
+        @kb.add("R")
+        @kb.add("f5")
+        def _refresh(event):
+            self.source.refresh()
+            self.notify("Refreshing…")
+
+        for key in ("d", "s", "r"):
+            kb.add(key)(lambda event, key=key: self._run_action(key))
+
+        @kb.add("q")
+        @kb.add("escape")
+        @kb.add("c-c")
+        def _quit(event):
+            event.app.exit()
+
+        preview = ConditionalContainer(
+            HSplit([
+                Window(height=1, char="─"),
+                Window(FormattedTextControl(self._preview_text), wrap_lines=True, style="class:preview"),
+            ], height=Dimension(weight=2)),
+            filter=Condition(lambda: self.preview),
+        )
+        body = HSplit([
+            HSplit([self.list_window], height=Dimension(weight=3)),
+            preview,
+            Window(FormattedTextControl(self._status_text), height=1, style="class:status"),
+        ])
+        return Application(layout=Layout(body, focused_element=self.list_window), key_bindings=kb,
+                           style=STYLE, full_screen=True, mouse_support=True)
+
+    def run(self) -> None:
+        self.rows.reload()
+        self.select(0)
+        self.source.refresh()
+        threads = [threading.Thread(target=self._body_loader, daemon=True),
+                   threading.Thread(target=self._poller, daemon=True)]
+        for t in threads:
+            t.start()
+        try:
+            self.app.run()
+        finally:
+            self._stop.set()
+            self._body_event.set()
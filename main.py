@@ -7,6 +7,7 @@
 # - non-destructive pip install to local target
 # - resilient to network issues, EOFError, KeyboardInterrupt
 # - logging, silent/verbose modes, CLI flags
+# - --startup-check: import-time budget for app.py with a per-module breakdown
 # - atomic file writes, thread-safe loader
 
 from __future__ import annotations
@@ -42,11 +43,19 @@ REQ_FILE = os.path.join(BASE_DIR, "requirements.txt")
 
 APP_URL = "https://raw.githubusercontent.com/optimum-modern-exchange/omx/refs/heads/main/app.py"
 MAIN_URL = "https://raw.githubusercontent.com/optimum-modern-exchange/omx/refs/heads/main/main.py"
+# modules app.py imports; updated together with it so the import test sees matching versions
+MODULE_URLS = {
+    "transport.py": "https://raw.githubusercontent.com/optimum-modern-exchange/omx/refs/heads/main/transport.py",
+    "browser.py": "https://raw.githubusercontent.com/optimum-modern-exchange/omx/refs/heads/main/browser.py",
+}
 REQ_URL = "https://raw.githubusercontent.com/optimum-modern-exchange/omx/refs/heads/main/requirements.txt"
 
 LOG_PATH = os.path.join(BASE_DIR, "launcher_update.log")
 TIMEOUT = 8  # seconds for network ops
 LOADER_JOIN_TIMEOUT = 2.0
+STARTUP_BUDGET_MS = 80  # import app + app.init(), measured by --startup-check
+# must not be imported before the user needs them (see app.py)
+LAZY_MODULES = ("prompt_toolkit", "httpx", "asyncio")
 
 # -------- runtime flags (set by CLI) --------
 FLAGS = {
@@ -388,6 +397,7 @@ def update_files(force: bool = False) -> None:
     req_path = os.path.join(UPDATE_DIR, "requirements.txt")
     app_path = os.path.join(UPDATE_DIR, "app.py")
     main_path = os.path.join(UPDATE_DIR, "main.py")
+    module_paths = {name: os.path.join(UPDATE_DIR, name) for name in MODULE_URLS}
 
     try:
         internet = check_internet()
@@ -420,10 +430,13 @@ def update_files(force: bool = False) -> None:
         # now attempt to download code files (only if internet)
         app_ok = False
         main_ok = False
+        modules_ok = {name: False for name in MODULE_URLS}
         if internet:
             # download updated code to temporary update dir
             app_ok = download_url_to_file(APP_URL, app_path)
             main_ok = download_url_to_file(MAIN_URL, main_path)
+            for name, url in MODULE_URLS.items():
+                modules_ok[name] = download_url_to_file(url, module_paths[name])
 
         # decide whether to apply updates: only if downloads succeeded or force
         apply_app = app_ok or force or (not internet and os.path.exists(os.path.join(BASE_DIR, "app.py")))
@@ -434,18 +447,33 @@ def update_files(force: bool = False) -> None:
         main_orig = os.path.join(BASE_DIR, "main.py")
         app_backup = backup_file(app_orig) if os.path.exists(app_orig) else None
         main_backup = backup_file(main_orig) if os.path.exists(main_orig) else None
+        module_origs = {name: os.path.join(BASE_DIR, name) for name in MODULE_URLS}
+        module_backups = {name: backup_file(path) for name, path in module_origs.items() if os.path.exists(path)}
 
         # apply updates to working dir but test before finalizing
         applied_any = False
+        created: list[str] = []  # files the update adds; they have no backup, rollback removes them
+
+        def apply_file(src: str, dst: str) -> None:
+            if not os.path.exists(dst):
+                created.append(dst)
+            safe_copy(src, dst)
+
         try:
             if apply_app and os.path.exists(app_path):
-                safe_copy(app_path, app_orig)
+                apply_file(app_path, app_orig)
                 applied_any = True
                 log("applied app.py update to working dir")
             if apply_main and os.path.exists(main_path):
-                safe_copy(main_path, main_orig)
+                apply_file(main_path, main_orig)
                 applied_any = True
                 log("applied main.py update to working dir")
+            for name, path in module_paths.items():
+                # a module is only worth applying when app.py comes along with it
+                if (modules_ok[name] or force) and apply_app and os.path.exists(path):
+                    apply_file(path, module_origs[name])
+                    applied_any = True
+                    log(f"applied {name} update to working dir")
 
             # optional remote hash verification for safety
             if internet and os.path.exists(app_orig):
@@ -456,6 +484,10 @@ def update_files(force: bool = False) -> None:
                 ok_hash = try_download_optional_hash(MAIN_URL, main_orig)
                 if not ok_hash:
                     raise RuntimeError("main.py hash verification failed")
+            for name, url in MODULE_URLS.items():
+                if internet and os.path.exists(module_origs[name]):
+                    if not try_download_optional_hash(url, module_origs[name]):
+                        raise RuntimeError(f"{name} hash verification failed")
 
             # test import of app.py to ensure it doesn't crash on import
             if os.path.exists(app_orig):
@@ -471,6 +503,15 @@ def update_files(force: bool = False) -> None:
                 restore_backup(app_orig)
             if main_backup:
                 restore_backup(main_orig)
+            for name in module_backups:
+                if module_backups[name]:
+                    restore_backup(module_origs[name])
+            for path in created:
+                try:
+                    os.remove(path)
+                    log(f"removed {path} added by the failed update")
+                except OSError as err:
+                    log(f"rollback remove error {path} {err}")
             log("rolled back to backups after failed update")
             raise
     finally:
@@ -598,7 +639,9 @@ def run_launcher():
             app = importlib.import_module("app")
         # best-effort load config
         try:
-            if hasattr(app, "load_config"):
+            if hasattr(app, "init"):
+                app.init()
+            elif hasattr(app, "load_config"):
                 app.load_config()
             if hasattr(app, "CONFIG") and hasattr(app, "DEFAULT_SERVER"):
                 app.SERVER_URL = app.CONFIG.get("server_url", app.DEFAULT_SERVER)
@@ -633,6 +676,59 @@ def run_launcher():
         log(f"fatal error {e}")
         raise SystemExit(1)
 
+# -------- startup budget check --------
+def parse_importtime(stderr: str) -> list[tuple[str, int, int, int]]:
+    """(module, self_us, cumulative_us, depth) for each line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # header line
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+def startup_check(budget_ms: float = STARTUP_BUDGET_MS, top: int = 12) -> int:
+    """Import app and run app.init() in a fresh interpreter, report where the time goes."""
+    code = ("import time; t = time.perf_counter(); import app; "
+            "getattr(app, 'init', lambda: None)(); print(time.perf_counter() - t)")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (BASE_DIR, LOCAL_DIR, env.get("PYTHONPATH")) if p)
+    try:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=BASE_DIR, env=env,
+                              capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"{RED}startup check could not run: {e}{RESET}")
+        return 2
+    if proc.returncode != 0:
+        print(f"{RED}importing app failed:{RESET}\n{proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ''}")
+        return 2
+    total_ms = float(proc.stdout.strip().splitlines()[-1]) * 1000
+    rows = parse_importtime(proc.stderr)
+    # children are printed before their parent: app's subtree is everything after the previous
+    # top-level entry; its direct imports (depth 1) are what app.py can do something about
+    app_idx = next((i for i, r in enumerate(rows) if r[0] == "app" and r[3] == 0), len(rows))
+    start = app_idx
+    while start > 0 and rows[start - 1][3] > 0:
+        start -= 1
+    app_deps = [r for r in rows[start:app_idx] if r[3] == 1]
+    print(f"{BOLD}{'MODULE':32} {'SELF ms':>8} {'CUMUL ms':>9}{RESET}")
+    for name, self_us, cum_us, _ in sorted(app_deps, key=lambda r: -r[2])[:top]:
+        print(f"{name:32} {self_us / 1000:>8.1f} {cum_us / 1000:>9.1f}")
+    if app_idx < len(rows):
+        print(f"{'app (self / total)':32} {rows[app_idx][1] / 1000:>8.1f} {rows[app_idx][2] / 1000:>9.1f}")
+    loaded = {r[0].split(".")[0] for r in rows[start:]}
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    ok = total_ms <= budget_ms and not eager
+    col = GREEN if ok else RED
+    print(f"{col}import + init: {total_ms:.1f} ms (budget {budget_ms:.0f} ms){RESET}")
+    if eager:
+        print(f"{RED}loaded at startup but should be lazy: {', '.join(eager)}{RESET}")
+    return 0 if ok else 1
+
 # -------- CLI parsing --------
 def parse_args():
     p = argparse.ArgumentParser(description="OMX Launcher")
@@ -640,6 +736,10 @@ def parse_args():
     p.add_argument("--no-update", action="store_true", help="skip update check")
     p.add_argument("--force-update", action="store_true", help="force apply updates even if same")
     p.add_argument("--verbose", action="store_true", help="verbose logging to console")
+    p.add_argument("--startup-check", action="store_true",
+                   help="measure app import/init time against the startup budget and exit")
+    p.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS, metavar="MS",
+                   help=f"budget for --startup-check (default {STARTUP_BUDGET_MS} ms)")
     return p.parse_args()
 
 # -------- safe main wrapper --------
@@ -650,6 +750,9 @@ def main():
     FLAGS["force_update"] = bool(args.force_update)
     FLAGS["verbose"] = bool(args.verbose)
 
+    if args.startup_check:
+        sys.exit(startup_check(args.startup_budget))
+
     try:
         run_launcher()
     except EOFError:
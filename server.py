@@ -0,0 +1,965 @@
+#!/usr/bin/env python3
+# OMX reference server
+# A self-contained implementation of the JSON protocol that app.py and admin.py speak, on an
+# indexed SQLite store, so the clients can be tested and benchmarked on one machine. Standard
+# library only.
+#
+#   python server.py --port 30174 --admin root:secretpw --user alice:secretpw --user bob:secretpw
+#   python server.py --latency 80 --jitter 20 --bandwidth 256     # a slow link: ms, ms, KiB/s
+#
+# then point the client at it with "server_url": "http://127.0.0.1:30174" in client_config.json.
+
+from __future__ import annotations
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import BinaryIO, Optional
+from urllib.parse import parse_qs, urlsplit
+
+FOLDERS = ("inbox", "sent", "deleted", "spam")
+ROLES = ("user", "admin")
+COMPRESS_MIN_BYTES = 1024
+WATCH_MAX_HOLD = 60
+TOKEN_TTL = 24 * 3600
+ETAG_ROUTES = {"/fetch_mail", "/fetch_mail_body"}
+UPLOAD_CHUNK = 256 * 1024
+IMPORT_MAX_BATCH = 1000
+IO_BLOCK = 64 * 1024
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+_RANGE_RE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    salt     BLOB NOT NULL,
+    hash     BLOB NOT NULL,
+    role     TEXT NOT NULL DEFAULT 'user',
+    banned   INTEGER NOT NULL DEFAULT 0,
+    created  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tokens (
+    token    TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    expires  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tokens_by_user ON tokens (username);
+CREATE TABLE IF NOT EXISTS mails (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner       TEXT NOT NULL,
+    folder      TEXT NOT NULL,
+    sender      TEXT NOT NULL,
+    recipients  TEXT NOT NULL,
+    cc          TEXT NOT NULL DEFAULT '[]',
+    bcc         TEXT NOT NULL DEFAULT '[]',
+    subject     TEXT NOT NULL DEFAULT '',
+    message     TEXT NOT NULL DEFAULT '',
+    timestamp   REAL NOT NULL,
+    attachments TEXT
+);
+CREATE INDEX IF NOT EXISTS mails_by_folder ON mails (owner, folder, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS mails_by_sender ON mails (owner, folder, sender);
+CREATE TABLE IF NOT EXISTS spam (
+    owner  TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    PRIMARY KEY (owner, sender)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner   TEXT NOT NULL,
+    folder  TEXT NOT NULL,
+    op      TEXT NOT NULL,
+    mail_id INTEGER NOT NULL,
+    dest    TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_by_owner ON changes (owner, folder, seq);
+CREATE TABLE IF NOT EXISTS sent_keys (
+    owner   TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    mail_id INTEGER NOT NULL,
+    PRIMARY KEY (owner, key)
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    id            TEXT PRIMARY KEY,
+    owner         TEXT NOT NULL,
+    filename      TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    sha256        TEXT NOT NULL,
+    received      INTEGER NOT NULL DEFAULT 0,
+    attachment_id TEXT
+);
+CREATE INDEX IF NOT EXISTS uploads_by_file ON uploads (owner, sha256, size);
+CREATE TABLE IF NOT EXISTS attachments (
+    id       TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    sha256   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachment_readers (
+    attachment_id TEXT NOT NULL,
+    username      TEXT NOT NULL,
+    PRIMARY KEY (attachment_id, username)
+);
+"""
+
+MAIL_COLUMNS = "id, sender, recipients, cc, bcc, subject, timestamp, attachments, message"
+HEADER_COLUMNS = "id, sender, recipients, cc, bcc, subject, timestamp, attachments"
+
+class APIError(Exception):
+    def __init__(self, error: str, status: int = 200, **extra):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+        self.extra = extra  # more fields for the error reply
+
+def _hash_password(password: str, salt: Optional[bytes] = None) -> tuple[bytes, bytes]:
+    salt = salt or secrets.token_bytes(16)
+    return salt, hashlib.pbkdf2_hmac("sha256", password.encode(), salt, 50_000)
+
+def _valid_username(name: str) -> bool:
+    return name.isalnum() and 3 <= len(name) <= 20
+
+def _mail_json(row, owner_sent: bool = False) -> dict:
+    mail = {"id": row[0], "from": row[1], "to": json.loads(row[2]), "cc": json.loads(row[3]),
+            "bcc": json.loads(row[4]) if owner_sent else [], "subject": row[5], "timestamp": row[6]}
+    if row[7]:
+        mail["attachments"] = json.loads(row[7])
+    if len(row) > 8:
+        mail["message"] = row[8]
+    return mail
+
+def _encode_cursor(row) -> str:
+    # keyset position after `row` (timestamp, id); opaque to clients
+    return base64.urlsafe_b64encode(json.dumps([row[6], row[0]]).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        ts, mail_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(ts), int(mail_id)
+    except (ValueError, TypeError):
+        raise APIError("invalid cursor", 400)
+
+def _number(body: dict, name: str, default=None, kind=int):
+    # a numeric request parameter; anything unparsable is the client's mistake, not a crash
+    value = body.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise APIError(f"invalid {name}", 400)
+
+class MailServer:
+    """All server state; every public method is one endpoint and returns the JSON reply.
+    One SQLite connection guarded by `lock`; file data for attachments lives under data_dir."""
+    def __init__(self, data_dir: Optional[str] = None, db_path: Optional[str] = None):
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix="omx-server-")
+        os.makedirs(os.path.join(self.data_dir, "uploads"), exist_ok=True)
+        os.makedirs(os.path.join(self.data_dir, "attachments"), exist_ok=True)
+        self.db_path = db_path or os.path.join(self.data_dir, "omx.sqlite3")
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        # running upload hashes; rebuilt from the partial file after a restart
+        self._upload_hashes: dict[str, "hashlib._Hash"] = {}
+        self._upload_locks: dict[str, threading.Lock] = {}
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    # ---- helpers ----
+    def _one(self, sql: str, args: tuple = ()):
+        return self.db.execute(sql, args).fetchone()
+
+    def add_user(self, username: str, password: str, role: str = "user") -> None:
+        username = username.lower()
+        if role not in ROLES:
+            raise APIError(f"unknown role {role!r}")
+        salt, digest = _hash_password(password)
+        with self.lock:
+            if self._one("SELECT 1 FROM users WHERE username=?", (username,)):
+                raise APIError("username taken")
+            with self.db:
+                self.db.execute("INSERT INTO users (username, salt, hash, role, created) VALUES (?, ?, ?, ?, ?)",
+                                (username, salt, digest, role, time.time()))
+
+    def import_mails(self, owner: str, folder: str, mails: list[dict]) -> int:
+        """Bulk-load mails without the change feed (seeding for tests and benchmarks)."""
+        rows = [(owner, folder, str(m.get("from") or ""), json.dumps(m.get("to") or [owner]),
+                 json.dumps(m.get("cc") or []), str(m.get("subject") or ""), str(m.get("message") or ""),
+                 float(m.get("timestamp") or time.time())) for m in mails]
+        with self.lock, self.db:
+            self.db.executemany("INSERT INTO mails (owner, folder, sender, recipients, cc, subject, message, "
+                                "timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def _check_password(self, username: str, password: str) -> bool:
+        row = self._one("SELECT salt, hash FROM users WHERE username=?", (username,))
+        return bool(row) and secrets.compare_digest(_hash_password(password, row[0])[1], row[1])
+
+    def _record(self, username: str, folder: str, op: str, mail_id: int, dest: Optional[str] = None) -> None:
+        # change feed: one row per "add" | "remove" | "move" of a mail in a folder; call inside a
+        # transaction, then notify_all() wakes /watch
+        self.db.execute("INSERT INTO changes (owner, folder, op, mail_id, dest) VALUES (?, ?, ?, ?, ?)",
+                        (username, folder, op, mail_id, dest))
+
+    def _latest(self, username: str) -> int:
+        return self._one("SELECT COALESCE(MAX(seq), 0) FROM changes WHERE owner=?", (username,))[0]
+
+    def _move(self, username: str, mail_id: int, src: str, dst: str) -> None:
+        self.db.execute("UPDATE mails SET folder=? WHERE id=? AND owner=?", (dst, mail_id, username))
+        self._record(username, src, "move", mail_id, dst)
+        self._record(username, dst, "add", mail_id)
+
+    def _find(self, username: str, folder: str, mail_id) -> int:
+        try:
+            mail_id = int(mail_id)
+        except (TypeError, ValueError):
+            raise APIError("mail not found")
+        if not self._one("SELECT 1 FROM mails WHERE id=? AND owner=? AND folder=?", (mail_id, username, folder)):
+            raise APIError("mail not found")
+        return mail_id
+
+    def _folder(self, body: dict) -> str:
+        folder = body.get("folder") or "inbox"
+        if folder not in FOLDERS:
+            raise APIError(f"unknown folder {folder!r}")
+        return folder
+
+    def authenticate(self, token: Optional[str], role: str = "user") -> str:
+        with self.lock:
+            row = self._one("SELECT u.username, u.role, u.banned, t.expires FROM tokens t "
+                            "JOIN users u ON u.username = t.username WHERE t.token=?", (token or "",))
+        if row is None or row[3] < time.time():
+            raise APIError("not authenticated", 401)
+        if row[2]:
+            raise APIError("account banned", 403)
+        if role == "admin" and row[1] != "admin":
+            raise APIError("admin role required", 403)
+        return row[0]
+
+    # ---- endpoints without auth ----
+    def register(self, body: dict) -> dict:
+        username = str(body.get("username") or "").strip().lower()
+        password = str(body.get("password") or "")
+        if not _valid_username(username):
+            raise APIError("username must be alphanumeric, 3-20 characters")
+        if len(password) < 8:
+            raise APIError("password must be at least 8 characters")
+        self.add_user(username, password)
+        return {"ok": True}
+
+    def login(self, body: dict) -> dict:
+        username = str(body.get("username") or "").strip().lower()
+        with self.lock:
+            if not self._check_password(username, str(body.get("password") or "")):
+                raise APIError("invalid username or password")
+            role, banned = self._one("SELECT role, banned FROM users WHERE username=?", (username,))
+            if banned:
+                raise APIError("account banned", 403)
+            token, expires = secrets.token_hex(16), time.time() + TOKEN_TTL
+            with self.db:
+                self.db.execute("DELETE FROM tokens WHERE username=? AND expires < ?", (username, time.time()))
+                self.db.execute("INSERT INTO tokens (token, username, expires) VALUES (?, ?, ?)",
+                                (token, username, expires))
+        return {"ok": True, "token": token, "role": role, "expires": int(expires)}
+
+    # ---- mail ----
+    def _deliver(self, sender: str, recipients: list[str], mail: dict, bcc: list[str]) -> int:
+        # one copy per recipient (spam if they blocked the sender) plus the sender's own; call
+        # inside a transaction
+        row = (sender, json.dumps(mail["to"]), json.dumps(mail["cc"]), mail["subject"], mail["message"],
+               mail["timestamp"], json.dumps(mail["attachments"]) if mail.get("attachments") else None)
+        for r in dict.fromkeys(recipients):
+            folder = "spam" if self._one("SELECT 1 FROM spam WHERE owner=? AND sender=?", (r, sender)) else "inbox"
+            cur = self.db.execute(
+                "INSERT INTO mails (owner, folder, sender, recipients, cc, subject, message, timestamp, attachments) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (r, folder, *row))
+            self._record(r, folder, "add", cur.lastrowid)
+        cur = self.db.execute(
+            "INSERT INTO mails (owner, folder, sender, recipients, cc, subject, message, timestamp, attachments, bcc) "
+            "VALUES (?, 'sent', ?, ?, ?, ?, ?, ?, ?, ?)", (sender, *row, json.dumps(bcc)))
+        self._record(sender, "sent", "add", cur.lastrowid)
+        return cur.lastrowid
+
+    def send(self, user: str, body: dict, idempotency_key: Optional[str] = None) -> dict:
+        to = [str(r).strip().lower() for r in body.get("to") or [] if str(r).strip()]
+        cc = [str(r).strip().lower() for r in body.get("cc") or [] if str(r).strip()]
+        bcc = [str(r).strip().lower() for r in body.get("bcc") or [] if str(r).strip()]
+        recipients = to + cc + bcc
+        if not recipients:
+            raise APIError("no recipients")
+        with self.lock:
+            if idempotency_key:
+                row = self._one("SELECT mail_id FROM sent_keys WHERE owner=? AND key=?", (user, idempotency_key))
+                if row:
+                    return {"ok": True, "mail_id": row[0]}
+            marks = ", ".join("?" for _ in recipients)
+            known = {r[0] for r in self.db.execute(f"SELECT username FROM users WHERE username IN ({marks})",
+                                                   recipients)}
+            unknown = [r for r in dict.fromkeys(recipients) if r not in known]
+            if unknown:
+                raise APIError(f"unknown recipient(s): {', '.join(unknown)}")
+            attachments = [self._attachment_for_send(user, a) for a in body.get("attachments") or []]
+            mail = {"to": to, "cc": cc, "subject": str(body.get("subject") or ""),
+                    "message": str(body.get("message") or ""), "timestamp": time.time(),
+                    "attachments": attachments}
+            with self.db:
+                for att in attachments:
+                    self.db.executemany("INSERT OR IGNORE INTO attachment_readers VALUES (?, ?)",
+                                        [(att["id"], r) for r in recipients])
+                mail_id = self._deliver(user, recipients, mail, bcc)
+                if idempotency_key:
+                    self.db.execute("INSERT INTO sent_keys (owner, key, mail_id) VALUES (?, ?, ?)",
+                                    (user, idempotency_key, mail_id))
+            self.changed.notify_all()
+        return {"ok": True, "mail_id": mail_id}
+
+    def import_mail(self, user: str, body: dict, idempotency_key: Optional[str] = None) -> dict:
+        # restore an export into the caller's own folders, keeping sender and date; each mail may
+        # name its folder, otherwise body["folder"] applies
+        mails = body.get("mails")
+        if not isinstance(mails, list) or len(mails) > IMPORT_MAX_BATCH:
+            raise APIError(f"mails must be a list of at most {IMPORT_MAX_BATCH}")
+        rows = []
+        for m in mails:
+            folder = self._folder({"folder": m.get("folder") or body.get("folder")})
+            rows.append((user, folder, str(m.get("from") or ""), json.dumps(m.get("to") or []),
+                         json.dumps(m.get("cc") or []), json.dumps(m.get("bcc") or []),
+                         str(m.get("subject") or ""), str(m.get("message") or ""),
+                         float(m.get("timestamp") or time.time())))
+        if not rows:
+            return {"ok": True, "imported": 0}
+        with self.lock:
+            if idempotency_key and self._one("SELECT 1 FROM sent_keys WHERE owner=? AND key=?",
+                                             (user, idempotency_key)):
+                return {"ok": True, "imported": len(rows)}
+            with self.db:
+                for row in rows:
+                    cur = self.db.execute(
+                        "INSERT INTO mails (owner, folder, sender, recipients, cc, bcc, subject, message, "
+                        "timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                    self._record(user, row[1], "add", cur.lastrowid)
+                if idempotency_key:
+                    self.db.execute("INSERT INTO sent_keys (owner, key, mail_id) VALUES (?, ?, ?)",
+                                    (user, idempotency_key, cur.lastrowid))
+            self.changed.notify_all()
+        return {"ok": True, "imported": len(rows)}
+
+    def fetch_mail(self, user: str, body: dict) -> dict:
+        # "cursor" (a previous reply's next_cursor) continues after the last mail of that page
+        # and wins over "offset"; next_cursor is null on the last page
+        folder = self._folder(body)
+        offset = max(0, _number(body, "offset", 0))
+        limit = _number(body, "limit")
+        limit = -1 if limit is None else max(0, limit)
+        cols = HEADER_COLUMNS if body.get("fields") == "headers" else MAIL_COLUMNS
+        with self.lock:
+            if body.get("cursor"):
+                ts, mail_id = _decode_cursor(str(body["cursor"]))
+                rows = self.db.execute(
+                    f"SELECT {cols} FROM mails WHERE owner=? AND folder=? AND timestamp <= ? "
+                    "AND (timestamp < ? OR id < ?) ORDER BY timestamp DESC, id DESC LIMIT ?",
+                    (user, folder, ts, ts, mail_id, limit)).fetchall()
+            else:
+                rows = self.db.execute(
+                    f"SELECT {cols} FROM mails WHERE owner=? AND folder=? "
+                    "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?", (user, folder, limit, offset)).fetchall()
+        next_cursor = _encode_cursor(rows[-1]) if rows and len(rows) == limit else None
+        return {"ok": True, "mails": [_mail_json(r, folder == "sent") for r in rows], "next_cursor": next_cursor}
+
+    def fetch_mail_body(self, user: str, body: dict) -> dict:
+        with self.lock:
+            mail_id = self._find(user, self._folder(body), body.get("mail_id"))
+            return {"ok": True, "message": self._one("SELECT message FROM mails WHERE id=?", (mail_id,))[0]}
+
+    def search_mail(self, user: str, body: dict) -> dict:
+        like = "%" + str(body.get("query") or "").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        folders = [self._folder(body)] if body.get("folder") else list(FOLDERS)
+        marks = ", ".join("?" for _ in folders)
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT {MAIL_COLUMNS}, folder FROM mails WHERE owner=? AND folder IN ({marks}) "
+                "AND (subject LIKE ? ESCAPE '\\' OR message LIKE ? ESCAPE '\\' OR sender LIKE ? ESCAPE '\\') "
+                "ORDER BY timestamp DESC, id DESC", (user, *folders, like, like, like)).fetchall()
+        return {"ok": True, "results": [dict(_mail_json(r[:9], r[9] == "sent"), folder=r[9]) for r in rows]}
+
+    def delete_mail(self, user: str, body: dict) -> dict:
+        folder = self._folder(body)
+        with self.lock:
+            mail_id = self._find(user, folder, body.get("mail_id"))
+            with self.db:
+                if folder != "deleted":
+                    self._move(user, mail_id, folder, "deleted")
+                else:
+                    self.db.execute("DELETE FROM mails WHERE id=?", (mail_id,))
+                    self._record(user, folder, "remove", mail_id)
+            self.changed.notify_all()
+        return {"ok": True}
+
+    def recover_mail(self, user: str, body: dict) -> dict:
+        with self.lock:
+            mail_id = self._find(user, "deleted", body.get("mail_id"))
+            with self.db:
+                self._move(user, mail_id, "deleted", "inbox")
+            self.changed.notify_all()
+        return {"ok": True}
+
+    def add_sender_to_spam(self, user: str, body: dict) -> dict:
+        sender = str(body.get("sender") or "").strip().lower()
+        if not sender:
+            raise APIError("sender required")
+        with self.lock:
+            moved = [r[0] for r in self.db.execute(
+                "SELECT id FROM mails WHERE owner=? AND folder='inbox' AND sender=?", (user, sender))]
+            with self.db:
+                self.db.execute("INSERT OR IGNORE INTO spam (owner, sender) VALUES (?, ?)", (user, sender))
+                for mail_id in moved:
+                    self._move(user, mail_id, "inbox", "spam")
+            self.changed.notify_all()
+        return {"ok": True, "moved": len(moved)}
+
+    def delete_sender_from_spam(self, user: str, body: dict) -> dict:
+        sender = str(body.get("sender") or "").strip().lower()
+        with self.lock, self.db:
+            if self.db.execute("DELETE FROM spam WHERE owner=? AND sender=?", (user, sender)).rowcount == 0:
+                raise APIError("sender not in spam list")
+        return {"ok": True}
+
+    def watch(self, user: str, body: dict) -> dict:
+        """Long-poll: answer as soon as the mailbox changes after `cursor`, or after `timeout`."""
+        cursor = _number(body, "cursor")
+        hold = min(_number(body, "timeout", 0, float) or 25, WATCH_MAX_HOLD)
+        deadline = time.monotonic() + hold
+        with self.lock:
+            if cursor is None:
+                return {"ok": True, "cursor": self._latest(user), "folders": []}
+            while self._latest(user) <= cursor:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return {"ok": True, "cursor": cursor, "folders": []}
+                self.changed.wait(left)
+            folders = [r[0] for r in self.db.execute(
+                "SELECT DISTINCT folder FROM changes WHERE owner=? AND seq > ? ORDER BY folder", (user, cursor))]
+            return {"ok": True, "cursor": self._latest(user), "folders": folders}
+
+    def sync_mail(self, user: str, body: dict) -> dict:
+        """Changes to one folder since `cursor`; `reset` tells the client to fetch it in full."""
+        folder = self._folder(body)
+        cursor = _number(body, "cursor")
+        with self.lock:
+            current = self._latest(user)
+            if cursor is None or not 0 <= cursor <= current:
+                return {"ok": True, "cursor": current, "reset": True}
+            last: dict[int, tuple[str, Optional[str]]] = {}
+            for mail_id, op, dest in self.db.execute(
+                    "SELECT mail_id, op, dest FROM changes WHERE owner=? AND folder=? AND seq > ? ORDER BY seq",
+                    (user, folder, cursor)):
+                last[mail_id] = (op, dest)
+            added_ids = [i for i, (op, _) in last.items() if op == "add"]
+            added = []
+            for start in range(0, len(added_ids), 500):
+                ids = added_ids[start:start + 500]
+                marks = ", ".join("?" for _ in ids)
+                added += [_mail_json(r, folder == "sent") for r in self.db.execute(
+                    f"SELECT {MAIL_COLUMNS} FROM mails WHERE owner=? AND folder=? AND id IN ({marks})",
+                    (user, folder, *ids))]
+        return {
+            "ok": True, "cursor": current, "added": added,
+            "removed": [i for i, (op, _) in last.items() if op == "remove"],
+            "moved": [{"id": i, "to": dest} for i, (op, dest) in last.items() if op == "move"],
+        }
+
+    # ---- attachments ----
+    # upload_init -> PUT /upload_chunk?upload_id&offset (raw bytes, in order) -> upload_complete,
+    # then the attachment id goes into /send. Data is streamed to disk and hashed as it arrives.
+    def _upload_path(self, upload_id: str) -> str:
+        return os.path.join(self.data_dir, "uploads", upload_id)
+
+    def _attachment_path(self, attachment_id: str) -> str:
+        return os.path.join(self.data_dir, "attachments", attachment_id)
+
+    def upload_init(self, user: str, body: dict) -> dict:
+        filename = os.path.basename(str(body.get("filename") or "")).strip() or "attachment"
+        sha256 = str(body.get("sha256") or "").lower()
+        try:
+            size = int(body.get("size"))
+        except (TypeError, ValueError):
+            raise APIError("size required")
+        if size < 0 or not _SHA256_RE.match(sha256):
+            raise APIError("size and sha256 required")
+        with self.lock, self.db:
+            row = self._one("SELECT id, received FROM uploads WHERE owner=? AND sha256=? AND size=?",
+                            (user, sha256, size))
+            if row:
+                # same file again: resume (or reuse) the earlier upload
+                self.db.execute("UPDATE uploads SET filename=? WHERE id=?", (filename, row[0]))
+                return {"ok": True, "upload_id": row[0], "chunk_size": UPLOAD_CHUNK, "received": row[1]}
+            upload_id = secrets.token_hex(8)
+            open(self._upload_path(upload_id), "wb").close()
+            self.db.execute("INSERT INTO uploads (id, owner, filename, size, sha256) VALUES (?, ?, ?, ?, ?)",
+                            (upload_id, user, filename, size, sha256))
+        return {"ok": True, "upload_id": upload_id, "chunk_size": UPLOAD_CHUNK, "received": 0}
+
+    def _upload(self, user: str, upload_id) -> dict:
+        with self.lock:
+            row = self._one("SELECT id, owner, size, sha256, received, attachment_id, filename FROM uploads "
+                            "WHERE id=?", (str(upload_id or ""),))
+            if row is None or row[1] != user:
+                raise APIError("unknown upload", 404)
+            lock = self._upload_locks.setdefault(row[0], threading.Lock())
+        return dict(zip(("id", "owner", "size", "sha256", "received", "attachment_id", "filename"), row),
+                    lock=lock)
+
+    def _upload_hash(self, up: dict):
+        digest = self._upload_hashes.get(up["id"])
+        if digest is None:
+            digest = hashlib.sha256()
+            with open(self._upload_path(up["id"]), "rb") as f:
+                left = up["received"]
+                while left:
+                    block = f.read(min(IO_BLOCK, left))
+                    digest.update(block)
+                    left -= len(block)
+            self._upload_hashes[up["id"]] = digest
+        return digest
+
+    def upload_chunk(self, user: str, upload_id: str, offset: int, stream: BinaryIO, length: int) -> dict:
+        up = self._upload(user, upload_id)
+        with up["lock"]:
+            up = self._upload(user, upload_id)  # re-read under the per-upload lock
+            if offset != up["received"] or up["attachment_id"]:
+                raise APIError(f"expected offset {up['received']}", 409, received=up["received"])
+            if offset + length > up["size"]:
+                raise APIError("chunk runs past the declared size", 400)
+            digest = self._upload_hash(up).copy()
+            with open(self._upload_path(up["id"]), "r+b") as f:
+                f.seek(offset)
+                f.truncate()
+                left = length
+                while left:
+                    block = stream.read(min(IO_BLOCK, left))
+                    if not block:
+                        # client went away mid-chunk: forget the partial chunk
+                        f.truncate(offset)
+                        raise APIError("incomplete chunk", 400)
+                    f.write(block)
+                    digest.update(block)
+                    left -= len(block)
+            self._upload_hashes[up["id"]] = digest
+            with self.lock, self.db:
+                self.db.execute("UPDATE uploads SET received=? WHERE id=?", (offset + length, up["id"]))
+        return {"ok": True, "received": offset + length}
+
+    def upload_complete(self, user: str, body: dict) -> dict:
+        up = self._upload(user, body.get("upload_id"))
+        with up["lock"]:
+            up = self._upload(user, body.get("upload_id"))
+            if up["attachment_id"] is None:
+                if up["received"] != up["size"]:
+                    raise APIError(f"upload incomplete ({up['received']} of {up['size']} bytes)")
+                if self._upload_hash(up).hexdigest() != up["sha256"]:
+                    with self.lock, self.db:
+                        self.db.execute("DELETE FROM uploads WHERE id=?", (up["id"],))
+                    self._upload_hashes.pop(up["id"], None)
+                    os.remove(self._upload_path(up["id"]))
+                    raise APIError("checksum mismatch")
+                attachment_id = secrets.token_hex(8)
+                os.replace(self._upload_path(up["id"]), self._attachment_path(attachment_id))
+                self._upload_hashes.pop(up["id"], None)
+                with self.lock, self.db:
+                    self.db.execute("INSERT INTO attachments (id, filename, size, sha256) VALUES (?, ?, ?, ?)",
+                                    (attachment_id, up["filename"], up["size"], up["sha256"]))
+                    self.db.execute("INSERT INTO attachment_readers VALUES (?, ?)", (attachment_id, user))
+                    self.db.execute("UPDATE uploads SET attachment_id=? WHERE id=?", (attachment_id, up["id"]))
+                up["attachment_id"] = attachment_id
+        return {"ok": True, "attachment_id": up["attachment_id"], "size": up["size"], "sha256": up["sha256"]}
+
+    def _attachment_for_send(self, user: str, attachment_id) -> dict:
+        row = self._one("SELECT a.id, a.filename, a.size, a.sha256 FROM attachments a "
+                        "JOIN attachment_readers r ON r.attachment_id = a.id WHERE a.id=? AND r.username=?",
+                        (str(attachment_id), user))
+        if row is None:
+            raise APIError(f"unknown attachment {attachment_id!r}")
+        return dict(zip(("id", "filename", "size", "sha256"), row))
+
+    def attachment(self, user: str, attachment_id) -> dict:
+        try:
+            with self.lock:
+                att = self._attachment_for_send(user, attachment_id) if attachment_id else None
+        except APIError:
+            att = None
+        if att is None:
+            # a 200 here would be taken for the file itself
+            raise APIError("attachment not found", 404)
+        att["path"] = self._attachment_path(att["id"])
+        return att
+
+    # ---- account ----
+    def change_password(self, user: str, body: dict) -> dict:
+        with self.lock:
+            if not self._check_password(user, str(body.get("old_password") or "")):
+                raise APIError("wrong password")
+        return self._set_password(user, str(body.get("new_password") or ""))
+
+    def _set_password(self, username: str, new: str) -> dict:
+        if len(new) < 8:
+            raise APIError("password must be at least 8 characters")
+        salt, digest = _hash_password(new)
+        with self.lock, self.db:
+            if self.db.execute("UPDATE users SET salt=?, hash=? WHERE username=?",
+                               (salt, digest, username)).rowcount == 0:
+                raise APIError("no such user", 404)
+        return {"ok": True}
+
+    def _rename(self, old: str, new: str) -> dict:
+        if not _valid_username(new):
+            raise APIError("username must be alphanumeric, 3-20 characters")
+        with self.lock:
+            if self._one("SELECT 1 FROM users WHERE username=?", (new,)):
+                raise APIError("username taken")
+            if not self._one("SELECT 1 FROM users WHERE username=?", (old,)):
+                raise APIError("no such user", 404)
+            with self.db:
+                self.db.execute("UPDATE users SET username=? WHERE username=?", (new, old))
+                for table, col in (("tokens", "username"), ("mails", "owner"), ("spam", "owner"),
+                                   ("changes", "owner"), ("sent_keys", "owner"), ("uploads", "owner"),
+                                   ("attachment_readers", "username")):
+                    self.db.execute(f"UPDATE {table} SET {col}=? WHERE {col}=?", (new, old))
+        return {"ok": True, "username": new}
+
+    def change_username(self, user: str, body: dict) -> dict:
+        with self.lock:
+            if not self._check_password(user, str(body.get("password") or "")):
+                raise APIError("wrong password")
+            return self._rename(user, str(body.get("new_username") or "").strip().lower())
+
+    def _remove_user(self, username: str) -> None:
+        with self.lock:
+            with self.db:
+                if self.db.execute("DELETE FROM users WHERE username=?", (username,)).rowcount == 0:
+                    raise APIError("no such user", 404)
+                for table, col in (("tokens", "username"), ("mails", "owner"), ("spam", "owner"),
+                                   ("changes", "owner"), ("sent_keys", "owner"),
+                                   ("attachment_readers", "username")):
+                    self.db.execute(f"DELETE FROM {table} WHERE {col}=?", (username,))
+            self.changed.notify_all()
+
+    def delete_account(self, user: str, body: dict) -> dict:
+        with self.lock:
+            if not self._check_password(user, str(body.get("password") or "")):
+                raise APIError("wrong password")
+            self._remove_user(user)
+        return {"ok": True}
+
+    # ---- admin ----
+    def _target(self, admin: str, body: dict) -> str:
+        target = str(body.get("username") or "").strip().lower()
+        if not target:
+            raise APIError("username required")
+        if target == admin:
+            raise APIError("refusing to do that to your own account")
+        return target
+
+    def admin_list_users(self, admin: str, body: dict) -> dict:
+        with self.lock:
+            rows = self.db.execute("SELECT username, role, created, banned FROM users ORDER BY username").fetchall()
+        return {"ok": True, "users": [{"username": u, "role": role, "created": int(created), "banned": bool(banned)}
+                                      for u, role, created, banned in rows]}
+
+    def _set_banned(self, target: str, banned: bool) -> dict:
+        with self.lock, self.db:
+            if self.db.execute("UPDATE users SET banned=? WHERE username=?", (int(banned), target)).rowcount == 0:
+                raise APIError("no such user", 404)
+            if banned:
+                self.db.execute("DELETE FROM tokens WHERE username=?", (target,))
+        return {"ok": True}
+
+    def admin_ban(self, admin: str, body: dict) -> dict:
+        return self._set_banned(self._target(admin, body), True)
+
+    def admin_unban(self, admin: str, body: dict) -> dict:
+        return self._set_banned(self._target(admin, body), False)
+
+    def admin_delete_user(self, admin: str, body: dict) -> dict:
+        self._remove_user(self._target(admin, body))
+        return {"ok": True}
+
+    def admin_broadcast(self, admin: str, body: dict) -> dict:
+        subject = str(body.get("subject") or "").strip()
+        if not subject:
+            raise APIError("subject required")
+        with self.lock:
+            users = [r[0] for r in self.db.execute("SELECT username FROM users WHERE username != ?", (admin,))]
+            mail = {"to": [], "cc": [], "subject": subject, "message": str(body.get("message") or ""),
+                    "timestamp": time.time()}
+            with self.db:
+                if users:
+                    self._deliver(admin, users, mail, [])
+            self.changed.notify_all()
+        return {"ok": True, "delivered": len(users)}
+
+    def admin_change_user_password(self, admin: str, body: dict) -> dict:
+        target = str(body.get("username") or "").strip().lower()
+        return self._set_password(target, str(body.get("new_password") or ""))
+
+    def admin_change_user_username(self, admin: str, body: dict) -> dict:
+        return self._rename(self._target(admin, body), str(body.get("new_username") or "").strip().lower())
+
+# path -> (method name, who may call it: None for anyone, "user" or "admin")
+ROUTES = {
+    "/register": ("register", None),
+    "/login": ("login", None),
+    "/send": ("send", "user"),
+    "/fetch_mail": ("fetch_mail", "user"),
+    "/fetch_mail_body": ("fetch_mail_body", "user"),
+    "/search_mail": ("search_mail", "user"),
+    "/delete_mail": ("delete_mail", "user"),
+    "/recover_mail": ("recover_mail", "user"),
+    "/add_sender_to_spam": ("add_sender_to_spam", "user"),
+    "/delete_sender_from_spam": ("delete_sender_from_spam", "user"),
+    "/watch": ("watch", "user"),
+    "/sync_mail": ("sync_mail", "user"),
+    "/import_mail": ("import_mail", "user"),
+    "/upload_init": ("upload_init", "user"),
+    "/upload_complete": ("upload_complete", "user"),
+    "/change_password": ("change_password", "user"),
+    "/change_username": ("change_username", "user"),
+    "/delete_account": ("delete_account", "user"),
+    "/admin/list_users": ("admin_list_users", "admin"),
+    "/admin/ban": ("admin_ban", "admin"),
+    "/admin/unban": ("admin_unban", "admin"),
+    "/admin/delete_user": ("admin_delete_user", "admin"),
+    "/admin/broadcast": ("admin_broadcast", "admin"),
+    "/admin/change_user_password": ("admin_change_user_password", "admin"),
+    "/admin/change_user_username": ("admin_change_user_username", "admin"),
+}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes; with Nagle on, the body waits for the
+    # client's delayed ACK (~40 ms per request on keep-alive connections)
+    disable_nagle_algorithm = True
+    server: "OMXHTTPServer"
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        self.server.link_delay(len(data), first=True)
+        if self.headers.get("Content-Encoding", "").lower() == "gzip":
+            data = gzip.decompress(data)
+        return json.loads(data or b"{}") if data else {}
+
+    def _reply(self, status: int, payload: dict, etag: bool = False) -> None:
+        data = json.dumps(payload).encode()
+        if etag:
+            tag = '"' + hashlib.sha1(data).hexdigest()[:24] + '"'
+            if tag in self.headers.get("If-None-Match", ""):
+                self.send_response(304)
+                self.send_header("ETag", tag)
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if etag:
+            self.send_header("ETag", tag)
+        if len(data) >= COMPRESS_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data, 6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.server.link_delay(len(data))
+        self.wfile.write(data)
+
+    def _user(self, role: str = "user") -> str:
+        auth = self.headers.get("Authorization", "")
+        return self.server.state.authenticate(auth[7:] if auth.startswith("Bearer ") else None, role)
+
+    def _query(self) -> dict[str, str]:
+        return {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+
+    def _drain(self) -> None:
+        left = int(self.headers.get("Content-Length") or 0)
+        while left > 0:
+            block = self.rfile.read(min(IO_BLOCK, left))
+            if not block:
+                break
+            left -= len(block)
+
+    def do_PUT(self) -> None:
+        if urlsplit(self.path).path != "/upload_chunk":
+            self._drain()
+            self._reply(404, {"ok": False, "error": "unknown endpoint"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        state = self.server.state
+        try:
+            user = self._user()
+            q = self._query()
+            result = state.upload_chunk(user, q.get("upload_id"), _number(q, "offset", 0), self.rfile, length)
+        except APIError as e:
+            self._drain()
+            self._reply(e.status, {"ok": False, "error": e.error, **e.extra})
+            return
+        self.server.link_delay(length, first=True)
+        self._reply(200, result)
+
+    def _send_attachment(self) -> None:
+        try:
+            att = self.server.state.attachment(self._user(), self._query().get("attachment_id"))
+        except APIError as e:
+            self._reply(e.status, {"ok": False, "error": e.error, **e.extra})
+            return
+        size, start = att["size"], 0
+        m = _RANGE_RE.match(self.headers.get("Range", ""))
+        if m:
+            start = int(m.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(206 if m else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(size - start))
+        if m:
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        self.server.link_delay(0, first=True)
+        with open(att["path"], "rb") as f:
+            f.seek(start)
+            for block in iter(lambda: f.read(IO_BLOCK), b""):
+                self.server.link_delay(len(block))
+                self.wfile.write(block)
+
+    def _dispatch(self) -> None:
+        path = self.path.split("?", 1)[0]
+        if path == "/attachment" and self.command == "GET":
+            self._drain()
+            self._send_attachment()
+            return
+        try:
+            # always drain the body, or the next request on this connection starts mid-body
+            body = self._read_json()
+        except (ValueError, OSError):
+            self._reply(400, {"ok": False, "error": "invalid request body"})
+            return
+        route = ROUTES.get(path)
+        if route is None:
+            self._reply(404, {"ok": False, "error": "unknown endpoint"})
+            return
+        name, access = route
+        state = self.server.state
+        try:
+            if access is None:
+                result = getattr(state, name)(body)
+            else:
+                user = self._user(access)
+                if name in ("send", "import_mail"):
+                    result = getattr(state, name)(user, body, self.headers.get("Idempotency-Key"))
+                else:
+                    result = getattr(state, name)(user, body)
+        except APIError as e:
+            self._reply(e.status, {"ok": False, "error": e.error, **e.extra})
+            return
+        self._reply(200, result, etag=path in ETAG_ROUTES)
+
+    do_POST = _dispatch
+    do_GET = _dispatch
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class OMXHTTPServer(ThreadingHTTPServer):
+    """`latency`/`jitter` (seconds) are added once per request, `bandwidth` (bytes/s) throttles
+    bodies in both directions; all default to a perfect link."""
+    daemon_threads = True
+
+    def __init__(self, address, state: Optional[MailServer] = None, verbose: bool = False,
+                 latency: float = 0.0, jitter: float = 0.0, bandwidth: Optional[float] = None):
+        super().__init__(address, Handler)
+        self.state = state or MailServer()
+        self.verbose = verbose
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+
+    def handle_error(self, request, client_address) -> None:
+        # a client that hung up before its reply (timeout, Ctrl-C) is not a server fault
+        if isinstance(sys.exc_info()[1], ConnectionError) and not self.verbose:
+            return
+        super().handle_error(request, client_address)
+
+    def link_delay(self, nbytes: int, first: bool = False) -> None:
+        wait = nbytes / self.bandwidth if self.bandwidth else 0.0
+        if first:
+            wait += self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+def start(host: str = "127.0.0.1", port: int = 0, state: Optional[MailServer] = None,
+          **link) -> OMXHTTPServer:
+    """Serve on a background thread (port 0 picks a free one); for tests and benchmarks.
+    `link` takes the latency/jitter/bandwidth options of OMXHTTPServer."""
+    httpd = OMXHTTPServer((host, port), state, **link)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def _account(spec: str) -> tuple[str, str]:
+    name, sep, password = spec.partition(":")
+    if not sep or not name or not password:
+        raise argparse.ArgumentTypeError(f"expected NAME:PASSWORD, got {spec!r}")
+    return name, password
+
+def main(argv=None) -> None:
+    p = argparse.ArgumentParser(description="OMX reference server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=30174)
+    p.add_argument("--data-dir", help="database and attachments (default: a temporary directory)")
+    p.add_argument("--user", action="append", default=[], type=_account, metavar="NAME:PASSWORD",
+                   help="create a user at startup if missing")
+    p.add_argument("--admin", action="append", default=[], type=_account, metavar="NAME:PASSWORD",
+                   help="create an admin at startup if missing")
+    p.add_argument("--latency", type=float, default=0.0, metavar="MS", help="added to every request")
+    p.add_argument("--jitter", type=float, default=0.0, metavar="MS", help="random extra latency, up to MS")
+    p.add_argument("--bandwidth", type=float, default=0.0, metavar="KIB_S", help="throttle bodies (0 = off)")
+    p.add_argument("--verbose", "-v", action="store_true", help="log every request")
+    args = p.parse_args(argv)
+    state = MailServer(args.data_dir)
+    for accounts, role in ((args.user, "user"), (args.admin, "admin")):
+        for name, password in accounts:
+            try:
+                state.add_user(name, password, role)
+            except APIError:
+                pass  # already there from an earlier run
+    httpd = OMXHTTPServer((args.host, args.port), state, args.verbose, latency=args.latency / 1000,
+                          jitter=args.jitter / 1000, bandwidth=args.bandwidth * 1024 or None)
+    print(f"OMX reference server on http://{args.host}:{httpd.server_port} (data in {state.data_dir})", flush=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        state.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Outbox redelivery and resumable uploads against the reference server.
+# Run: python -m unittest discover tests
+import io
+import os
+import unittest
+
+from test_sync import ServerTestCase
+
+import app
+import server
+
+
+class OutboxTest(ServerTestCase):
+    def test_redelivery_reuses_idempotency_key(self):
+        original = server.MailServer.send
+        keys = []
+
+        def lost_reply(state, user, body, idempotency_key=None):
+            # stored, but the reply never makes it back
+            keys.append(idempotency_key)
+            original(state, user, body, idempotency_key)
+            raise server.APIError("gateway timeout", 504)
+
+        app.STORE.outbox_add("alice", "outbox-key-1", {"to": ["bob"], "subject": "once", "message": "hi"})
+        worker = app.OutboxWorker()
+        server.MailServer.send = lost_reply
+        try:
+            self.assertFalse(worker.deliver(app.STORE.outbox_get("alice", "outbox-key-1")))
+        finally:
+            server.MailServer.send = original
+        item = app.STORE.outbox_get("alice", "outbox-key-1")
+        self.assertEqual(item["status"], "pending")
+        self.assertEqual(item["attempts"], 1)
+
+        self.assertTrue(worker.deliver(item))
+        self.assertEqual(app.STORE.outbox_get("alice", "outbox-key-1")["status"], "sent")
+        self.assertEqual(keys, ["outbox-key-1"])
+        inbox = self.state.fetch_mail("bob", {"folder": "inbox"})["mails"]
+        self.assertEqual([m["subject"] for m in inbox], ["once"])
+
+
+class UploadResumeTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chunk = server.UPLOAD_CHUNK
+        server.UPLOAD_CHUNK = 1024
+        self.path = os.path.join(self.dir, "report.bin")
+        with open(self.path, "wb") as f:
+            f.write(os.urandom(2 * 1024 + 512))
+
+    def tearDown(self):
+        server.UPLOAD_CHUNK = self.chunk
+        super().tearDown()
+
+    def test_resume_after_partial_chunk(self):
+        original = app._put_chunk
+        offsets = []
+
+        def dropped(upload_id, offset, data):
+            offsets.append(offset)
+            if len(offsets) < 2:
+                return original(upload_id, offset, data)
+            # the connection drops halfway through the second chunk
+            with self.assertRaises(server.APIError):
+                self.state.upload_chunk("alice", upload_id, offset, io.BytesIO(data[:len(data) // 2]), len(data))
+            return False, {"error": "Connection error: reset by peer", "retry": True}
+
+        def counted(upload_id, offset, data):
+            offsets.append(offset)
+            return original(upload_id, offset, data)
+
+        app._put_chunk = dropped
+        try:
+            ok, resp = app.upload_attachment(self.path)
+            self.assertFalse(ok)
+            self.assertTrue(resp.get("retry"))
+            offsets.clear()
+            app._put_chunk = counted
+            ok, resp = app.upload_attachment(self.path)
+        finally:
+            app._put_chunk = original
+        self.assertTrue(ok, resp)
+        self.assertEqual(offsets, [1024, 2048])
+
+        digest, size = app.file_sha256(self.path)
+        ok, got = app.download_attachment({"id": resp["attachment_id"], "filename": "copy.bin", "size": size,
+                                           "sha256": digest}, dest_dir=os.path.join(self.dir, "down"))
+        self.assertTrue(ok, got)
+        with open(got["path"], "rb") as a, open(self.path, "rb") as b:
+            self.assertEqual(a.read(), b.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
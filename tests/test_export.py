@@ -0,0 +1,50 @@
+# mbox/NDJSON export round trips. Run: python -m unittest discover tests
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+BODIES = [
+    "",
+    "no trailing newline",
+    "one trailing newline\n",
+    "two trailing newlines\n\n",
+    "From the start\nFrom here on\n>From quoted\n\nFrom after a blank line",
+    "Grüße aus Köln — ünïcödé ✓\n日本語",
+]
+
+
+class MboxRoundTripTest(unittest.TestCase):
+    def _mail(self, i, body):
+        return app.Mail(id=f"m{i}", sender="bob@example.org", subject=f"Grüße {i}",
+                        timestamp=1700000000 + i, to=("alice@example.org",), message=body,
+                        folder="inbox")
+
+    def test_bodies_survive_round_trip(self):
+        mails = [self._mail(i, body) for i, body in enumerate(BODIES)]
+        f = io.BytesIO(b"".join(app.mbox_entry(m) for m in mails))
+        parsed = [mail for _, mail in app.iter_mbox(f)]
+        self.assertEqual([m["message"] for m in parsed], BODIES)
+        self.assertEqual([m["subject"] for m in parsed], [m.subject for m in mails])
+        self.assertEqual([m["timestamp"] for m in parsed], [m.timestamp for m in mails])
+        self.assertEqual(parsed[0]["to"], ["alice@example.org"])
+        self.assertEqual(parsed[0]["folder"], "inbox")
+
+    def test_offsets_resume_after_entry(self):
+        f = io.BytesIO(b"".join(app.mbox_entry(self._mail(i, body)) for i, body in enumerate(BODIES)))
+        offsets = [pos for pos, _ in app.iter_mbox(f)]
+        f.seek(offsets[1])
+        self.assertEqual([m["message"] for _, m in app.iter_mbox(f)], BODIES[2:])
+
+    def test_ndjson_round_trip(self):
+        f = io.BytesIO(b"".join(app.ndjson_entry(self._mail(i, body)) for i, body in enumerate(BODIES)))
+        self.assertEqual([m["message"] for _, m in app.iter_ndjson(f)], BODIES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+# Bulk-action selections like "1-8,11". Run: python -m unittest discover tests
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+class ParseSelectionTest(unittest.TestCase):
+    def test_all(self):
+        for text in ("all", " ALL ", "a", "*"):
+            self.assertEqual(app.parse_selection(text, 4), [1, 2, 3, 4])
+
+    def test_reversed_range(self):
+        self.assertEqual(app.parse_selection("5-2", 6), [2, 3, 4, 5])
+
+    def test_mixed_separators(self):
+        self.assertEqual(app.parse_selection("1-3, 7 9,,2", 10), [1, 2, 3, 7, 9])
+
+    def test_out_of_range(self):
+        for text in ("0", "11", "9-11", "0-3", "1-99999999999999"):
+            with self.assertRaises(ValueError):
+                app.parse_selection(text, 10)
+
+    def test_invalid(self):
+        for text in ("", " , ", "x", "1-", "-3", "1-2-3", "2.5"):
+            with self.assertRaises(ValueError):
+                app.parse_selection(text, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
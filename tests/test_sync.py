@@ -0,0 +1,245 @@
+# Client sync against the reference server, in-process. Run: python -m unittest discover tests
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import server
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="omx-test-")
+        self.state = server.MailServer(os.path.join(self.dir, "server"))
+        self.state.add_user("alice", "changeme1")
+        self.state.add_user("bob", "changeme1")
+        self.state.send("bob", {"to": ["alice"], "subject": "first", "message": "hello there"})
+        self.httpd = server.start("127.0.0.1", 0, self.state)
+        url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        app.CONFIG_FILE = os.path.join(self.dir, "client_config.json")
+        app.CONFIG = {"server_url": url}
+        app.STORE = app.MailStore(os.path.join(self.dir, "store.sqlite3"))
+        app.ETAGS = app.ETagCache()
+        app.SERVER_CAPS.update(delta_sync=None, headers_only=None, cursor_paging=None)
+        ok, resp = app.send_request("/login", {"username": "alice", "password": "changeme1"})
+        self.assertTrue(ok, resp)
+        app.CONFIG.update(username="alice", token=resp["token"])
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class DeltaSyncTest(ServerTestCase):
+    def _delta_sync_new_mail(self):
+        self.assertTrue(app.sync_folder("inbox"))
+        self.assertTrue(app.SERVER_CAPS["delta_sync"])
+        self.state.send("bob", {"to": ["alice"], "subject": "second", "message": "the zanzibar report"})
+        self.assertTrue(app.sync_folder("inbox"))
+        self.assertTrue(app.STORE.search_ready("alice", "inbox"))
+        results = app.STORE.search("alice", "zanzibar", ["inbox"])
+        self.assertEqual([m.subject for m in results], ["second"])
+        self.assertEqual(app.STORE.get("alice", "inbox", results[0].id).message, "the zanzibar report")
+
+    def test_delta_sync_indexes_bodies(self):
+        self._delta_sync_new_mail()
+
+    def test_headers_only_feed_fetches_bodies(self):
+        original = server.MailServer.sync_mail
+
+        def headers_only(state, user, body):
+            resp = original(state, user, body)
+            for mail in resp.get("added") or []:
+                mail.pop("message", None)
+            return resp
+
+        server.MailServer.sync_mail = headers_only
+        try:
+            self._delta_sync_new_mail()
+        finally:
+            server.MailServer.sync_mail = original
+
+
+class BodyLoadTest(ServerTestCase):
+    def _headers_only_copy(self):
+        self.assertTrue(app.sync_folder("inbox"))
+        mail = app.STORE.page("alice", "inbox", 0, 1)[0]
+        mail.message = None
+        app.STORE.upsert("alice", "inbox", [mail])
+        app.BODY_CACHE = app.BodyCache()
+        return app.STORE.get("alice", "inbox", mail.id)
+
+    def _body_requests(self):
+        return app.NET_STATS.snapshot().get("/fetch_mail_body", {}).get("requests", 0)
+
+    def test_loaded_body_is_stored(self):
+        mail = self._headers_only_copy()
+        self.assertIsNone(mail.message)
+        before = self._body_requests()
+        self.assertEqual(app.load_mail_body(mail, "inbox").message, "hello there")
+        self.assertEqual(app.STORE.get("alice", "inbox", mail.id).message, "hello there")
+        self.assertEqual([m.id for m in app.STORE.search("alice", "hello", ["inbox"])], [mail.id])
+        app.BODY_CACHE = app.BodyCache()
+        app.load_mail_body(app.STORE.get("alice", "inbox", mail.id), "inbox")
+        self.assertEqual(self._body_requests(), before + 1)
+
+    def test_missing_body_endpoint_is_remembered(self):
+        mail = self._headers_only_copy()
+        route = server.ROUTES.pop("/fetch_mail_body")
+        app.SERVER_CAPS["body_endpoint"] = None
+        try:
+            self.assertEqual(app.load_mail_body(mail, "inbox").message, "hello there")
+            self.assertIs(app.SERVER_CAPS["body_endpoint"], False)
+            before = self._body_requests()
+            self.assertEqual(app.load_mail_body(self._headers_only_copy(), "inbox").message, "hello there")
+            self.assertEqual(self._body_requests(), before)
+        finally:
+            server.ROUTES["/fetch_mail_body"] = route
+            app.SERVER_CAPS["body_endpoint"] = None
+
+
+class ErrorReplyTest(ServerTestCase):
+    def test_missing_resources_are_not_unsupported(self):
+        ok, resp = app._put_chunk("nosuchupload", 0, b"data")
+        self.assertFalse(ok)
+        self.assertEqual(resp["error"], "unknown upload")
+        self.assertNotIn("unsupported", resp)
+        ok, resp = app.download_attachment({"id": "nosuchattachment", "filename": "x.bin", "size": 4},
+                                           dest_dir=self.dir)
+        self.assertFalse(ok)
+        self.assertEqual(resp["error"], "attachment not found")
+
+    def test_async_timeout_is_retryable(self):
+        original = server.MailServer.fetch_mail
+
+        def slow(state, user, body):
+            time.sleep(0.5)
+            return original(state, user, body)
+
+        server.MailServer.fetch_mail = slow
+        try:
+            [(ok, resp)] = app.send_requests([("/fetch_mail", {"folder": "inbox"})], timeout=0.05)
+        finally:
+            server.MailServer.fetch_mail = original
+        self.assertFalse(ok)
+        self.assertTrue(resp.get("retry"), resp)
+
+    def test_malformed_numbers_are_bad_requests(self):
+        for endpoint, payload, name in [("/fetch_mail", {"offset": "abc"}, "offset"),
+                                        ("/fetch_mail", {"limit": [1]}, "limit"),
+                                        ("/watch", {"cursor": 0, "timeout": "soon"}, "timeout"),
+                                        ("/sync_mail", {"cursor": "x"}, "cursor")]:
+            ok, resp = app.send_request(endpoint, payload)
+            self.assertFalse(ok)
+            self.assertTrue(resp.get("bad_request"), resp)
+            self.assertEqual(resp["error"], f"invalid {name}")
+
+    def test_unknown_route_is_unsupported(self):
+        ok, resp = app.send_request("/no_such_endpoint", {})
+        self.assertFalse(ok)
+        self.assertTrue(resp.get("unsupported"))
+
+
+class WatcherTest(ServerTestCase):
+    def test_watch_failures_leave_shared_breaker_closed(self):
+        def down(state, user, body):
+            raise server.APIError("overloaded", 503)
+
+        app.CONFIG["retries"] = 1
+        app.BREAKER = app.CircuitBreaker(threshold=2, cooldown=60)
+        app.SESSION = app.HTTPSession()
+        watch_breaker = app.CircuitBreaker(threshold=2, cooldown=60)
+        app.WATCH_SESSION = app.HTTPSession(watch_breaker)
+        original = server.MailServer.watch
+        server.MailServer.watch = down
+        try:
+            watcher = app.MailWatcher(hold=1)
+            for _ in range(3):
+                watcher.check()
+        finally:
+            server.MailServer.watch = original
+        self.assertEqual(watch_breaker.state, "open")
+        self.assertEqual(app.BREAKER.state, "closed")
+        ok, resp = app.send_request("/fetch_mail", {"folder": "inbox"})
+        self.assertTrue(ok, resp)
+
+
+class StoreMoveTest(ServerTestCase):
+    def _inbox_mail(self):
+        self.assertTrue(app.sync_folder("inbox"))
+        return app.STORE.page("alice", "inbox", 0, 1)[0]
+
+    def test_move_into_partial_folder_only_removes(self):
+        mail = self._inbox_mail()
+        app.STORE.set_state("alice", "deleted", 0, None, False)
+        app.store_mail_deleted("inbox", mail.id)
+        self.assertIsNone(app.STORE.get("alice", "inbox", mail.id))
+        self.assertIsNone(app.STORE.get("alice", "deleted", mail.id))
+        self.assertEqual(app.STORE.count("alice", "deleted"), 0)
+
+    def test_move_into_complete_folder_keeps_row(self):
+        mail = self._inbox_mail()
+        app.STORE.set_state("alice", "deleted", 0, None, True)
+        app.store_mail_deleted("inbox", mail.id)
+        self.assertIsNone(app.STORE.get("alice", "inbox", mail.id))
+        self.assertEqual(app.STORE.get("alice", "deleted", mail.id).subject, "first")
+        app.STORE.set_state("alice", "inbox", 0, None, False)
+        app.store_mail_recovered(mail.id)
+        self.assertIsNone(app.STORE.get("alice", "deleted", mail.id))
+        self.assertIsNone(app.STORE.get("alice", "inbox", mail.id))
+
+
+class HeadersOnlyTest(ServerTestCase):
+    def _fetch_with(self, fetch_mail):
+        original = server.MailServer.fetch_mail
+        server.MailServer.fetch_mail = fetch_mail
+        try:
+            return app.fetch_mail_headers("inbox", 10, 0)
+        finally:
+            server.MailServer.fetch_mail = original
+
+    def test_rejected_fields_fall_back_to_full_mails(self):
+        original = server.MailServer.fetch_mail
+
+        def no_fields(state, user, body):
+            if "fields" in body:
+                raise server.APIError("unknown parameter: fields", 400)
+            return original(state, user, body)
+
+        ok, mails = self._fetch_with(no_fields)
+        self.assertTrue(ok, mails)
+        self.assertEqual(mails[0].message, "hello there")
+        self.assertIs(app.SERVER_CAPS["headers_only"], False)
+
+    def test_other_errors_keep_headers_only(self):
+        def unauthorized(state, user, body):
+            raise server.APIError("token expired", 401)
+
+        ok, resp = self._fetch_with(unauthorized)
+        self.assertFalse(ok)
+        self.assertTrue(resp.get("auth"))
+        self.assertIsNone(app.SERVER_CAPS["headers_only"])
+
+
+class PagingTest(ServerTestCase):
+    def test_page_cursors_are_bounded(self):
+        self.state.import_mails("alice", "inbox", [{"from": "bob", "subject": f"m{i}", "timestamp": i}
+                                                   for i in range(200)])
+        app.CONFIG["page_size"] = 2
+        app.PAGE_CACHE = app.PageCache(max_pages=8)
+        seen = []
+        for page in range(60):
+            ok, mails = app.fetch_page("inbox", page)
+            self.assertTrue(ok, mails)
+            seen += [m.id for m in mails]
+        self.assertTrue(app.SERVER_CAPS["cursor_paging"])
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertLessEqual(len(app.PAGE_CACHE._cursors), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
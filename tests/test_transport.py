@@ -0,0 +1,188 @@
+# transport.py against canned replies, no server. Run: python -m unittest discover tests
+import os
+import sys
+import time
+import unittest
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transport
+
+
+class CannedTransport(transport.Transport):
+    # every request goes to `handler` (an httpx.Request -> httpx.Response function)
+    def __init__(self, handler, **kwargs):
+        kwargs.setdefault("retry", transport.RetryPolicy(attempts=3, backoff=0, max_backoff=0))
+        super().__init__("http://omx.test", **kwargs)
+        self.handler = handler
+        self.seen = []
+
+    def _client_kwargs(self):
+        def handle(request):
+            self.seen.append(request)
+            return self.handler(request)
+
+        return dict(super()._client_kwargs(), transport=httpx.MockTransport(handle))
+
+
+BIG = {"message": "x" * (2 * transport.COMPRESS_MIN_BYTES)}
+
+
+class GzipRejectionTest(unittest.TestCase):
+    def _post(self, status, error):
+        def handler(request):
+            if request.headers.get("Content-Encoding") == "gzip":
+                return httpx.Response(status, json={"ok": False, "error": error})
+            return httpx.Response(200, json={"ok": True})
+
+        caps = {"request_gzip": None}
+        t = CannedTransport(handler, caps=caps)
+        r = t.request("POST", "/send", BIG)
+        return t, caps, r
+
+    def test_415_disables_gzip(self):
+        t, caps, r = self._post(415, "unsupported media type")
+        self.assertEqual(r.status_code, 200)
+        self.assertIs(caps["request_gzip"], False)
+        self.assertEqual(len(t.seen), 2)
+
+    def test_400_naming_encoding_disables_gzip(self):
+        t, caps, r = self._post(400, "unsupported Content-Encoding: gzip")
+        self.assertEqual(r.status_code, 200)
+        self.assertIs(caps["request_gzip"], False)
+
+    def test_other_400_is_passed_through(self):
+        t, caps, r = self._post(400, "no recipients")
+        self.assertEqual(r.status_code, 400)
+        self.assertIsNone(caps["request_gzip"])
+        self.assertEqual(len(t.seen), 1)
+
+    def test_accepted_gzip_is_remembered(self):
+        t, caps, r = self._post(200, None)
+        self.assertIs(caps["request_gzip"], True)
+
+
+def _reply(status, retry_after=None):
+    headers = {} if retry_after is None else {"Retry-After": retry_after}
+    return httpx.Response(status, headers=headers, json={"ok": status < 400})
+
+
+class RetryPolicyTest(unittest.TestCase):
+    policy = transport.RetryPolicy(attempts=3, max_retry_after=30)
+
+    def test_5xx_only_retried_when_idempotent(self):
+        for status in (500, 502, 503, 504):
+            self.assertTrue(self.policy.retryable(True, response=_reply(status)), status)
+            self.assertFalse(self.policy.retryable(False, response=_reply(status)), status)
+        self.assertFalse(self.policy.retryable(True, response=_reply(501)))
+        self.assertFalse(self.policy.retryable(True, response=_reply(404)))
+
+    def test_retry_after_means_not_processed(self):
+        # 429/503 with Retry-After: the server did not act on it, so even a POST may be resent
+        self.assertTrue(self.policy.retryable(False, response=_reply(503, "2")))
+        self.assertTrue(self.policy.retryable(False, response=_reply(429, "0")))
+        self.assertFalse(self.policy.retryable(False, response=_reply(500, "2")))
+        # longer than we are willing to wait: reported instead
+        self.assertFalse(self.policy.retryable(True, response=_reply(503, "120")))
+        self.assertEqual(self.policy.delay(0, _reply(503, "2")), 2)
+
+    def test_connect_errors_always_retried(self):
+        error = httpx.ConnectError("refused")
+        self.assertTrue(self.policy.retryable(False, error=error))
+        self.assertTrue(self.policy.retryable(True, error=error))
+
+    def test_timeouts_never_retried(self):
+        for error in (httpx.ReadTimeout("slow"), httpx.ConnectTimeout("slow")):
+            self.assertFalse(self.policy.retryable(True, error=error))
+            self.assertFalse(self.policy.retryable(False, error=error))
+
+    def test_dropped_connection_only_retried_when_idempotent(self):
+        error = httpx.RemoteProtocolError("server disconnected")
+        self.assertTrue(self.policy.retryable(True, error=error))
+        self.assertFalse(self.policy.retryable(False, error=error))
+
+    def test_retries_reuse_idempotency_key(self):
+        replies = iter([_reply(503, "0"), _reply(503, "0"), _reply(200)])
+        t = CannedTransport(lambda request: next(replies))
+        r = t.request("POST", "/send", {"to": ["bob"]})
+        self.assertEqual(r.status_code, 200)
+        keys = {request.headers["Idempotency-Key"] for request in t.seen}
+        self.assertEqual(len(t.seen), 3)
+        self.assertEqual(len(keys), 1)
+
+    def test_post_5xx_returned_without_retry(self):
+        t = CannedTransport(lambda request: _reply(502))
+        self.assertEqual(t.request("POST", "/send", {"to": ["bob"]}).status_code, 502)
+        self.assertEqual(len(t.seen), 1)
+        t = CannedTransport(lambda request: _reply(502))
+        self.assertEqual(t.request("GET", "/attachment").status_code, 502)
+        self.assertEqual(len(t.seen), 3)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def _opened(self, cooldown=0.05):
+        breaker = transport.CircuitBreaker(threshold=3, cooldown=cooldown)
+        for _ in range(3):
+            self.assertEqual(breaker.state, "closed")
+            breaker.before_request()
+            breaker.record_failure()
+        return breaker
+
+    def test_opens_after_threshold(self):
+        breaker = self._opened(cooldown=60)
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(transport.CircuitOpenError) as cm:
+            breaker.before_request()
+        self.assertGreater(cm.exception.retry_in, 50)
+
+    def test_success_resets_failure_count(self):
+        breaker = transport.CircuitBreaker(threshold=3, cooldown=60)
+        for _ in range(5):
+            breaker.record_failure()
+            breaker.record_failure()
+            breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_half_open_trial_closes_on_success(self):
+        breaker = self._opened()
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, "half-open")
+        breaker.before_request()
+        # only one trial at a time
+        with self.assertRaises(transport.CircuitOpenError):
+            breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        breaker.before_request()
+
+    def test_failed_trial_reopens_for_longer(self):
+        breaker = self._opened()
+        time.sleep(0.06)
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertGreater(breaker.retry_in(), 0.06)
+
+    def test_abandoned_trial_lets_next_request_try(self):
+        breaker = self._opened()
+        time.sleep(0.06)
+        breaker.before_request()
+        breaker.release()
+        breaker.before_request()
+
+    def test_transport_fails_fast_when_open(self):
+        breaker = transport.CircuitBreaker(threshold=2, cooldown=60)
+        t = CannedTransport(lambda request: _reply(503), breaker=breaker,
+                            retry=transport.RetryPolicy(attempts=2, backoff=0))
+        self.assertEqual(t.request("GET", "/fetch_mail").status_code, 503)
+        self.assertEqual(breaker.state, "open")
+        seen = len(t.seen)
+        with self.assertRaises(transport.CircuitOpenError):
+            t.request("GET", "/fetch_mail")
+        self.assertEqual(len(t.seen), seen)
+
+
+if __name__ == "__main__":
+    unittest.main()
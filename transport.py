@@ -0,0 +1,543 @@
+# OMX shared HTTP transport
+# httpx is imported on first use so that importing this module (and app.py) stays cheap.
+# Used by app.py and admin.py. It owns the pooled httpx clients and decides which failures are
+# worth retrying. It honors Retry-After, attaches idempotency keys to mutating calls, and stops
+# calling a server that keeps failing (circuit breaker) so an outage fails fast.
+
+from __future__ import annotations
+import bisect
+import contextlib
+import gzip
+import importlib.util
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+COMPRESS_MIN_BYTES = 1024
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# statuses where a later attempt may succeed; anything else 4xx is the caller's fault
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# the server said "not now" and did not process the request, so even a POST may be re-sent
+NOT_PROCESSED_STATUS = {429, 503}
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of sending while the breaker is open."""
+    def __init__(self, retry_in: float):
+        super().__init__(f"server unavailable, retrying in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+def accept_encoding() -> str:
+    # httpx decodes br/zstd only when the optional packages are installed
+    encodings = []
+    if importlib.util.find_spec("zstandard") is not None:
+        encodings.append("zstd")
+    if importlib.util.find_spec("brotli") is not None or importlib.util.find_spec("brotlicffi") is not None:
+        encodings.append("br")
+    encodings += ["gzip", "deflate"]
+    return ", ".join(encodings)
+
+def new_idempotency_key() -> str:
+    return os.urandom(16).hex()
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), None if absent/invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def fmt_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+# log-spaced latency buckets, 1 ms .. ~85 s; a request costs one bisect and two additions
+LATENCY_BUCKETS = tuple(0.001 * 1.25 ** i for i in range(52))
+PERCENTILES = (50, 95, 99)
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        # upper bound of the bucket holding the p-th sample (at most 25% high)
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        out = {f"p{p}": self.percentile(p) for p in PERCENTILES}
+        out["mean"] = self.total / self.count if self.count else None
+        out["max"] = self.max if self.count else None
+        return out
+
+class _Endpoint:
+    __slots__ = ("requests", "errors", "retries", "raw_out", "wire_out", "raw_in", "wire_in", "latency", "server")
+
+    def __init__(self):
+        self.requests = self.errors = self.retries = 0
+        self.raw_out = self.wire_out = self.raw_in = self.wire_in = 0
+        self.latency = LatencyHistogram()
+        self.server = LatencyHistogram()
+
+class EndpointStats:
+    """In-process per-endpoint counters: calls, errors, retries, bytes before (raw) and after
+    (wire) compression, and two latency histograms. `latency` is what the caller waited,
+    retries and backoff included; `server` is send-to-last-byte of the final attempt, so the
+    gap between them is time spent on our side."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: dict[str, _Endpoint] = {}
+        self.started = time.time()
+
+    def _get(self, endpoint: str) -> _Endpoint:
+        e = self._endpoints.get(endpoint)
+        if e is None:
+            e = self._endpoints[endpoint] = _Endpoint()
+        return e
+
+    def observe(self, endpoint: str, latency: float, server: Optional[float] = None,
+                retries: int = 0, error: bool = False) -> None:
+        with self._lock:
+            e = self._get(endpoint)
+            e.requests += 1
+            e.retries += retries
+            e.errors += bool(error)
+            e.latency.add(latency)
+            if server is not None:
+                e.server.add(server)
+
+    def record_bytes(self, endpoint: str, raw_out: int, wire_out: int, raw_in: int, wire_in: int) -> None:
+        with self._lock:
+            e = self._get(endpoint)
+            e.raw_out += raw_out
+            e.wire_out += wire_out
+            e.raw_in += raw_in
+            e.wire_in += wire_in
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {ep: {"requests": e.requests, "errors": e.errors, "retries": e.retries,
+                         "raw_out": e.raw_out, "wire_out": e.wire_out, "raw_in": e.raw_in, "wire_in": e.wire_in,
+                         "latency": e.latency.summary(), "server": e.server.summary()}
+                    for ep, e in sorted(self._endpoints.items())}
+
+    def dump(self, path: str) -> None:
+        data = {"started": self.started, "dumped": time.time(), "endpoints": self.snapshot()}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+def traffic_lines(stats: dict[str, dict], width: int = 22) -> list[str]:
+    lines = [f"{'ENDPOINT':{width}} {'REQS':>5} {'SENT raw/wire':>21} {'RECEIVED raw/wire':>21} {'SAVED':>6}"]
+    for ep, t in stats.items():
+        raw, wire = t["raw_out"] + t["raw_in"], t["wire_out"] + t["wire_in"]
+        saved = f"{(1 - wire / raw) * 100:.0f}%" if raw else "-"
+        sent = f"{fmt_bytes(t['raw_out'])}/{fmt_bytes(t['wire_out'])}"
+        recv = f"{fmt_bytes(t['raw_in'])}/{fmt_bytes(t['wire_in'])}"
+        lines.append(f"{ep:{width}} {t['requests']:>5} {sent:>21} {recv:>21} {saved:>6}")
+    return lines
+
+def _ms(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+def latency_lines(stats: dict[str, dict], width: int = 22) -> list[str]:
+    lines = [f"{'ENDPOINT':{width}} {'REQS':>5} {'ERR':>4} {'RETRY':>5}  {'TOTAL p50/p95/p99 ms':>20}  {'SERVER p50/p95/p99 ms':>21}"]
+    for ep, t in stats.items():
+        total = "/".join(_ms(t["latency"][f"p{p}"]) for p in PERCENTILES)
+        server = "/".join(_ms(t["server"][f"p{p}"]) for p in PERCENTILES)
+        lines.append(f"{ep:{width}} {t['requests']:>5} {t['errors']:>4} {t['retries']:>5}  {total:>20}  {server:>21}")
+    return lines
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures; after the cool-down one trial
+    request is let through (half-open) and its outcome closes or re-opens the circuit."""
+    def __init__(self, threshold: int = 5, cooldown: float = 10.0, max_cooldown: float = 120.0):
+        self.threshold = max(1, int(threshold))
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._cooldown = cooldown
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or time.monotonic() - self._opened_at >= self._cooldown:
+                return "half-open"
+            return "open"
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self._cooldown - time.monotonic())
+
+    def before_request(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            wait = self._opened_at + self._cooldown - time.monotonic()
+            if wait > 0 or self._trial:
+                raise CircuitOpenError(max(wait, 0.0))
+            self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._cooldown = self.base_cooldown
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial:
+                # the trial failed: stay open, and wait longer next time
+                self._cooldown = min(self.max_cooldown, self._cooldown * 2)
+                self._opened_at = time.monotonic()
+                self._trial = False
+            elif self._opened_at is None and self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        # the trial was abandoned without an answer; let the next request try instead
+        with self._lock:
+            self._trial = False
+
+    def reset(self) -> None:
+        self.record_success()
+
+class RetryPolicy:
+    def __init__(self, attempts: int = 3, backoff: float = 0.4, max_backoff: float = 8.0,
+                 max_retry_after: float = 30.0):
+        self.attempts = max(1, int(attempts))
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.max_retry_after = float(max_retry_after)
+
+    def retryable(self, idempotent: bool, response: Optional[httpx.Response] = None,
+                  error: Optional[Exception] = None) -> bool:
+        import httpx
+        if error is not None:
+            # a timed-out attempt has already used the whole time budget; another one rarely helps
+            if isinstance(error, (CircuitOpenError, httpx.TimeoutException)):
+                return False
+            # never left this machine: safe to resend whatever the method
+            if isinstance(error, httpx.ConnectError):
+                return True
+            # read/write timeouts and dropped connections may have been processed already
+            return idempotent and isinstance(error, httpx.TransportError)
+        if response is None or response.status_code not in RETRYABLE_STATUS:
+            return False
+        if response.status_code in NOT_PROCESSED_STATUS and "Retry-After" in response.headers:
+            wait = parse_retry_after(response.headers.get("Retry-After"))
+            return wait is not None and wait <= self.max_retry_after
+        return idempotent
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            wait = parse_retry_after(response.headers.get("Retry-After"))
+            if wait is not None:
+                return min(wait, self.max_retry_after)
+        # full jitter keeps many clients from retrying in lock-step
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+def _breaker_failure(response: Optional[httpx.Response], error: Optional[BaseException]) -> bool:
+    # only "the server is not answering properly" counts; 4xx and 429 mean it is alive
+    if error is not None:
+        return not isinstance(error, CircuitOpenError)
+    return response is not None and response.status_code >= 500 and response.status_code != 501
+
+def _names_encoding(r: httpx.Response) -> bool:
+    # a 400 that blames the body's encoding rather than its content
+    import httpx
+    try:
+        text = r.text
+    except httpx.ResponseNotRead:
+        # a streamed reply (only the blocking transport streams); error bodies are small
+        r.read()
+        text = r.text
+    text = text.lower()
+    return "encoding" in text or "gzip" in text
+
+def _timeout_kwargs(timeout: Optional[float]) -> dict:
+    return {} if timeout is None else {"timeout": timeout}
+
+class _TransportBase:
+    def __init__(self, base_url: str, timeout: float = 8, limits: Optional[httpx.Limits] = None,
+                 http2: bool = False, retry: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None, stats: Optional[EndpointStats] = None,
+                 caps: Optional[dict] = None, compress: bool = True):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limits = limits
+        self.http2 = http2
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = stats or EndpointStats()
+        # shared with the caller so sync and async transports learn server capabilities once
+        self.caps = caps if caps is not None else {}
+        self.caps.setdefault("request_gzip", None)
+        self.compress = compress
+
+    def _client_kwargs(self) -> dict:
+        import httpx
+        return {"base_url": self.base_url, "timeout": self.timeout, "limits": self.limits or httpx.Limits(),
+                "http2": self.http2, "headers": {"Accept-Encoding": accept_encoding()}}
+
+    def encode(self, payload, compress: bool = True) -> tuple[bytes, dict, int]:
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            # file data: sent as is, it is rarely worth compressing
+            return bytes(payload), {"Content-Type": "application/octet-stream"}, len(payload)
+        raw = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json"}
+        if (compress and self.compress and len(raw) >= COMPRESS_MIN_BYTES
+                and self.caps.get("request_gzip") is not False):
+            headers["Content-Encoding"] = "gzip"
+            return gzip.compress(raw, 6), headers, len(raw)
+        return raw, headers, len(raw)
+
+    def _gzip_rejected(self, r: httpx.Response, body_headers: dict) -> bool:
+        # the first gzip upload the server accepts, or rejects for its encoding, decides whether
+        # it understands Content-Encoding; any other error leaves the question open
+        if "Content-Encoding" not in body_headers or self.caps.get("request_gzip") is not None:
+            return False
+        if r.status_code == 415 or (r.status_code == 400 and _names_encoding(r)):
+            self.caps["request_gzip"] = False
+            return True
+        if r.status_code < 400:
+            self.caps["request_gzip"] = True
+        return False
+
+    def _prepare(self, method: str, headers: Optional[dict], idempotent: Optional[bool]):
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        headers = dict(headers or {})
+        if not idempotent and not any(k.lower() == "idempotency-key" for k in headers):
+            # one key per logical call, reused by every retry of it
+            headers["Idempotency-Key"] = new_idempotency_key()
+        return method, idempotent, headers
+
+    def _body(self, payload, headers: dict, compress: bool) -> tuple[bytes, dict, int]:
+        if payload is None:
+            return b"", headers, 0
+        body, body_headers, raw_len = self.encode(payload, compress)
+        return body, {**headers, **body_headers}, raw_len
+
+    def _observe(self, path: str, r: httpx.Response, retries: int, started: float) -> None:
+        try:
+            server = r.elapsed.total_seconds()
+        except RuntimeError:
+            server = None
+        self.stats.observe(path, time.perf_counter() - started, server, retries, r.status_code >= 400)
+
+    def _settle(self, response: Optional[httpx.Response], error: Optional[BaseException]) -> None:
+        import httpx
+        if response is None and not isinstance(error, httpx.TransportError):
+            # interrupted (Ctrl-C, cancellation): says nothing about the server
+            self.breaker.release()
+        elif _breaker_failure(response, error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+class Transport(_TransportBase):
+    """Blocking transport around one pooled httpx.Client."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+    def client(self) -> httpx.Client:
+        import httpx
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._client_kwargs())
+            return self._client
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                try:
+                    self._client.close()
+                except Exception:
+                    pass
+                self._client = None
+
+    def _send(self, method, path, body, headers, params, stream, timeout):
+        self.breaker.before_request()
+        client = self.client()
+        request = client.build_request(method, path, content=body or None, headers=headers, params=params,
+                                       **_timeout_kwargs(timeout))
+        try:
+            r = client.send(request, stream=stream)
+        except BaseException as e:
+            self._settle(None, e)
+            raise
+        self._settle(r, None)
+        return r
+
+    def _attempts(self, method, path, payload, headers, params, idempotent, compress, stream, timeout):
+        import httpx
+        started = time.perf_counter()
+        method, idempotent, headers = self._prepare(method, headers, idempotent)
+        body, all_headers, raw_len = self._body(payload, headers, compress)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    r = self._send(method, path, body, all_headers, params, stream, timeout)
+                except httpx.TransportError as e:
+                    if attempt + 1 >= self.retry.attempts or not self.retry.retryable(idempotent, error=e):
+                        raise
+                    time.sleep(self.retry.delay(attempt))
+                    attempt += 1
+                    continue
+                if self._gzip_rejected(r, all_headers):
+                    r.close()
+                    body, all_headers, raw_len = self._body(payload, headers, compress=False)
+                    continue
+                if attempt + 1 < self.retry.attempts and self.retry.retryable(idempotent, response=r):
+                    r.close()
+                    time.sleep(self.retry.delay(attempt, r))
+                    attempt += 1
+                    continue
+                return r, body, raw_len, attempt, started
+        except BaseException:
+            self.stats.observe(path, time.perf_counter() - started, retries=attempt, error=True)
+            raise
+
+    def request(self, method: str, path: str, payload=None, *, headers: Optional[dict] = None,
+                params: Optional[dict] = None, idempotent: Optional[bool] = None,
+                compress: bool = True, timeout: Optional[float] = None) -> httpx.Response:
+        """Send with retries; returns the final response (any status) or raises httpx.TransportError.
+        `timeout` overrides the client default for this call only (e.g. long-polls)."""
+        r, body, raw_len, retries, started = self._attempts(
+            method, path, payload, headers, params, idempotent, compress, False, timeout)
+        self.stats.record_bytes(path, raw_len, len(body), len(r.content), r.num_bytes_downloaded)
+        self._observe(path, r, retries, started)
+        return r
+
+    @contextlib.contextmanager
+    def stream(self, method: str, path: str, payload=None, *, headers: Optional[dict] = None,
+               params: Optional[dict] = None, idempotent: Optional[bool] = None,
+               timeout: Optional[float] = None):
+        """Like request() but the body is left unread and sent uncompressed; retries stop once
+        headers have arrived. The caller records bytes (record_bytes) after consuming the body."""
+        r, _, _, retries, started = self._attempts(method, path, payload, headers, params, idempotent, False, True,
+                                                    timeout)
+        try:
+            yield r
+        finally:
+            r.close()
+            self._observe(path, r, retries, started)
+
+class AsyncTransport(_TransportBase):
+    """Same policy around one httpx.AsyncClient; use from a single event loop."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def client(self) -> httpx.AsyncClient:
+        import httpx
+        if self._client is None:
+            self._client = httpx.AsyncClient(**self._client_kwargs())
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            try:
+                await self._client.aclose()
+            except Exception:
+                pass
+            self._client = None
+
+    async def _send(self, method, path, body, headers, params, timeout):
+        self.breaker.before_request()
+        client = self.client()
+        request = client.build_request(method, path, content=body or None, headers=headers, params=params,
+                                       **_timeout_kwargs(timeout))
+        try:
+            r = await client.send(request)
+        except BaseException as e:
+            self._settle(None, e)
+            raise
+        self._settle(r, None)
+        return r
+
+    async def request(self, method: str, path: str, payload=None, *, headers: Optional[dict] = None,
+                      params: Optional[dict] = None, idempotent: Optional[bool] = None,
+                      compress: bool = True, timeout: Optional[float] = None) -> httpx.Response:
+        import asyncio
+        import httpx
+        started = time.perf_counter()
+        method, idempotent, headers = self._prepare(method, headers, idempotent)
+        body, all_headers, raw_len = self._body(payload, headers, compress)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    r = await self._send(method, path, body, all_headers, params, timeout)
+                except httpx.TransportError as e:
+                    if attempt + 1 >= self.retry.attempts or not self.retry.retryable(idempotent, error=e):
+                        raise
+                    await asyncio.sleep(self.retry.delay(attempt))
+                    attempt += 1
+                    continue
+                if self._gzip_rejected(r, all_headers):
+                    body, all_headers, raw_len = self._body(payload, headers, compress=False)
+                    continue
+                if attempt + 1 < self.retry.attempts and self.retry.retryable(idempotent, response=r):
+                    await asyncio.sleep(self.retry.delay(attempt, r))
+                    attempt += 1
+                    continue
+                break
+        except BaseException:
+            # includes cancellation by the caller's own timeout
+            self.stats.observe(path, time.perf_counter() - started, retries=attempt, error=True)
+            raise
+        self.stats.record_bytes(path, raw_len, len(body), len(r.content), r.num_bytes_downloaded)
+        self._observe(path, r, attempt, started)
+        return r